@@ -0,0 +1,77 @@
+"""
+Memory benchmark for the order working set: 100k orders held as the JSON-loaded
+dicts order_storage.json used to produce, versus Order objects (slots plus
+interned repeated values) built from the same file.
+
+Run with: python benchmarks/bench_order_memory.py [orders]
+"""
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+from sandbox import import_bot
+
+Order = import_bot().Order
+
+SERVICES = [('5', 'DANA'), ('12', 'OVO'), ('17', 'GoPay'), ('23', 'ShopeePay')]
+USERS = ['123456789', '987654321', '555000111']
+STATUSES = ['PENDING', 'SUCCESS', 'CANCEL']
+
+
+def storage_json(count: int) -> str:
+    """order_storage.json contents in the legacy format, parsed fresh like a restart"""
+    orders = {}
+    for i in range(count):
+        service_id, service_name = SERVICES[i % len(SERVICES)]
+        orders[str(10_000_000 + i)] = {
+            'service_id': service_id,
+            'service_name': service_name,
+            'phone_number': f"62812{i:08d}",
+            'price': round(0.12 + (i % 50) * 0.001, 5),
+            'order_time': f"2026-10-19 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+            'user_id': USERS[i % len(USERS)],
+            'status': STATUSES[i % len(STATUSES)],
+            'chat_id': int(USERS[i % len(USERS)]),
+            'message_id': 1000 + i,
+        }
+    return json.dumps(orders)
+
+
+def load_dicts(text: str) -> dict:
+    return json.loads(text)
+
+
+def load_orders(text: str) -> dict:
+    return {order_id: Order.from_dict(order_id, data) for order_id, data in json.loads(text).items()}
+
+
+def measure(loader, text: str):
+    """Held and peak bytes under tracemalloc, then load time in a separate untraced run"""
+    gc.collect()
+    tracemalloc.start()
+    storage = loader(text)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    loaded = len(storage)
+    del storage
+    gc.collect()
+    started = time.perf_counter()
+    loader(text)
+    return loaded, current, peak, time.perf_counter() - started
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    text = storage_json(count)
+    print(f"{count} orders, {len(text) / 1e6:.1f} MB of JSON")
+    for name, loader in (('dict', load_dicts), ('Order', load_orders)):
+        loaded, current, peak, elapsed = measure(loader, text)
+        print(f"{name:6} {current / 1e6:7.1f} MB held  {current / loaded:6.0f} B/order  "
+              f"peak {peak / 1e6:7.1f} MB  load {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
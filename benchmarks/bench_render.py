@@ -0,0 +1,42 @@
+"""
+Microbenchmark for the order message renderer: cost of one render_order_view()
+plus order_keyboard() call per view, the work done on every auto-update tick.
+
+Run with: python benchmarks/bench_render.py [iterations]
+"""
+import sys
+import timeit
+
+from sandbox import import_bot
+
+bot = import_bot()
+
+SMS_DATA = [{'sms': '111', 'fullSms': 'Your code is 111 '}, {'fullSms': 'abc'}]
+
+CASES = {
+    'pending': ('PENDING', []),
+    'sms': ('PENDING', SMS_DATA),
+    'success': ('SUCCESS', SMS_DATA),
+    'cancelled': ('CANCEL', []),
+}
+
+
+def render(view: str, order_status: str, sms_data) -> None:
+    bot.render_order_view(
+        bot.order_view_state(order_status, sms_data), view, '9901', 'DANA', order_status,
+        '6281234', '081234', '$0.12000', '2025-01-01 00:00:00', sms_data=sms_data,
+        reason="Dibatalkan otomatis", stamp="03:04:05"
+    )
+    bot.order_keyboard(bot.order_keyboard_kind(order_status), '9901', '17')
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for view in ('monitor', 'manual'):
+        for name, (order_status, sms_data) in CASES.items():
+            seconds = timeit.timeit(lambda: render(view, order_status, sms_data), number=iterations)
+            print(f"{view:8} {name:10} {seconds / iterations * 1e6:7.2f} us/render")
+
+
+if __name__ == "__main__":
+    main()
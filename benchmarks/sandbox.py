@@ -0,0 +1,35 @@
+"""
+Import telefix_enhanced for a benchmark without touching the checkout: placeholder
+credentials, a throwaway working directory for the files it creates, and the log
+listener stopped on exit.
+"""
+import atexit
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_bot():
+    """The telefix_enhanced module, imported inside a temporary working directory"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("SMSVIRTUAL_API_KEY", "bench-api-key")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench-token")
+    os.environ.setdefault("AUTHORIZED_IDS", "1")
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="telefix-bench-")
+    os.chdir(workdir)
+    bot = importlib.import_module("telefix_enhanced")
+
+    def cleanup():
+        bot.log_listener.stop()
+        bot.file_handler.close()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    atexit.register(cleanup)
+    return bot
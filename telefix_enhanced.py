@@ -1,13 +1,16 @@
-from typing import Dict
+from typing import Dict, NamedTuple, Optional
 import requests
 import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, CallbackContext, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, SimpleUpdateProcessor, filters
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
 import json
 import os
 from dotenv import load_dotenv
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
 import colorlog
 import asyncio
 import aiohttp
@@ -16,9 +19,23 @@ import sys
 import time
 import io
 import ssl
-from threading import Thread
-from flask import Flask, jsonify
+from threading import Lock, Thread
+from flask import Flask, jsonify, request
 import concurrent.futures
+import functools
+import hmac
+import random
+import shutil
+import tempfile
+import contextvars
+from collections import OrderedDict, deque
+from array import array
+import bisect
+import sqlite3
+import csv
+import gzip
+import glob
+import re
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
@@ -26,11 +43,72 @@ ssl._create_default_https_context = ssl._create_unverified_context
 load_dotenv()
 API_KEY = os.getenv("SMSVIRTUAL_API_KEY")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-AUTHORIZED_IDS = set(os.getenv("AUTHORIZED_IDS", "").split(","))
-ADMIN_IDS = set(os.getenv("ADMIN_IDS", "").split(","))
+# Seed values only; the authorization store is the source of truth at runtime
+AUTHORIZED_IDS = set(filter(None, os.getenv("AUTHORIZED_IDS", "").split(",")))
+ADMIN_IDS = set(filter(None, os.getenv("ADMIN_IDS", "").split(",")))
 PORT = int(os.getenv("PORT", 5000))
+SLOW_HANDLER_MS = float(os.getenv("SLOW_HANDLER_MS", 2000))
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 64))
+MAX_UPDATES_PER_USER = int(os.getenv("MAX_UPDATES_PER_USER", 2))
+MAX_QUEUED_PER_USER = int(os.getenv("MAX_QUEUED_PER_USER", 10))
+EWALLET_CACHE_TTL = int(os.getenv("EWALLET_CACHE_TTL", 6 * 3600))
+EWALLET_CACHE_SIZE = int(os.getenv("EWALLET_CACHE_SIZE", 5000))
+# "1" also validates OVO/GoPay/LinkAja numbers while ordering; by default only DANA is checked
+EWALLET_VALIDATE_ALL = os.getenv("EWALLET_VALIDATE_ALL", "0") == "1"
+EWALLET_CACHE_FILE = os.getenv("EWALLET_CACHE_FILE", "ewallet_cache.json")
+REGISTERED_INDEX_FILE = os.getenv(
+    "REGISTERED_INDEX_FILE", "registered_numbers.json")
+ORDER_PRICE_CAP = float(os.getenv("ORDER_PRICE_CAP", 0))  # 0 = no cap
+PRICE_TIER_MIN_SUCCESS = float(os.getenv("PRICE_TIER_MIN_SUCCESS", 0.5))
+PRICE_TIER_STATS_FILE = os.getenv(
+    "PRICE_TIER_STATS_FILE", "price_tier_stats.json")
+PRICE_REFRESH_INTERVAL = int(os.getenv("PRICE_REFRESH_INTERVAL", 60))
+PRICE_REFRESH_CONCURRENCY = int(os.getenv("PRICE_REFRESH_CONCURRENCY", 4))
+PRICE_MAX_AGE = int(os.getenv("PRICE_MAX_AGE", 2 * PRICE_REFRESH_INTERVAL))
+ORDER_RATE_LIMIT = float(os.getenv("ORDER_RATE_LIMIT", 5))  # Order POSTs per second, 0 = unlimited
+ORDER_RATE_BURST = int(os.getenv("ORDER_RATE_BURST", 5))
+BULK_ORDER_CONCURRENCY = int(os.getenv("BULK_ORDER_CONCURRENCY", 5))
+BULK_ORDER_MAX = int(os.getenv("BULK_ORDER_MAX", 50))
+BULK_SPEND_CAP = float(os.getenv("BULK_SPEND_CAP", 0))  # USD per bulk run, 0 = no cap
+CANCEL_MIN_HOLD = int(os.getenv("CANCEL_MIN_HOLD", 130))  # Provider refuses cancellation before this
+CANCEL_SAFETY_MARGIN = int(os.getenv("CANCEL_SAFETY_MARGIN", 60))
+NO_SMS_FALLBACK_TIMEOUT = int(os.getenv("NO_SMS_FALLBACK_TIMEOUT", 600))
+SMS_LATENCY_FILE = os.getenv("SMS_LATENCY_FILE", "sms_latency.json")
+# "service_id:silence_seconds,..." - services whose silent orders are replaced automatically
+AUTO_REORDER_SILENCE = int(os.getenv("AUTO_REORDER_SILENCE", 180))
+AUTO_REORDER_SERVICES = {
+    sid.strip(): int(silence) if silence.strip().isdigit() else AUTO_REORDER_SILENCE
+    for sid, _, silence in (item.partition(":") for item in os.getenv("AUTO_REORDER_SERVICES", "").split(","))
+    if sid.strip()
+}
+AUTO_REORDER_MAX = int(os.getenv("AUTO_REORDER_MAX", 3))  # Replacements per original order
+ORDER_ARCHIVE_FILE = os.getenv("ORDER_ARCHIVE_FILE", "order_archive.db")
+ORDER_RECENT_SECONDS = int(os.getenv("ORDER_RECENT_SECONDS", 3600))  # Closed orders kept in memory
+ORDER_STALE_SECONDS = int(os.getenv("ORDER_STALE_SECONDS", 86400))  # Older orders are archived regardless
+ORDER_EVENTS_FILE = os.getenv("ORDER_EVENTS_FILE", "order_events.db")
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", 2))
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", 200))  # Buffered events that force a flush
+ANALYTICS_FILE = os.getenv("ANALYTICS_FILE", "order_analytics.json")
+ANALYTICS_DAYS = int(os.getenv("ANALYTICS_DAYS", 90))  # Daily aggregates kept
+STATS_MAX_SERVICES = 15  # Services listed in one /stats message
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")  # X-Stats-Token for the HTTP /stats route, empty = disabled
+EXPORT_PART_BYTES = int(os.getenv("EXPORT_PART_BYTES", 20 * 1024 * 1024))  # Compressed size per /export file
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "log_archive")
+LOG_BLOCK_BYTES = int(os.getenv("LOG_BLOCK_BYTES", 64 * 1024))  # Uncompressed bytes per gzip member
+ORDER_LOG_SEGMENT_BYTES = int(os.getenv("ORDER_LOG_SEGMENT_BYTES", 10 * 1024 * 1024))
+ORDER_LOG_HEADER = "timestamp,user_id,order_id,service_id,service_name,phone_number,price,status,sms_content"
+TRACE_MAX_LINES = 400  # Lines returned by one /trace
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # "json" for one JSON object per line
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", 5))  # Identical lines (below CRITICAL) per window, 0 = unlimited
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", 60))
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 120))
+RECONCILE_GRACE = int(os.getenv("RECONCILE_GRACE", 60))  # Seconds before a fresh order may be retired
+BULK_ACTION_CONCURRENCY = int(os.getenv("BULK_ACTION_CONCURRENCY", 8))
+BULK_CANCEL_AGES = tuple(int(m) for m in os.getenv(
+    "BULK_CANCEL_AGES", "2,10").split(",") if m.strip().isdigit())
 
 USER_ID_FILE = "useridbot.txt"
+AUTH_STORE_FILE = "authorized_users.json"
 
 # Create Flask app for health check and UptimeRobot
 app = Flask(__name__)
@@ -56,12 +134,39 @@ def ping():
     return "pong"
 
 
+@app.route('/stats')
+def stats():
+    """Order analytics: /stats?days=7&service=123, requires the X-Stats-Token header"""
+    if not STATS_TOKEN:
+        return jsonify({"error": "not found"}), 404  # Telegram /stats only
+    if not hmac.compare_digest(request.headers.get('X-Stats-Token', ''), STATS_TOKEN):
+        return jsonify({"error": "unauthorized"}), 401
+    days = request.args.get('days', '7')
+    return jsonify(order_analytics.report(
+        days=max(1, int(days)) if days.isdigit() else 7,
+        service_id=request.args.get('service') or None))
+
+
 @app.route('/status')
 def status():
     return jsonify({
         "bot_status": "running",
         "active_orders": len(order_storage) if 'order_storage' in globals() else 0,
-        "monitoring_tasks": len(active_order_monitors) if 'active_order_monitors' in globals() else 0
+        "monitoring_tasks": len(active_order_monitors) if 'active_order_monitors' in globals() else 0,
+        "callback_routes": callback_router.snapshot() if 'callback_router' in globals() else {},
+        "handler_latency": handler_metrics.snapshot() if 'handler_metrics' in globals() else {},
+        "update_scheduler": update_processor.snapshot() if 'update_processor' in globals() else {},
+        "ewallet_cache": ewallet_cache.snapshot() if 'ewallet_cache' in globals() else {},
+        "registered_index": registered_index.snapshot() if 'registered_index' in globals() else {},
+        "price_snapshot": price_snapshot.snapshot() if 'price_snapshot' in globals() else {},
+        "sms_latency": sms_latency_stats.snapshot() if 'sms_latency_stats' in globals() else {},
+        "reconciliation": order_reconciler.snapshot() if 'order_reconciler' in globals() else {},
+        "order_archive": order_archive.count() if 'order_archive' in globals() else 0,
+        "lifecycle": order_lifecycle.snapshot() if 'order_lifecycle' in globals() else {},
+        "order_events": order_events.snapshot() if 'order_events' in globals() else {},
+        "log_segments": log_segments.snapshot() if 'log_segments' in globals() else {},
+        "logging": {"queued": log_queue.qsize(), "suppressed": log_rate_limiter.suppressed_total}
+        if 'log_queue' in globals() else {}
     })
 
 
@@ -81,8 +186,7 @@ if not os.path.exists(USER_ID_FILE):
         pass
 if not os.path.exists("logorder.txt"):
     with open("logorder.txt", "w", encoding='utf-8') as f:
-        f.write(
-            "timestamp,user_id,order_id,service_id,service_name,phone_number,price,status,sms_content\n")
+        f.write(ORDER_LOG_HEADER + "\n")
 
 BASE_URL = "https://api.smsvirtual.co/v1/"
 
@@ -94,15 +198,102 @@ pending_cancellations = {}  # Track orders that need to be cancelled after delay
 auto_cancel_timers = {}  # Track 10-minute auto-cancel timers for orders without SMS
 active_order_monitors = {}  # Track active order monitoring tasks
 user_cancel_requests = {}  # Track user manual cancel requests
+ewallet_validations = {}  # Track background e-wallet validation tasks
+bulk_orders = {}  # Track running /bulkorder jobs per user
 
 # Order storage functions
 
 
+def atomic_write_json(path: str, payload) -> None:
+    """Write JSON to a temp file in the same directory and rename it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Order:
+    """
+    One order: identity, pricing, both phone formats, message location, provider expiry
+    and the last SMS list. Unknown fields are None rather than 'N/A' strings. Slots plus
+    interned repeated values (service, user, status) keep each order far smaller than a
+    JSON-loaded dict with its own copy of every key and value.
+    """
+
+    __slots__ = ('order_id', 'service_id', 'service_name', 'phone_number', 'price',
+                 'placed_at', 'user_id', 'status', 'closed_at', 'chat_id', 'message_id',
+                 'expires_at', 'sms')
+
+    # Persisted fields; 'order_time' is written as text for files from older versions
+    FIELDS = ('service_id', 'service_name', 'phone_number', 'price', 'user_id', 'status',
+              'closed_at', 'chat_id', 'message_id', 'expires_at')
+
+    def __init__(self, order_id, service_id=None, service_name=None, phone_number=None, price=None,
+                 placed_at=None, user_id=None, status=None, closed_at=None, chat_id=None,
+                 message_id=None, expires_at=None):
+        self.order_id = str(order_id)
+        self.service_id = _intern(service_id)
+        self.service_name = _intern(service_name)
+        self.phone_number = phone_number
+        self.price = price
+        self.placed_at = placed_at
+        self.user_id = _intern(user_id)
+        self.status = _intern(status)
+        self.closed_at = closed_at
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.expires_at = expires_at
+        self.sms = ()
+
+    @property
+    def phone62(self):
+        """Local 08xx format of phone_number"""
+        phone_number = self.phone_number
+        return phone_number.replace(
+            "62", "0") if phone_number and phone_number.startswith("62") else phone_number
+
+    @property
+    def order_time(self) -> str:
+        if self.placed_at is None:
+            return 'N/A'
+        return datetime.fromtimestamp(self.placed_at).strftime('%Y-%m-%d %H:%M:%S')
+
+    def to_dict(self) -> dict:
+        data = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        if self.placed_at is not None:
+            data['order_time'] = self.order_time
+        return data
+
+    @classmethod
+    def from_dict(cls, order_id, data: dict):
+        fields = {field: data[field] for field in cls.FIELDS
+                  if data.get(field) not in (None, 'N/A')}
+        try:
+            fields['placed_at'] = datetime.strptime(
+                data['order_time'], '%Y-%m-%d %H:%M:%S').timestamp()
+        except (KeyError, ValueError):
+            pass
+        return cls(order_id, **fields)
+
+
 def save_order_storage():
     """Save order storage to file"""
     try:
-        with open("order_storage.json", "w", encoding='utf-8') as f:
-            json.dump(order_storage, f, ensure_ascii=False, indent=2)
+        atomic_write_json("order_storage.json", {
+            order_id: order.to_dict() for order_id, order in order_storage.items()})
     except Exception as e:
         logger.error(f"Failed to save order storage: {str(e)}")
 
@@ -113,7 +304,8 @@ def load_order_storage():
     try:
         if os.path.exists("order_storage.json"):
             with open("order_storage.json", "r", encoding='utf-8') as f:
-                order_storage = json.load(f)
+                order_storage = {order_id: Order.from_dict(order_id, data)
+                                 for order_id, data in json.load(f).items()}
             logger.info(f"Loaded {len(order_storage)} orders from storage")
         else:
             order_storage = {}
@@ -123,32 +315,928 @@ def load_order_storage():
 
 
 def store_order_info(order_id: str, service_id: str, service_name: str, phone_number: str, price: float, user_id: str):
-    """Store order information"""
-    order_storage[order_id] = {
-        'service_id': service_id,
-        'service_name': service_name,
-        'phone_number': phone_number,
-        'price': price,
-        'order_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'user_id': user_id
-    }
+    """Store order information, keyed by the string order id like the reloaded JSON"""
+    order_storage[str(order_id)] = Order(
+        order_id, service_id=service_id, service_name=service_name, phone_number=phone_number,
+        price=None if price == 'N/A' else price, placed_at=time.time(), user_id=user_id)
     save_order_storage()
 
 
-def get_order_info(order_id: str) -> dict:
-    """Get order information"""
-    return order_storage.get(order_id, {
-        'service_id': 'N/A',
-        'service_name': 'Unknown Service',
-        'phone_number': 'N/A',
-        'price': 'N/A',
-        'order_time': 'N/A',
-        'user_id': 'N/A'
-    })
+def get_order_info(order_id: str) -> Order:
+    """Get order information from the working set, falling through to the archive"""
+    return order_storage.get(str(order_id)) or order_archive.get(order_id) or Order(order_id)
+
+
+def stored_order(order_id) -> Optional[Order]:
+    """Working-set order for an int (provider JSON) or str (callback data) order id"""
+    return order_storage.get(str(order_id))
+
+
+def mark_order_closed(order_id, status: str) -> None:
+    """Record that an order reached a terminal state so the sweep can archive it later"""
+    order = order_storage.get(str(order_id))
+    if order is None or order.closed_at:
+        return
+    order.status = status
+    order.closed_at = time.time()
+    save_order_storage()
+
+
+class OrderArchive:
+    """
+    Closed orders in SQLite keyed by order_id, plus the completion records indexed by
+    service and date. Nothing is read at startup; lookups hit the indexes on demand.
+    """
+
+    COMPLETION_COLUMNS = ('completed_at', 'user_id', 'order_id', 'service_id', 'service_name',
+                          'phone_number', 'price', 'completion_type')
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = Lock()  # The Flask status thread shares the connection
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL: export scans read alongside writes, and commits don't fsync on every finish
+            self._conn.executescript(
+                "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;"
+                "CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, closed_at REAL, data TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS completions (order_id TEXT PRIMARY KEY, completed_at REAL NOT NULL, "
+                "user_id TEXT, service_id TEXT, service_name TEXT, phone_number TEXT, price TEXT, completion_type TEXT);"
+                "CREATE INDEX IF NOT EXISTS completions_service_name ON completions (service_name, completed_at);"
+                "CREATE INDEX IF NOT EXISTS completions_service_id ON completions (service_id, completed_at);"
+                "CREATE INDEX IF NOT EXISTS completions_time ON completions (completed_at);")
+        return self._conn
+
+    def put_many(self, entries: dict) -> None:
+        with self._lock, self._db() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO orders (order_id, closed_at, data) VALUES (?, ?, ?)",
+                [(order_id, order.closed_at, json.dumps(order.to_dict())) for order_id, order in entries.items()])
+
+    def get(self, order_id):
+        try:
+            with self._lock:
+                row = self._db().execute(
+                    "SELECT data FROM orders WHERE order_id = ?", (str(order_id),)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Order archive lookup failed for {order_id}: {str(e)}")
+            return None
+        return Order.from_dict(order_id, json.loads(row[0])) if row else None
+
+    def add_completions(self, rows: list, replace: bool = True) -> int:
+        """Insert completion rows ordered as COMPLETION_COLUMNS; replace=False keeps existing ones"""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._lock, self._db() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                f"{verb} INTO completions ({', '.join(self.COMPLETION_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+            return conn.total_changes - before
+
+    def iter_completions(self, service_id: str = None, service_name: str = None, since: float = None,
+                         until: float = None, batch_size: int = 500):
+        """
+        Yield completion rows (as COMPLETION_COLUMNS) matching the service id or name in a
+        date window, oldest first, through the (service, completed_at) indexes. Rows
+        imported from selesai files only carry the name.
+        """
+        if not os.path.exists(self.path):
+            return
+        since = since if since is not None else 0
+        until = until if until is not None else float('inf')
+        columns = ', '.join(self.COMPLETION_COLUMNS)
+        if service_id or service_name:
+            # Two index range scans instead of one OR that would fall back to a table scan
+            sql = (f"SELECT {columns} FROM completions WHERE service_id = ? AND completed_at >= ? AND completed_at < ? "
+                   f"UNION ALL SELECT {columns} FROM completions WHERE service_name = ? AND (? IS NULL OR service_id IS NOT ?) "
+                   "AND completed_at >= ? AND completed_at < ? ORDER BY completed_at")
+            params = (service_id, since, until, service_name, service_id, service_id, since, until)
+        else:
+            sql = f"SELECT {columns} FROM completions WHERE completed_at >= ? AND completed_at < ? ORDER BY completed_at"
+            params = (since, until)
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        except sqlite3.Error as e:
+            logger.error(f"Completion scan failed: {str(e)}")
+        finally:
+            conn.close()
+
+    def iter_orders(self, batch_size: int = 500):
+        """
+        Yield every archived Order oldest-closed first. Uses its own read connection so
+        the shared one stays free for lookups while a consumer is suspended mid-stream.
+        """
+        if not os.path.exists(self.path):
+            return
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute("SELECT order_id, data FROM orders ORDER BY closed_at")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for order_id, data in rows:
+                    yield Order.from_dict(order_id, json.loads(data))
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        try:
+            with self._lock:
+                return self._db().execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+order_archive = OrderArchive(ORDER_ARCHIVE_FILE)
+
 
+def archive_closed_orders() -> int:
+    """
+    Move orders closed more than ORDER_RECENT_SECONDS ago (or placed more than
+    ORDER_STALE_SECONDS ago) out of order_storage into the archive
+    """
+    now = time.time()
+    moving = {}
+    for order_id, order in order_storage.items():
+        if order.closed_at is not None and order.closed_at < now - ORDER_RECENT_SECONDS:
+            moving[order_id] = order
+        elif order.placed_at is not None and order.placed_at < now - ORDER_STALE_SECONDS:
+            moving[order_id] = order
+
+    if not moving:
+        return 0
+    try:
+        order_archive.put_many(moving)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to archive orders: {str(e)}")
+        return 0
+    for order_id in moving:
+        del order_storage[order_id]
+    save_order_storage()
+    logger.info(f"📦 Archived {len(moving)} closed orders, {len(order_storage)} in working set")
+    return len(moving)
+
+
+# Append-only order lifecycle event log
+
+
+class OrderEventLog:
+    """
+    Every lifecycle transition (ordered, sms_received, resend, cancel_requested,
+    cancelled, finished, expired) as an append-only SQLite table. emit() only buffers;
+    run() writes batches off the event loop. Timestamps come from the monotonic clock
+    anchored to wall time, so they never go backwards within or across restarts.
+    """
+
+    EVENTS = ('ordered', 'sms_received', 'resend', 'cancel_requested', 'cancelled', 'finished', 'expired')
+    TERMINAL = {'SUCCESS': 'finished', 'CANCEL': 'cancelled', 'REFUND': 'expired', 'CLOSED': 'expired'}
+    ITER_BATCH = 1000  # Rows read per lock acquisition in iter_events
+
+    def __init__(self, path: str, flush_interval: float, batch_size: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+        self.listeners = []  # Called with (ts, event, order_id, service_id, user_id, data) on emit
+        self._conn = None
+        self._lock = Lock()  # Flushes run in a worker thread, queries in handlers and Flask
+        self._buffer_lock = Lock()
+        self._flushing = None
+        self._anchor = time.time() - time.monotonic()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, "
+                "event TEXT NOT NULL, order_id TEXT NOT NULL, service_id TEXT, user_id TEXT, data TEXT);"
+                "CREATE INDEX IF NOT EXISTS events_order ON events (order_id, seq);"
+                "CREATE INDEX IF NOT EXISTS events_service ON events (service_id, ts);")
+            last_ts = self._conn.execute("SELECT MAX(ts) FROM events").fetchone()[0]
+            if last_ts is not None and self.now() <= last_ts:
+                # Wall clock moved back since the last run: continue after the last event
+                self._anchor += last_ts - self.now() + 1e-3
+        return self._conn
+
+    def open(self) -> None:
+        """Open the log at startup so the clock is anchored after the last stored event"""
+        with self._lock:
+            self._db()
+
+    def now(self) -> float:
+        return self._anchor + time.monotonic()
+
+    def emit(self, event: str, order_id, service_id: str = None, user_id: str = None, **data) -> None:
+        """Buffer one event; service and user default to the stored order's"""
+        order = stored_order(order_id)
+        if order is not None:
+            service_id = service_id or order.service_id
+            user_id = user_id or order.user_id
+        ts = self.now()
+        with self._buffer_lock:
+            self.buffer.append((ts, event, str(order_id), service_id, user_id,
+                                json.dumps(data) if data else None))
+        for listener in self.listeners:
+            try:
+                listener(ts, event, str(order_id), service_id, user_id, data)
+            except Exception as e:
+                logger.error(f"Order event listener failed on {event} for {order_id}: {str(e)}")
+        if len(self.buffer) >= self.batch_size and self._flushing is None:
+            self.request_flush()
+
+    def request_flush(self) -> None:
+        try:
+            self._flushing = asyncio.get_running_loop().create_task(self.flush_async())
+        except RuntimeError:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write buffered events; safe from any thread"""
+        with self._buffer_lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return 0
+        try:
+            with self._lock, self._db() as conn:
+                conn.executemany(
+                    "INSERT INTO events (ts, event, order_id, service_id, user_id, data) VALUES (?, ?, ?, ?, ?, ?)",
+                    batch)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write {len(batch)} order events: {str(e)}")
+            with self._buffer_lock:
+                self.buffer[:0] = batch  # Keep them for the next attempt
+            return 0
+        self.written += len(batch)
+        return len(batch)
+
+    async def flush_async(self) -> int:
+        try:
+            return await asyncio.to_thread(self.flush)
+        finally:
+            self._flushing = None
+
+    async def run(self) -> None:
+        """Background job: flush the buffer every flush_interval seconds"""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                if self.buffer and self._flushing is None:
+                    self.request_flush()
+        finally:
+            self.flush()
+
+    def _query(self, sql: str, params=()):
+        """Rows of sql after flushing, so a query always sees this process's events"""
+        self.flush()
+        with self._lock:
+            return self._db().execute(sql, params).fetchall()
+
+    def for_order(self, order_id) -> list:
+        """[(ts, event, data)] for one order, oldest first"""
+        rows = self._query("SELECT ts, event, data FROM events WHERE order_id = ? ORDER BY seq",
+                           (str(order_id),))
+        return [(ts, event, json.loads(data) if data else {}) for ts, event, data in rows]
+
+    def for_service(self, service_id: str, since: float = 0, until: float = None, event: str = None) -> list:
+        """[(ts, event, order_id, data)] for one service in a time window"""
+        sql = "SELECT ts, event, order_id, data FROM events WHERE service_id = ? AND ts >= ? AND ts < ?"
+        params = [str(service_id), since, until if until is not None else float('inf')]
+        if event:
+            sql += " AND event = ?"
+            params.append(event)
+        rows = self._query(sql + " ORDER BY ts", params)
+        return [(ts, ev, order_id, json.loads(data) if data else {}) for ts, ev, order_id, data in rows]
+
+    @staticmethod
+    def apply(state: dict, ts: float, event: str, order_id: str, service_id: str, user_id: str, data: dict) -> dict:
+        """Fold one event into the per-order state dict"""
+        order = state.get(order_id)
+        if order is None:
+            order = state[order_id] = {'service_id': service_id, 'user_id': user_id, 'status': None,
+                                       'placed_at': None, 'first_sms_at': None, 'sms_count': 0,
+                                       'resends': 0, 'cancel_requested_at': None, 'closed_at': None}
+        if event == 'ordered':
+            order['placed_at'] = ts
+            order['status'] = 'PENDING'
+            order['price'] = data.get('price')
+        elif event == 'sms_received':
+            order['first_sms_at'] = order['first_sms_at'] or ts
+            order['sms_count'] = data.get('sms_count', order['sms_count'] + 1)
+        elif event == 'resend':
+            order['resends'] += 1
+        elif event == 'cancel_requested':
+            order['cancel_requested_at'] = order['cancel_requested_at'] or ts
+        elif event in ('cancelled', 'finished', 'expired'):
+            order['status'] = data.get('status', event)
+            order['closed_at'] = ts
+        return order
+
+    def iter_events(self, order_ids=None, since: float = 0):
+        """
+        Yield (ts, event, order_id, service_id, user_id, data) in log order. Rows are read
+        in ITER_BATCH pages keyed on seq, holding the lock only while a page is fetched,
+        so flushes and other queries are not blocked for as long as the consumer iterates.
+        """
+        self.flush()
+        sql = "SELECT seq, ts, event, order_id, service_id, user_id, data FROM events WHERE seq > ? AND ts >= ?"
+        params = [since]
+        if order_ids is not None:
+            order_ids = [str(order_id) for order_id in order_ids]
+            sql += f" AND order_id IN ({','.join('?' * len(order_ids))})"
+            params += order_ids
+        sql += f" ORDER BY seq LIMIT {int(self.ITER_BATCH)}"
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._db().execute(sql, [last_seq, *params]).fetchall()
+            for seq, ts, event, order_id, service_id, user_id, data in rows:
+                yield ts, event, order_id, service_id, user_id, json.loads(data) if data else {}
+            if len(rows) < self.ITER_BATCH:
+                return
+            last_seq = rows[-1][0]
+
+    def replay(self, order_ids=None, since: float = 0) -> dict:
+        """Rebuild {order_id: state} from the log, optionally for some orders only"""
+        state = {}
+        for row in self.iter_events(order_ids, since):
+            self.apply(state, *row)
+        return state
+
+    def snapshot(self) -> dict:
+        return {'buffered': len(self.buffer), 'written': self.written}
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+order_events = OrderEventLog(ORDER_EVENTS_FILE, EVENT_FLUSH_INTERVAL, EVENT_BATCH_SIZE)
+
+# Per-service, per-day order analytics maintained from the event stream
+
+
+class OrderAnalytics:
+    """
+    Daily counters per service (orders, outcomes, spend) plus a fixed-bucket histogram
+    of time-to-first-SMS, updated on every order event. Queries only add up the
+    requested days; history is never rescanned.
+    """
+
+    LATENCY_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300, 450, 600, 900, 1200)
+    OUTCOMES = ('finished', 'cancelled', 'expired')
+
+    def __init__(self, path: str = None, keep_days: int = 90):
+        self.path = path
+        self.keep_days = keep_days
+        self.days = {}  # {'YYYY-MM-DD': {service_id: counters}}
+        self._lock = Lock()  # /stats is also served from the Flask thread
+        self._dirty = False
+        self._last_save = 0.0
+
+    def new_counters(self) -> dict:
+        return {'orders': 0, 'finished': 0, 'cancelled': 0, 'expired': 0, 'spend': 0.0,
+                'first_sms': [0] * (len(self.LATENCY_BUCKETS) + 1)}
+
+    def observe(self, ts: float, event: str, order_id: str, service_id: str, user_id: str, data: dict) -> None:
+        """OrderEventLog listener"""
+        if event not in ('ordered', 'sms_received') + self.OUTCOMES:
+            return
+        if event == 'sms_received' and data.get('after') is None:
+            return  # Only the first SMS carries the latency
+        day = datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+        with self._lock:
+            counters = self.days.setdefault(day, {}).get(service_id or 'unknown')
+            if counters is None:
+                counters = self.days[day][service_id or 'unknown'] = self.new_counters()
+            if event == 'ordered':
+                counters['orders'] += 1
+                try:
+                    counters['spend'] += float(data.get('price') or 0)
+                except (TypeError, ValueError):
+                    pass
+            elif event == 'sms_received':
+                counters['first_sms'][bisect.bisect_left(self.LATENCY_BUCKETS, data['after'])] += 1
+            else:
+                counters[event] += 1
+            self._dirty = True
+        if time.time() - self._last_save > 60:
+            self.save()
+
+    def percentile(self, histogram: list, q: float):
+        """Seconds below which a fraction q of first SMS arrived, interpolated within its bucket"""
+        total = sum(histogram)
+        if not total:
+            return None
+        target, seen = q * total, 0
+        for index, count in enumerate(histogram):
+            if count and seen + count >= target:
+                if index == len(self.LATENCY_BUCKETS):
+                    return float(self.LATENCY_BUCKETS[-1])
+                low = self.LATENCY_BUCKETS[index - 1] if index else 0
+                return round(low + (self.LATENCY_BUCKETS[index] - low) * (target - seen) / count, 1)
+            seen += count
+        return float(self.LATENCY_BUCKETS[-1])
+
+    def summarize(self, counters: dict) -> dict:
+        closed = counters['finished'] + counters['cancelled'] + counters['expired']
+        return {
+            'orders': counters['orders'],
+            'finished': counters['finished'],
+            'cancelled': counters['cancelled'],
+            'expired': counters['expired'],
+            'success_rate': round(counters['finished'] / closed, 3) if closed else None,
+            'cancel_rate': round((counters['cancelled'] + counters['expired']) / closed, 3) if closed else None,
+            'first_sms_p50_s': self.percentile(counters['first_sms'], 0.5),
+            'first_sms_p95_s': self.percentile(counters['first_sms'], 0.95),
+            'spend': round(counters['spend'], 5),
+            'cost_per_success': round(counters['spend'] / counters['finished'], 5) if counters['finished'] else None
+        }
+
+    def report(self, days: int = 7, service_id: str = None) -> dict:
+        """Totals per service and per day over the last `days` days (today included)"""
+        first_day = datetime.fromtimestamp(time.time() - (days - 1) * 86400).strftime('%Y-%m-%d')
+        services, per_day = {}, {}
+        with self._lock:
+            for day, day_services in self.days.items():
+                if day < first_day:
+                    continue
+                for sid, counters in day_services.items():
+                    if service_id and sid != service_id:
+                        continue
+                    for totals in (services.setdefault(sid, self.new_counters()),
+                                   per_day.setdefault(day, self.new_counters())):
+                        for key, value in counters.items():
+                            if key == 'first_sms':
+                                totals[key] = [a + b for a, b in zip(totals[key], value)]
+                            else:
+                                totals[key] += value
+        return {
+            'since': first_day,
+            'services': {sid: self.summarize(counters) for sid, counters in services.items()},
+            'days': {day: self.summarize(counters) for day, counters in sorted(per_day.items())}
+        }
+
+    def rebuild(self, events: 'OrderEventLog') -> int:
+        """One-off backfill from the event log when no aggregate file exists yet"""
+        since = time.time() - self.keep_days * 86400
+        count = 0
+        for row in events.iter_events(since=since):
+            self.observe(*row)
+            count += 1
+        self.save()
+        return count
+
+    def load(self) -> bool:
+        """False when there is nothing to load and the aggregates should be rebuilt"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                self.days = json.load(f)
+            logger.info(f"Loaded order analytics for {len(self.days)} days")
+        except Exception as e:
+            logger.error(f"Failed to load order analytics: {str(e)}")
+        return True
+
+    def save(self) -> None:
+        self._last_save = time.time()
+        if not self.path or not self._dirty:
+            return
+        cutoff = datetime.fromtimestamp(time.time() - self.keep_days * 86400).strftime('%Y-%m-%d')
+        try:
+            with self._lock:
+                for day in [day for day in self.days if day < cutoff]:
+                    del self.days[day]
+                payload = json.loads(json.dumps(self.days))
+                self._dirty = False
+            atomic_write_json(self.path, payload)
+        except Exception as e:
+            logger.error(f"Failed to save order analytics: {str(e)}")
+
+
+order_analytics = OrderAnalytics(ANALYTICS_FILE or None, ANALYTICS_DAYS)
+order_events.listeners.append(order_analytics.observe)
 
 # Order storage for maintaining order information
-order_storage = {}  # Store order details: {order_id: {service_id, service_name, phone_number, price, order_time, user_id}}
+order_storage = {}  # Working set of orders: {order_id: Order}
+
+# Per-order lifecycle: task ownership, serialized terminal transitions and cleanup
+
+
+class OrderLifecycle:
+    """
+    Owns every per-order background task (monitor, auto-cancel, delayed cancellations,
+    e-wallet validation) and one lock per order. Terminal transitions run through
+    transition()/close(), which happen at most once per order and cancel whatever the
+    order still owns, so no timer fires after an order is finished and no order is
+    PATCHed twice.
+    """
+
+    CLOSED_MEMORY = 10000  # Recently closed ids remembered to reject late transitions
+
+    def __init__(self, tables: dict):
+        self.tables = tables  # {kind: {order_id: {'task', 'message_id', 'chat_id'}}}
+        self.locks = {}
+        self.closed = OrderedDict()  # {order_id: terminal status}
+        self.last_leak_check = {}
+
+    def lock(self, order_id) -> asyncio.Lock:
+        return self.locks.setdefault(str(order_id), asyncio.Lock())
+
+    def track(self, kind: str, order_id, task, message_id: int = None, chat_id: int = None):
+        """Register task as the order's `kind` task, replacing (and cancelling) any previous one"""
+        order_id = str(order_id)
+        table = self.tables[kind]
+        previous = table.get(order_id)
+        if previous is not None and previous['task'] not in (task, asyncio.current_task()):
+            previous['task'].cancel()
+        table[order_id] = {'task': task, 'message_id': message_id, 'chat_id': chat_id}
+
+        def release(done_task):
+            info = table.get(order_id)
+            if info is not None and info['task'] is done_task:
+                del table[order_id]
+
+        task.add_done_callback(release)
+        return task
+
+    def get(self, kind: str, order_id):
+        return self.tables[kind].get(str(order_id))
+
+    def tracked(self, order_id) -> bool:
+        """True if any task still watches order_id"""
+        order_id = str(order_id)
+        return any(order_id in table for table in self.tables.values())
+
+    def location(self, order_id):
+        """(chat_id, message_id) of the order message from whichever task still tracks it"""
+        order_id = str(order_id)
+        for table in self.tables.values():
+            info = table.get(order_id)
+            if info is not None and info['message_id'] and info['chat_id']:
+                return info['chat_id'], info['message_id']
+        return None
+
+    def stop(self, order_id, kinds=None) -> None:
+        """Cancel the order's tasks (all kinds by default) except the calling task"""
+        order_id = str(order_id)
+        current = asyncio.current_task()
+        for kind in kinds or self.tables:
+            info = self.tables[kind].get(order_id)
+            if info is not None and info['task'] is not current:
+                del self.tables[kind][order_id]
+                info['task'].cancel()
+
+    def is_closed(self, order_id) -> bool:
+        return str(order_id) in self.closed
+
+    def close(self, order_id, status: str) -> bool:
+        """Mark the order terminal, cancel its tasks and drop its lock; False if already closed"""
+        order_id = str(order_id)
+        if order_id in self.closed:
+            return False
+        self.closed[order_id] = status
+        if len(self.closed) > self.CLOSED_MEMORY:
+            self.closed.popitem(last=False)
+        self.stop(order_id)
+        self.locks.pop(order_id, None)
+        order_events.emit(OrderEventLog.TERMINAL.get(status, 'expired'), order_id, status=status)
+        mark_order_closed(order_id, status)
+        return True
+
+    async def transition(self, order_id, status: str, request):
+        """
+        Run request() - a provider PATCH returning (status_code, data) - under the order's
+        lock and close the order when it succeeds. Returns None without calling the
+        provider when the order is already closed.
+        """
+        order_id = str(order_id)
+        async with self.lock(order_id):
+            if order_id in self.closed:
+                return None
+            status_code, data = await request()
+            if status_code == 200 and data and data.get('status'):
+                self.close(order_id, status)
+            return status_code, data
+
+    def leak_check(self) -> dict:
+        """
+        Drop table entries whose task already finished and locks nobody needs any more;
+        report tasks still owned by closed orders
+        """
+        report = {'finished_tasks': 0, 'closed_with_tasks': [], 'orphan_locks': 0}
+        for kind, table in self.tables.items():
+            for order_id, info in list(table.items()):
+                if info['task'].done():
+                    del table[order_id]
+                    report['finished_tasks'] += 1
+                elif order_id in self.closed:
+                    report['closed_with_tasks'].append(f"{kind}:{order_id}")
+        for order_id, lock in list(self.locks.items()):
+            if not lock.locked() and not self.tracked(order_id) and order_id not in order_storage:
+                del self.locks[order_id]
+                report['orphan_locks'] += 1
+        if report['finished_tasks'] or report['closed_with_tasks'] or report['orphan_locks']:
+            logger.warning(f"🧯 Order lifecycle leak check: {report}")
+        self.last_leak_check = report
+        return report
+
+    def snapshot(self) -> dict:
+        return {
+            'tasks': {kind: len(table) for kind, table in self.tables.items()},
+            'locks': len(self.locks),
+            'recently_closed': len(self.closed),
+            'last_leak_check': self.last_leak_check
+        }
+
+
+order_lifecycle = OrderLifecycle({
+    'monitor': active_order_monitors,
+    'auto_cancel': auto_cancel_timers,
+    'pending_cancel': pending_cancellations,
+    'user_cancel': user_cancel_requests,
+    'ewallet': ewallet_validations
+})
+
+# Per-update timing: handler wall time split into provider, Telegram and queueing time
+
+
+class UpdateTiming:
+    """Timing accumulator for one update, carried through the handler via a contextvar"""
+    __slots__ = ('label', 'user_id', 'queue_ms', 'provider_ms',
+                 'telegram_ms', 'provider_calls', 'telegram_calls', 'closed')
+
+    def __init__(self, queue_ms: float = 0.0):
+        self.label = None
+        self.user_id = None
+        self.queue_ms = queue_ms
+        self.provider_ms = 0.0
+        self.telegram_ms = 0.0
+        self.provider_calls = 0
+        self.telegram_calls = 0
+        self.closed = False
+
+
+current_update_timing = contextvars.ContextVar(
+    'current_update_timing', default=None)
+
+
+def record_io_time(kind: str, elapsed_ms: float) -> None:
+    """Attribute provider/telegram I/O time to the update being handled, if any"""
+    timing = current_update_timing.get()
+    # Background tasks inherit the contextvar; ignore them once the handler returned
+    if timing is None or timing.closed:
+        return
+    if kind == 'provider':
+        timing.provider_ms += elapsed_ms
+        timing.provider_calls += 1
+    else:
+        timing.telegram_ms += elapsed_ms
+        timing.telegram_calls += 1
+
+
+class HandlerMetrics:
+    """Rolling per-label samples with percentile snapshots and slow-handler reports"""
+
+    FIELDS = ('wall_ms', 'provider_ms', 'telegram_ms', 'queue_ms')
+
+    def __init__(self, window: int = 500, slow_ms: float = SLOW_HANDLER_MS):
+        self.window = window
+        self.slow_ms = slow_ms
+        self.samples = {}  # {label: {field: deque}}
+        self.counts = {}  # {label: {'calls', 'errors', 'slow'}}
+
+    def record(self, timing: UpdateTiming, wall_ms: float, error: bool = False) -> None:
+        label = timing.label
+        series = self.samples.get(label)
+        if series is None:
+            series = {field: deque(maxlen=self.window)
+                      for field in self.FIELDS}
+            self.samples[label] = series
+            self.counts[label] = {'calls': 0, 'errors': 0, 'slow': 0}
+        series['wall_ms'].append(wall_ms)
+        series['provider_ms'].append(timing.provider_ms)
+        series['telegram_ms'].append(timing.telegram_ms)
+        series['queue_ms'].append(timing.queue_ms)
+        counts = self.counts[label]
+        counts['calls'] += 1
+        if error:
+            counts['errors'] += 1
+
+        if wall_ms >= self.slow_ms:
+            counts['slow'] += 1
+            logger.warning("Slow handler " + json.dumps({
+                'handler': label,
+                'user_id': timing.user_id,
+                'wall_ms': round(wall_ms, 1),
+                'provider_ms': round(timing.provider_ms, 1),
+                'provider_calls': timing.provider_calls,
+                'telegram_ms': round(timing.telegram_ms, 1),
+                'telegram_calls': timing.telegram_calls,
+                'queue_ms': round(timing.queue_ms, 1),
+                'other_ms': round(max(0.0, wall_ms - timing.provider_ms - timing.telegram_ms), 1),
+                'error': error,
+                'p95_wall_ms': self.percentile(series['wall_ms'], 95)
+            }, ensure_ascii=False))
+
+    @staticmethod
+    def percentile(values, pct: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return round(ordered[index], 1)
+
+    def snapshot(self) -> dict:
+        report = {}
+        for label, series in self.samples.items():
+            entry = dict(self.counts[label])
+            for field in self.FIELDS:
+                values = list(series[field])
+                entry[field] = {
+                    'p50': self.percentile(values, 50),
+                    'p95': self.percentile(values, 95),
+                    'p99': self.percentile(values, 99)
+                }
+            report[label] = entry
+        return report
+
+
+handler_metrics = HandlerMetrics()
+
+
+class TimedUpdateProcessor(SimpleUpdateProcessor):
+    """Update processor that measures how long each update waited for a free slot"""
+
+    async def process_update(self, update, coroutine) -> None:
+        await self._run_timed(update, coroutine, time.perf_counter())
+
+    async def _run_timed(self, update, coroutine, queued_at: float) -> None:
+        timing = UpdateTiming()
+        token = current_update_timing.set(timing)
+        try:
+            async with self._semaphore:
+                timing.queue_ms = (time.perf_counter() - queued_at) * 1000
+                await self.do_process_update(update, coroutine)
+        finally:
+            current_update_timing.reset(token)
+
+
+class FairUpdateProcessor(TimedUpdateProcessor):
+    """
+    Global concurrency cap plus per-user in-flight limits and bounded per-user FIFO queues.
+    A user can hold at most per_user_limit global slots, so one user spamming buttons
+    cannot starve everyone else. Identical callbacks already in flight are dropped.
+    """
+
+    def __init__(self, max_concurrent_updates: int, per_user_limit: int, per_user_queue: int):
+        super().__init__(max_concurrent_updates)
+        self.per_user_limit = per_user_limit
+        self.per_user_queue = per_user_queue
+        self._users = {}  # {user_id: {'semaphore': asyncio.Semaphore, 'pending': int}}
+        self._inflight_callbacks = set()  # {(user_id, callback_data)}
+        self.stats = {'processed': 0, 'deduplicated': 0, 'rejected': 0}
+
+    async def process_update(self, update, coroutine) -> None:
+        queued_at = time.perf_counter()
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            await self._run_timed(update, coroutine, queued_at)
+            return
+
+        callback_query = getattr(update, 'callback_query', None)
+        callback_key = None
+        if callback_query is not None and callback_query.data:
+            callback_key = (user.id, callback_query.data)
+            if callback_key in self._inflight_callbacks:
+                self.stats['deduplicated'] += 1
+                coroutine.close()
+                await self._notify(update, "⏳ Masih diproses, mohon tunggu...")
+                return
+
+        slot = self._users.get(user.id)
+        if slot is None:
+            slot = {'semaphore': asyncio.Semaphore(
+                self.per_user_limit), 'pending': 0}
+            self._users[user.id] = slot
+        if slot['pending'] >= self.per_user_limit + self.per_user_queue:
+            self.stats['rejected'] += 1
+            coroutine.close()
+            await self._notify(update, "🚦 Terlalu banyak permintaan, coba lagi sebentar lagi.")
+            logger.warning(f"Rejected update from user {user.id}: queue full")
+            return
+
+        slot['pending'] += 1
+        if callback_key is not None:
+            self._inflight_callbacks.add(callback_key)
+        try:
+            async with slot['semaphore']:
+                await self._run_timed(update, coroutine, queued_at)
+            self.stats['processed'] += 1
+        finally:
+            slot['pending'] -= 1
+            if callback_key is not None:
+                self._inflight_callbacks.discard(callback_key)
+            if slot['pending'] == 0 and self._users.get(user.id) is slot:
+                del self._users[user.id]
+
+    @staticmethod
+    async def _notify(update, text: str) -> None:
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(text)
+            elif update.effective_message is not None:
+                await update.effective_message.reply_text(text)
+        except Exception as e:
+            logger.error(f"Failed to notify dropped update: {str(e)}")
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            'active_users': len(self._users),
+            'queued_or_running': sum(slot['pending'] for slot in self._users.values()),
+            'inflight_callbacks': len(self._inflight_callbacks)
+        }
+
+
+update_processor = FairUpdateProcessor(
+    MAX_CONCURRENT_UPDATES, MAX_UPDATES_PER_USER, MAX_QUEUED_PER_USER)
+
+
+class TimedTelegramRequest(HTTPXRequest):
+    """Bot API request backend that attributes Telegram round-trip time to the current update"""
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            record_io_time(
+                'telegram', (time.perf_counter() - started) * 1000)
+
+
+def timed_callback(label: str, callback):
+    """Wrap a handler callback so every invocation is measured and recorded"""
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        timing = current_update_timing.get()
+        token = None
+        if timing is None or timing.closed:
+            timing = UpdateTiming()
+            token = current_update_timing.set(timing)
+
+        timing.label = label
+        if update.callback_query is not None:
+            action = callback_router.parse(update.callback_query.data)
+            timing.label = f"callback:{action.route}" if action else "callback:unknown"
+        if update.effective_user is not None:
+            timing.user_id = str(update.effective_user.id)
+
+        started = time.perf_counter()
+        error = False
+        try:
+            return await callback(update, context)
+        except Exception:
+            error = True
+            raise
+        finally:
+            timing.closed = True
+            handler_metrics.record(
+                timing, (time.perf_counter() - started) * 1000, error)
+            if token is not None:
+                current_update_timing.reset(token)
+    return wrapper
+
+
+def instrument_handler(handler):
+    """Install timing middleware on a registered handler"""
+    if isinstance(handler, CommandHandler):
+        label = "command:" + "/".join(sorted(handler.commands))
+    elif isinstance(handler, CallbackQueryHandler):
+        label = "callback"
+    else:
+        label = "message"
+    handler.callback = timed_callback(label, handler.callback)
+    return handler
 
 # Enhanced async HTTP session for better performance
 
@@ -165,15 +1253,19 @@ class AsyncHTTPClient:
 
     async def get(self, url, headers=None):
         session = await self.get_session()
+        started = time.perf_counter()
         try:
             async with session.get(url, headers=headers) as response:
                 return response.status, await response.json()
         except Exception as e:
             logger.error(f"HTTP GET error: {str(e)}")
             return None, None
+        finally:
+            record_io_time('provider', (time.perf_counter() - started) * 1000)
 
     async def post(self, url, data=None, json_data=None, headers=None):
         session = await self.get_session()
+        started = time.perf_counter()
         try:
             if json_data:
                 async with session.post(url, json=json_data, headers=headers) as response:
@@ -184,9 +1276,12 @@ class AsyncHTTPClient:
         except Exception as e:
             logger.error(f"HTTP POST error: {str(e)}")
             return None, None
+        finally:
+            record_io_time('provider', (time.perf_counter() - started) * 1000)
 
     async def patch(self, url, data=None, json_data=None, headers=None):
         session = await self.get_session()
+        started = time.perf_counter()
         try:
             if json_data:
                 async with session.patch(url, json=json_data, headers=headers) as response:
@@ -197,6 +1292,8 @@ class AsyncHTTPClient:
         except Exception as e:
             logger.error(f"HTTP PATCH error: {str(e)}")
             return None, None
+        finally:
+            record_io_time('provider', (time.perf_counter() - started) * 1000)
 
     async def close(self):
         if self.session and not self.session.closed:
@@ -206,6 +1303,208 @@ class AsyncHTTPClient:
 # Global HTTP client instance
 http_client = AsyncHTTPClient()
 
+# Order message renderer: templates are compiled once at import, each render is one format + join
+
+ORDER_STATUS_EMOJI = {
+    'PENDING': '🟡',
+    'SUCCESS': '🟢',
+    'CANCEL': '🔴',
+    'REFUND': '🟠'
+}
+
+_ORDER_BODY = (
+    "🆔 Order ID: {order_id}\n"
+    "📞 Nomor: <code>{phone_number}</code> | <code>{phone62}</code>\n"
+    "💵 Harga: {price}\n"
+    "📊 Status: {status}\n"
+)
+
+# Keyed by (state, view). 'monitor' is the auto-update view, 'manual' the Get SMS view.
+ORDER_TEMPLATES = {
+    ('pending', 'monitor'): "📱 Status Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "📧 Menunggu SMS...\n🕒 Dipesan pada: {order_time}\n🔄 Auto-Update: {stamp}",
+    ('pending', 'manual'): "📱 Status Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "📧 Menunggu SMS...\n🕒 Dipesan pada: {order_time}",
+    ('sms', 'monitor'): "📱 SMS Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "📧 Total SMS: {sms_count}\n🕒 Dipesan pada: {order_time}\n🔄 {stamp_label}: {stamp}\n\n",
+    ('sms', 'manual'): "📱 SMS Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "📧 Total SMS: {sms_count}\n🕒 Dipesan pada: {order_time}\n\n",
+    ('success', 'monitor'): "📱 Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "✅ Order berhasil diselesaikan\n🕒 Dipesan pada: {order_time}\n🔄 Final Update: {stamp}",
+    ('success', 'manual'): "📱 Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "✅ Order berhasil diselesaikan\n🕒 Dipesan pada: {order_time}",
+    ('cancelled', 'monitor'): "📱 Status Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "🚫 {reason}\n📧 SMS tidak tersedia (order dibatalkan)\n🕒 Dipesan pada: {order_time}\n🔄 Final Update: {stamp}",
+    ('cancelled', 'manual'): "📱 Order {service_name} {emoji}\n" + _ORDER_BODY +
+    "🚫 {reason}\n🕒 Dipesan pada: {order_time}\n🔄 Final Update: {stamp}",
+}
+
+NOTICE_TEMPLATES = {
+    'placed': (
+        "✅ Pesanan berhasil {service_name}!\n"
+        "🆔 Order ID: {order_id}{status_text}\n"
+        "📞 Nomor: <code>{phone_number}</code> | <code>{phone62}</code>\n"
+        "💵 Harga: {price}\n"
+        "🕒 Dipesan pada: {order_time}"
+    ),
+    'resend': (
+        "🔄 Resend Order {service_name}\n"
+        "🆔 Order ID: {order_id}\n"
+        "📞 Nomor: {phone_number}\n"
+        "💵 Harga: {price}\n"
+        "📊 Status: Resend berhasil\n"
+        "🕒 Dipesan pada: {order_time}\n"
+        "🔄 Resend pada: {stamp}\n"
+        "⏳ Menunggu SMS..."
+    ),
+    'finished': (
+        "✅ Pesanan selesai - {service_name}\n"
+        "🆔 Order ID: {order_id}\n"
+        "📞 Nomor: {phone_display}\n"
+        "💵 Harga: {price}\n"
+        "🕒 Dipesan pada: {order_time}\n"
+        "✅ Diselesaikan pada: {stamp}\n"
+        "🎉 Status: Berhasil diselesaikan manual"
+    ),
+    'cancelled_manual': (
+        "❌ Pesanan dibatalkan!\n"
+        "🆔 Order ID: {order_id}\n"
+        "🚫 Alasan: Pembatalan manual\n"
+        "🕒 Dibatalkan pada: {stamp}\n"
+        "✅ Status: Berhasil dibatalkan"
+    ),
+    'cancelled_no_sms': (
+        "❌ Pesanan dibatalkan otomatis!\n"
+        "🆔 Order ID: {order_id}\n"
+        "🚫 Alasan: Tidak ada SMS diterima dalam {waited}\n"
+        "🕒 Dibatalkan pada: {stamp}\n"
+        "⏰ Auto-cancelled setelah {waited}"
+    ),
+    'cancelled_registered': (
+        "❌ Pesanan dibatalkan otomatis!\n"
+        "🆔 Order ID: {order_id}\n"
+        "🚫 Alasan: Nomor sudah terdaftar pada e-wallet\n"
+        "🕒 Dibatalkan pada: {stamp}\n"
+        "⏰ Auto-cancelled setelah {delay_seconds} detik"
+    ),
+    'cancelling_now': (
+        "⚡ Membatalkan pesanan {service_name}...\n"
+        "🆔 Order ID: {order_id}\n"
+        "📞 Nomor: {phone_number}\n"
+        "🚫 Alasan: {reason}\n"
+        "🕒 Dipesan pada: {order_time}\n"
+        "⏰ Order sudah lebih dari {hold}, dibatalkan langsung\n"
+        "🔄 Status: Memproses pembatalan..."
+    ),
+    'cancelling_later': (
+        "⏳ Proses pembatalan pesanan {service_name}\n"
+        "🆔 Order ID: {order_id}\n"
+        "📞 Nomor: {phone_number}\n"
+        "🚫 Alasan: {reason}\n"
+        "🕒 Dipesan pada: {order_time}\n"
+        "⏰ Akan dibatalkan pada: {cancel_time}\n"
+        "🔄 Status: Menunggu konfirmasi API..."
+    ),
+}
+
+_SMS_LINE = "📧 SMS #{0}: <code>{1}</code>\n"
+_SMS_FULL_LINE = "📄 {0}: <code>{1}</code>\n"
+
+
+def render_notice(kind: str, **fields) -> str:
+    """Render one of the single-shot order notices (placed, finished, cancelled...)"""
+    return NOTICE_TEMPLATES[kind].format_map(fields)
+
+
+def render_order_view(state: str, view: str, order_id, service_name: str, status: str,
+                      phone_number: str, phone62: str, price, order_time: str,
+                      sms_data=(), reason: str = "", stamp: str = "") -> str:
+    """
+    Render an order status view. state is one of pending/sms/success/cancelled,
+    view is 'monitor' (auto-update) or 'manual' (Get SMS button).
+    """
+    head = ORDER_TEMPLATES[(state, view)].format(
+        order_id=order_id, service_name=service_name, emoji=ORDER_STATUS_EMOJI.get(status, '⚪'),
+        status=status, phone_number=phone_number, phone62=phone62, price=price,
+        order_time=order_time, reason=reason, stamp=stamp, sms_count=len(sms_data),
+        stamp_label="Final Update" if status == 'SUCCESS' else "Auto-Update"
+    )
+    if state != 'sms':
+        return head
+
+    # The pending auto-update view uses a compact SMS list, every other view spaces them out
+    compact = view == 'monitor' and status != 'SUCCESS'
+    full_label = "Full" if compact else "Full SMS"
+    parts = [head]
+    for i, sms in enumerate(sms_data, 1):
+        sms_text = sms.get('sms', sms.get('fullSms', 'No text'))
+        full_sms = sms.get('fullSms', sms_text)
+        if sms_text:
+            sms_text = sms_text.strip()
+        if full_sms:
+            full_sms = full_sms.strip()
+
+        parts.append(_SMS_LINE.format(i, sms_text))
+        if full_sms and full_sms != sms_text and len(full_sms) > len(sms_text):
+            parts.append(_SMS_FULL_LINE.format(full_label, full_sms))
+        if not compact:
+            parts.append("\n")
+    return "".join(parts)
+
+
+def order_view_state(order_status: str, sms_data) -> str:
+    """Map provider status + SMS list to a renderer state"""
+    if order_status in ('CANCEL', 'REFUND'):
+        return 'cancelled'
+    if sms_data:
+        return 'sms'
+    return 'success' if order_status == 'SUCCESS' else 'pending'
+
+
+@functools.lru_cache(maxsize=4096)
+def order_keyboard(kind: str, order_id, service_id="N/A"):
+    """
+    Cached inline keyboard for an order. kind 'pending' includes the cancel button,
+    'success' does not. Returns None for kind 'closed'.
+    """
+    if kind == 'closed':
+        return None
+
+    if kind == 'pending':
+        first_row = [
+            InlineKeyboardButton(
+                "❌ Batalkan OTP", callback_data=f"cancel_order_{order_id}"),
+            InlineKeyboardButton(
+                "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
+        ]
+    else:
+        first_row = [
+            InlineKeyboardButton(
+                "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
+        ]
+
+    action_buttons = [
+        first_row,
+        [
+            InlineKeyboardButton(
+                "🔄 Resend", callback_data=f"resend_order_{order_id}"),
+            InlineKeyboardButton(
+                "📱 Get SMS", callback_data=f"get_sms_{order_id}")
+        ]
+    ]
+    if service_id != "N/A":
+        action_buttons.append([
+            InlineKeyboardButton(
+                f"🔄 Order Again", callback_data=f"order_service_{service_id}")
+        ])
+    return InlineKeyboardMarkup(action_buttons)
+
+
+def order_keyboard_kind(order_status: str) -> str:
+    if order_status in ('CANCEL', 'REFUND'):
+        return 'closed'
+    return 'success' if order_status == 'SUCCESS' else 'pending'
+
 # Function to monitor order for SMS updates with enhanced async
 
 
@@ -217,18 +1516,19 @@ async def monitor_order_sms(context: ContextTypes.DEFAULT_TYPE, order_id: str, m
     last_sms_count = initial_sms_count
     last_status = None
     check_count = 0
-    max_checks = 60  # Monitor for 10 minutes (60 checks * 10 seconds)
+    max_checks = 60  # Monitor for at least 10 minutes (60 checks * 10 seconds)
 
     async def check_order_updates():
         nonlocal last_sms_count, last_status, check_count
 
-        while check_count < max_checks:
+        # Keep watching until the provider expiry when it is known, since auto-cancel may hold longer
+        while check_count < max_checks or time.time() < (getattr(stored_order(order_id), 'expires_at', None) or 0):
             try:
                 await asyncio.sleep(10)  # Check every 10 seconds
                 check_count += 1
 
                 # Check if order is still being monitored
-                if order_id not in active_order_monitors:
+                if order_lifecycle.is_closed(order_id):
                     break
 
                 url = f"{BASE_URL}order/status/{order_id}"
@@ -243,6 +1543,18 @@ async def monitor_order_sms(context: ContextTypes.DEFAULT_TYPE, order_id: str, m
                             'orderStatus', 'Unknown')
                         sms_data = order_data.get('Sms', [])
                         current_sms_count = len(sms_data)
+                        note_order_expiry(order_id, order_data.get('expiredAt'))
+                        order = stored_order(order_id)
+                        first_sms_after = None
+                        if order is not None:
+                            order.sms = sms_data
+                            if current_sms_count and not last_sms_count and order.placed_at:
+                                first_sms_after = round(time.time() - order.placed_at, 1)
+                                sms_latency_stats.record(order.service_id, first_sms_after)
+
+                        if current_sms_count > last_sms_count:
+                            order_events.emit('sms_received', order_id, sms_count=current_sms_count,
+                                              after=first_sms_after)
 
                         # Check if there are new SMS or status changes
                         if current_sms_count > last_sms_count or current_status != last_status:
@@ -250,27 +1562,21 @@ async def monitor_order_sms(context: ContextTypes.DEFAULT_TYPE, order_id: str, m
                             last_status = current_status
 
                             # Only update if there's actually a change
-                            await auto_update_order_message(context, order_id, message_id, chat_id, order_data)
+                            if message_id:
+                                await auto_update_order_message(context, order_id, message_id, chat_id, order_data)
 
                         # Stop monitoring if order is completed or cancelled
                         if current_status in ['SUCCESS', 'CANCEL', 'REFUND']:
+                            order_lifecycle.close(order_id, current_status)
                             break
 
             except Exception as e:
                 logger.error(f"Error monitoring order {order_id}: {str(e)}")
                 await asyncio.sleep(5)  # Wait a bit before retrying
 
-        # Remove from active monitors when done
-        if order_id in active_order_monitors:
-            del active_order_monitors[order_id]
-
-    # Store the monitoring task
-    task = asyncio.create_task(check_order_updates())
-    active_order_monitors[order_id] = {
-        'task': task,
-        'message_id': message_id,
-        'chat_id': chat_id
-    }
+    # Store the monitoring task; the registry drops the entry when it ends
+    order_lifecycle.track('monitor', order_id, asyncio.create_task(
+        check_order_updates()), message_id, chat_id)
 
 
 def extract_service_info_from_message(message_text: str) -> dict:
@@ -337,10 +1643,10 @@ async def auto_update_order_message(context: ContextTypes.DEFAULT_TYPE, order_id
             api_price, (int, float)) else api_price  # Default price
 
         # Get stored order info first
-        stored_order = get_order_info(order_id)
-        service_name = stored_order['service_name']
-        order_time = stored_order['order_time']
-        stored_phone = stored_order['phone_number']
+        stored = get_order_info(order_id)
+        service_name = stored.service_name or 'Unknown Service'
+        order_time = stored.order_time
+        stored_phone = stored.phone_number or 'N/A'
 
         # Use stored phone number if API doesn't provide it or if it's better
         if phone_number == 'N/A' or not phone_number:
@@ -363,9 +1669,9 @@ async def auto_update_order_message(context: ContextTypes.DEFAULT_TYPE, order_id
                 phone_number = service_info['phone_number']
         except:
             # Use stored data as fallback
-            if stored_order['price'] != 'N/A':
-                price = f"${float(stored_order['price']):.5f}" if isinstance(
-                    stored_order['price'], (int, float)) else stored_order['price']
+            if stored.price is not None:
+                price = f"${float(stored.price):.5f}" if isinstance(
+                    stored.price, (int, float)) else stored.price
             else:
                 # Use API price as fallback
                 price = f"${float(api_price):.5f}" if api_price != 'N/A' and isinstance(
@@ -395,148 +1701,15 @@ async def auto_update_order_message(context: ContextTypes.DEFAULT_TYPE, order_id
             phone_number = 'N/A'
             phoneformat62 = 'N/A'
 
-        # Status emoji mapping
-        status_emoji = {
-            'PENDING': '🟡',
-            'SUCCESS': '🟢',
-            'CANCEL': '🔴',
-            'REFUND': '🟠'
-        }.get(order_status, '⚪')
-
-        # Build updated message based on status
-        if order_status in ['CANCEL', 'REFUND']:
-            # For cancelled/refunded orders, show final status without action buttons
-            cancel_reason = "Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses"
-            message = f"📱 Status Order {service_name} {status_emoji}\n"
-            message += f"🆔 Order ID: {order_id}\n"
-            message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-            message += f"💵 Harga: {price}\n"
-            message += f"📊 Status: {order_status}\n"
-            message += f"🚫 {cancel_reason}\n"
-            message += f"📧 SMS tidak tersedia (order dibatalkan)\n"
-            message += f"🕒 Dipesan pada: {order_time}\n"
-            message += f"🔄 Final Update: {datetime.now().strftime('%H:%M:%S')}"
-
-            # No action buttons for cancelled/refunded orders
-            reply_markup = None
-
-        elif order_status == 'SUCCESS':
-            # For successful orders, show final status with SMS and action buttons
-            if sms_data:
-                message = f"📱 SMS Order {service_name} {status_emoji}\n"
-                message += f"🆔 Order ID: {order_id}\n"
-                message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                message += f"💵 Harga: {price}\n"
-                message += f"📊 Status: {order_status}\n"
-                message += f"📧 Total SMS: {len(sms_data)}\n"
-                message += f"🕒 Dipesan pada: {order_time}\n"
-                message += f"🔄 Final Update: {datetime.now().strftime('%H:%M:%S')}\n\n"
-
-                for i, sms in enumerate(sms_data, 1):
-                    sms_text = sms.get('sms', sms.get('fullSms', 'No text'))
-                    full_sms = sms.get('fullSms', sms_text)
-
-                    # Clean and format SMS text for better display
-                    if sms_text:
-                        sms_text = sms_text.strip()
-                    if full_sms:
-                        full_sms = full_sms.strip()
-
-                    message += f"📧 SMS #{i}: <code>{sms_text}</code>\n"
-                    if full_sms and full_sms != sms_text and len(full_sms) > len(sms_text):
-                        message += f"📄 Full SMS: <code>{full_sms}</code>\n"
-                    message += "\n"
-            else:
-                message = f"📱 Order {service_name} {status_emoji}\n"
-                message += f"🆔 Order ID: {order_id}\n"
-                message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                message += f"💵 Harga: {price}\n"
-                message += f"📊 Status: {order_status}\n"
-                message += f"✅ Order berhasil diselesaikan\n"
-                message += f"🕒 Dipesan pada: {order_time}\n"
-                message += f"🔄 Final Update: {datetime.now().strftime('%H:%M:%S')}"
-
-            # Show buttons for successful orders (no Cancel button)
-            action_buttons = [
-                [
-                    InlineKeyboardButton(
-                        "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
-                ],
-                [
-                    InlineKeyboardButton(
-                        "🔄 Resend", callback_data=f"resend_order_{order_id}"),
-                    InlineKeyboardButton(
-                        "📱 Get SMS", callback_data=f"get_sms_{order_id}")
-                ]
-            ]
-
-            if service_id != "N/A":
-                action_buttons.append([
-                    InlineKeyboardButton(
-                        f"🔄 Order Again", callback_data=f"order_service_{service_id}")
-                ])
-
-            reply_markup = InlineKeyboardMarkup(action_buttons)
-
-        else:
-            # For pending orders, show normal interface
-            if sms_data:
-                message = f"📱 SMS Order {service_name} {status_emoji}\n"
-                message += f"🆔 Order ID: {order_id}\n"
-                message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                message += f"💵 Harga: {price}\n"
-                message += f"📊 Status: {order_status}\n"
-                message += f"📧 Total SMS: {len(sms_data)}\n"
-                message += f"🕒 Dipesan pada: {order_time}\n"
-                message += f"🔄 Auto-Update: {datetime.now().strftime('%H:%M:%S')}\n\n"
-
-                for i, sms in enumerate(sms_data, 1):
-                    sms_text = sms.get('sms', sms.get('fullSms', 'No text'))
-                    full_sms = sms.get('fullSms', sms_text)
-
-                    # Clean and format SMS text for better display
-                    if sms_text:
-                        sms_text = sms_text.strip()
-                    if full_sms:
-                        full_sms = full_sms.strip()
-
-                    message += f"📧 SMS #{i}: <code>{sms_text}</code>\n"
-                    if full_sms and full_sms != sms_text and len(full_sms) > len(sms_text):
-                        message += f"📄 Full: <code>{full_sms}</code>\n"
-            else:
-                message = f"📱 Status Order {service_name} {status_emoji}\n"
-                message += f"🆔 Order ID: {order_id}\n"
-                message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                message += f"💵 Harga: {price}\n"
-                message += f"📊 Status: {order_status}\n"
-                message += f"📧 Menunggu SMS...\n"
-                message += f"🕒 Dipesan pada: {order_time}\n"
-                message += f"🔄 Auto-Update: {datetime.now().strftime('%H:%M:%S')}"
-
-            # Show action buttons for pending orders
-            action_buttons = [
-                [
-                    InlineKeyboardButton(
-                        "❌ Batalkan OTP", callback_data=f"cancel_order_{order_id}"),
-                    InlineKeyboardButton("✅ Tandai Selesai",
-                                         callback_data=f"finish_order_{order_id}")
-                ],
-                [
-                    InlineKeyboardButton(
-                        "🔄 Resend", callback_data=f"resend_order_{order_id}"),
-                    InlineKeyboardButton(
-                        "📱 Get SMS", callback_data=f"get_sms_{order_id}")
-                ]
-            ]
-
-            # Add Order Again button if service_id is available
-            if service_id != "N/A":
-                action_buttons.append([
-                    InlineKeyboardButton(
-                        f"🔄 Order Again", callback_data=f"order_service_{service_id}")
-                ])
-
-            reply_markup = InlineKeyboardMarkup(action_buttons)
+        # Render through the shared order templates
+        message = render_order_view(
+            order_view_state(order_status, sms_data), 'monitor', order_id, service_name,
+            order_status, phone_number, phoneformat62, price, order_time, sms_data=sms_data,
+            reason="Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses",
+            stamp=datetime.now().strftime('%H:%M:%S')
+        )
+        reply_markup = order_keyboard(
+            order_keyboard_kind(order_status), order_id, service_id)
 
         # Update the message
         await context.bot.edit_message_text(
@@ -566,7 +1739,12 @@ async def schedule_delayed_cancellation(context: ContextTypes.DEFAULT_TYPE, orde
         headers = {"X-Api-Key": API_KEY}
 
         try:
-            status_code, data = await http_client.patch(url, headers=headers)
+            outcome = await order_lifecycle.transition(
+                order_id, 'CANCEL', lambda: http_client.patch(url, headers=headers))
+            if outcome is None:
+                logger.info(f"Order {order_id} already closed, skipping delayed-cancel")
+                return
+            status_code, data = outcome
             logger.info(
                 f"Delayed-cancel request for order {order_id}: Status {status_code}, Response: {data}")
 
@@ -578,13 +1756,9 @@ async def schedule_delayed_cancellation(context: ContextTypes.DEFAULT_TYPE, orde
                     # Final cancellation message
                     if message_id and chat_id:
                         try:
-                            final_message = (
-                                f"❌ Pesanan dibatalkan!\n"
-                                f"🆔 Order ID: {order_id}\n"
-                                f"🚫 Alasan: Pembatalan manual\n"
-                                f"🕒 Dibatalkan pada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                                f"✅ Status: Berhasil dibatalkan"
-                            )
+                            final_message = render_notice(
+                                'cancelled_manual', order_id=order_id,
+                                stamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
                             await context.bot.edit_message_text(
                                 chat_id=chat_id,
@@ -605,17 +1779,9 @@ async def schedule_delayed_cancellation(context: ContextTypes.DEFAULT_TYPE, orde
             logger.error(
                 f"Exception during delayed-cancel of order {order_id}: {str(e)}")
 
-        # Remove from user cancel requests
-        if order_id in user_cancel_requests:
-            del user_cancel_requests[order_id]
-
     # Store the cancellation task
-    task = asyncio.create_task(cancel_after_delay())
-    user_cancel_requests[order_id] = {
-        'task': task,
-        'message_id': message_id,
-        'chat_id': chat_id
-    }
+    order_lifecycle.track('user_cancel', order_id, asyncio.create_task(
+        cancel_after_delay()), message_id, chat_id)
 
 # E-wallet service IDs that require account validation
 EWALLET_SERVICES = {
@@ -625,6 +1791,243 @@ EWALLET_SERVICES = {
     'linkaja': ['357']  # Add LinkAja service IDs
 }
 
+# Mapping service_type to account_type value for the validation endpoint
+EWALLET_ACCOUNT_TYPES = {
+    'dana': 'kPTh+rsIRDKKTeYWkaPh10QxQ2tiTFFLTml5eFRBME1NbmxqVjFFSWRkL0crVEhxSERWK3V0YTdNbzA9',
+    'dana_active': '3RMatI3XfkQj5iAAKnfvjnR0eUkzc1Y2Z25pcVhsTTNWU3hiWDB2ekVNRjI1TW9oRTFuVjRwT0tyMFk9',
+    'shopeepay': '7BLFgSXukDhivFWpp9HAPXFMNzF4RTE3cGxkcVE0VmlZSTNUNEtkaWFWMXJnZU5kYVRKdnRoMFI1NjQ9',
+    'linkaja_active': 'e/FsJuSdqID+MkmS4zCSNkU1dHJVc3hDQkgrVndnR3NNU1VVakJvVVk2TE9lbmZ4YS95WXZyWXZ4LzQ9',
+    'ovo_active': 'sS/AWaTnhjm66U9P/vbjyUNhY2g3d3NxeXdLVk5ObVhTRElLRDdPUTNLYzB5ZTQycW13WFFxb2xNeUk9',
+    'shopeepay_active': 'RRRj9w9nFnIvDwYu8vAcyHoxc2dMNnVaNkpLSGR3bE5pdkY2dytLQWJCZHlUdk90cUdiOUlKTGVNU2M9',
+    'isaku_active': 'kGMDFe6LPSaVM8nmsrQCH0lGN0M2d1JFOGlDUTVDNlhoS2lkQ2hLYmsxV2k0NHFXbnc3RTYvOEcxdVk9',
+    'gopay_customer_active': 'KgtVgI/JN0VrPz+qhwyU3UlIa1hsWHhMM0RGbHY5dkQyb3NvT0pGdUFudVFUcnltdzJlSE1iQW1XY2FqY2F2Z2dleVBuU2JZdVgyaGNoODA=',
+    'gopay_driver_active': 'RlwUvZiBOdEYkEAV9A2+5WZ1cG1kL0I4b29sdWRFN1RBNUFtTjZjbXdGdWRJdWJyT3MzOXg4K1BROWdJeDN3RWVXWHJsQmhaZ3lqVm1UV0I='
+}
+
+# Wallet names accepted by /cekwallet mapped to their account-type keys
+EWALLET_WALLET_ALIASES = {
+    '17': 'dana_active',
+    'dana': 'dana_active',
+    'ovo': 'ovo_active',
+    'gopay': 'gopay_customer_active',
+    'linkaja': 'linkaja_active'
+}
+
+# Service types cekrek resolves while ordering; other wallets stay 'unknown' unless enabled
+EWALLET_TYPE_ALIASES = dict(EWALLET_WALLET_ALIASES) if EWALLET_VALIDATE_ALL else {
+    '17': 'dana_active',
+    'dana': 'dana_active'
+}
+
+# One check per wallet for a combined registration profile
+EWALLET_PROFILE_TYPES = (
+    'dana_active', 'ovo_active', 'gopay_customer_active', 'shopeepay_active', 'linkaja_active'
+)
+
+def normalize_wallet_phone(phone_number: str) -> str:
+    """Normalize +62/62 prefixes to the leading-0 format used by the validator"""
+    if phone_number.startswith('+62'):
+        return '0' + phone_number[3:]
+    if phone_number.startswith('62'):
+        return '0' + phone_number[2:]
+    return phone_number
+
+# Local index of numbers known to be registered per wallet
+
+
+class RegisteredNumberIndex:
+    """
+    Sorted array of numbers known to be registered, one per wallet type. Membership is a
+    binary search over packed 64-bit integers, so millions of numbers stay compact.
+    Changes only mark the index dirty; run() writes it from a worker thread.
+    """
+
+    SAVE_INTERVAL = 60
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.wallets = {}  # {wallet_type: array('Q') sorted}
+        self.hits = 0
+        self._dirty = False
+
+    @staticmethod
+    def _pack(phone_number: str):
+        digits = normalize_wallet_phone(phone_number).lstrip('0')
+        return int(digits) if digits.isdigit() else None
+
+    def contains(self, phone_number: str, wallet_type: str) -> bool:
+        numbers = self.wallets.get(wallet_type)
+        value = self._pack(phone_number)
+        if not numbers or value is None:
+            return False
+        i = bisect.bisect_left(numbers, value)
+        found = i < len(numbers) and numbers[i] == value
+        if found:
+            self.hits += 1
+        return found
+
+    def add(self, phone_number: str, wallet_type: str) -> None:
+        value = self._pack(phone_number)
+        if value is None:
+            return
+        numbers = self.wallets.setdefault(wallet_type, array('Q'))
+        i = bisect.bisect_left(numbers, value)
+        if i < len(numbers) and numbers[i] == value:
+            return
+        numbers.insert(i, value)
+        self._dirty = True
+
+    def discard(self, phone_number: str, wallet_type: str) -> None:
+        numbers = self.wallets.get(wallet_type)
+        value = self._pack(phone_number)
+        if not numbers or value is None:
+            return
+        i = bisect.bisect_left(numbers, value)
+        if i < len(numbers) and numbers[i] == value:
+            del numbers[i]
+            self._dirty = True
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                raw = json.load(f)
+            self.wallets = {wallet_type: array('Q', sorted(set(numbers)))
+                            for wallet_type, numbers in raw.items()}
+            logger.info(
+                f"Loaded {sum(len(n) for n in self.wallets.values())} known registered numbers")
+        except Exception as e:
+            logger.error(f"Failed to load registered number index: {str(e)}")
+
+    def _take_snapshot(self):
+        """Copies of the arrays (a memcpy each) to serialize off the event loop, or None if clean"""
+        if not self.path or not self._dirty:
+            return None
+        self._dirty = False
+        return {wallet_type: array('Q', numbers) for wallet_type, numbers in self.wallets.items()}
+
+    def _write(self, snapshot: dict) -> None:
+        try:
+            atomic_write_json(self.path, {wallet_type: numbers.tolist()
+                                          for wallet_type, numbers in snapshot.items()})
+        except Exception as e:
+            self._dirty = True  # Retry on the next pass
+            logger.error(f"Failed to save registered number index: {str(e)}")
+
+    def save(self) -> None:
+        """Synchronous flush for shutdown"""
+        snapshot = self._take_snapshot()
+        if snapshot is not None:
+            self._write(snapshot)
+
+    async def run(self) -> None:
+        """Background job: write pending changes every SAVE_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(self.SAVE_INTERVAL)
+            snapshot = self._take_snapshot()
+            if snapshot is not None:
+                await asyncio.to_thread(self._write, snapshot)
+
+    def snapshot(self) -> dict:
+        return {
+            'numbers': {wallet_type: len(numbers) for wallet_type, numbers in self.wallets.items()},
+            'hits': self.hits
+        }
+
+
+registered_index = RegisteredNumberIndex(REGISTERED_INDEX_FILE or None)
+
+# E-wallet validation result cache
+
+
+class ValidationCache:
+    """
+    Bounded LRU + TTL cache of cekrek results keyed by (normalized phone, account_type).
+    Only definitive results (valid/invalid) are cached. Optionally persisted to disk.
+    """
+
+    def __init__(self, ttl: int, max_size: int, path: str = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()  # {"phone|account_type": (expires_at, result)}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._last_save = 0.0
+
+    @staticmethod
+    def _key(phone_number: str, account_type: str) -> str:
+        return f"{phone_number}|{account_type}"
+
+    def get(self, phone_number: str, account_type: str):
+        key = self._key(phone_number, account_type)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, result = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            self._dirty = True
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(result)
+
+    def put(self, phone_number: str, account_type: str, result: dict) -> None:
+        key = self._key(phone_number, account_type)
+        self.entries[key] = (time.time() + self.ttl, dict(result))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self._dirty = True
+        # Debounced persistence; the final state is flushed on shutdown
+        if time.time() - self._last_save > 60:
+            self.save()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                raw = json.load(f)
+            now = time.time()
+            for key, (expires_at, result) in raw.items():
+                if expires_at > now:
+                    self.entries[key] = (expires_at, result)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            logger.info(
+                f"Loaded {len(self.entries)} cached e-wallet validations")
+        except Exception as e:
+            logger.error(f"Failed to load e-wallet cache: {str(e)}")
+
+    def save(self) -> None:
+        self._last_save = time.time()
+        if not self.path or not self._dirty:
+            return
+        try:
+            atomic_write_json(self.path, dict(self.entries))
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"Failed to save e-wallet cache: {str(e)}")
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+ewallet_cache = ValidationCache(
+    EWALLET_CACHE_TTL, EWALLET_CACHE_SIZE, EWALLET_CACHE_FILE or None)
+
 # Enhanced async e-wallet checker
 
 
@@ -634,28 +2037,11 @@ async def cekrek(phone_number: str, service_type: str, max_retries: int = 3) ->
     """
     try:
         # Format phone number (remove +62, keep leading 0)
-        if phone_number.startswith('+62'):
-            phone_number = '0' + phone_number[3:]
-        elif phone_number.startswith('62'):
-            phone_number = '0' + phone_number[2:]
-
-        if service_type.lower() == 'dana' or service_type.lower() == '17':
-            service_type = 'dana_active'
-
-        # Mapping service_type to account_type value
-        service_mapping = {
-            'dana': 'kPTh+rsIRDKKTeYWkaPh10QxQ2tiTFFLTml5eFRBME1NbmxqVjFFSWRkL0crVEhxSERWK3V0YTdNbzA9',
-            'dana_active': '3RMatI3XfkQj5iAAKnfvjnR0eUkzc1Y2Z25pcVhsTTNWU3hiWDB2ekVNRjI1TW9oRTFuVjRwT0tyMFk9',
-            'shopeepay': '7BLFgSXukDhivFWpp9HAPXFMNzF4RTE3cGxkcVE0VmlZSTNUNEtkaWFWMXJnZU5kYVRKdnRoMFI1NjQ9',
-            'linkaja_active': 'e/FsJuSdqID+MkmS4zCSNkU1dHJVc3hDQkgrVndnR3NNU1VVakJvVVk2TE9lbmZ4YS95WXZyWXZ4LzQ9',
-            'ovo_active': 'sS/AWaTnhjm66U9P/vbjyUNhY2g3d3NxeXdLVk5ObVhTRElLRDdPUTNLYzB5ZTQycW13WFFxb2xNeUk9',
-            'shopeepay_active': 'RRRj9w9nFnIvDwYu8vAcyHoxc2dMNnVaNkpLSGR3bE5pdkY2dytLQWJCZHlUdk90cUdiOUlKTGVNU2M9',
-            'isaku_active': 'kGMDFe6LPSaVM8nmsrQCH0lGN0M2d1JFOGlDUTVDNlhoS2lkQ2hLYmsxV2k0NHFXbnc3RTYvOEcxdVk9',
-            'gopay_customer_active': 'KgtVgI/JN0VrPz+qhwyU3UlIa1hsWHhMM0RGbHY5dkQyb3NvT0pGdUFudVFUcnltdzJlSE1iQW1XY2FqY2F2Z2dleVBuU2JZdVgyaGNoODA=',
-            'gopay_driver_active': 'RlwUvZiBOdEYkEAV9A2+5WZ1cG1kL0I4b29sdWRFN1RBNUFtTjZjbXdGdWRJdWJyT3MzOXg4K1BROWdJeDN3RWVXWHJsQmhaZ3lqVm1UV0I='
-        }
+        phone_number = normalize_wallet_phone(phone_number)
+        service_type = EWALLET_TYPE_ALIASES.get(
+            service_type.lower(), service_type)
 
-        account_type = service_mapping.get(service_type.lower())
+        account_type = EWALLET_ACCOUNT_TYPES.get(service_type.lower())
         if not account_type:
             return {
                 'status': 'error',
@@ -664,6 +2050,11 @@ async def cekrek(phone_number: str, service_type: str, max_retries: int = 3) ->
                 'data': {}
             }
 
+        # Recycled numbers are served again; skip the network while the result is fresh
+        cached = ewallet_cache.get(phone_number, account_type)
+        if cached is not None:
+            return cached
+
         url = "https://kedaimutasi.com/cekrekening/home/validate_account"
         payload = {
             'account_type': account_type,
@@ -692,19 +2083,25 @@ async def cekrek(phone_number: str, service_type: str, max_retries: int = 3) ->
 
                 if status_code == 200:
                     if data.get('status') == 'success':
-                        return {
+                        result = {
                             'status': 'valid',
                             'message': f"✅ Nomor rekening valid untuk {service_type.upper()}!",
                             'account_name': data.get('account_name', 'N/A'),
                             'data': data
                         }
                     else:
-                        return {
+                        result = {
                             'status': 'invalid',
                             'message': f"❌ Nomor rekening tidak valid untuk {service_type.upper()}!",
                             'account_name': 'N/A',
                             'data': data
                         }
+                    ewallet_cache.put(phone_number, account_type, result)
+                    if result['status'] == 'valid':
+                        registered_index.add(phone_number, service_type)
+                    else:
+                        registered_index.discard(phone_number, service_type)
+                    return result
                 elif status_code == 400:
                     retries += 1
                     if retries < max_retries:
@@ -752,6 +2149,78 @@ async def cekrek(phone_number: str, service_type: str, max_retries: int = 3) ->
             'data': {}
         }
 
+# Concurrent multi-wallet validation
+
+
+async def cekrek_multi(phone_number: str, service_types=EWALLET_PROFILE_TYPES, max_concurrency: int = 5) -> Dict:
+    """
+    Check one number against several wallets at once with bounded concurrency.
+    Takes roughly as long as the slowest single check instead of the sum of all checks.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def check(service_type: str):
+        async with semaphore:
+            return service_type, await cekrek(phone_number, service_type)
+
+    results = dict(await asyncio.gather(*(check(service_type) for service_type in service_types)))
+    profile = {
+        'phone_number': phone_number,
+        'registered': [],
+        'not_registered': [],
+        'unknown': [],
+        'results': results
+    }
+    for service_type, result in results.items():
+        if result['status'] == 'valid':
+            profile['registered'].append(service_type)
+        elif result['status'] == 'invalid':
+            profile['not_registered'].append(service_type)
+        else:
+            profile['unknown'].append(service_type)
+    return profile
+
+
+async def check_wallets(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/cekwallet <nomor> [wallet ...] - combined e-wallet registration profile (admin only)"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can check e-wallets! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to check e-wallets")
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            "🔍 Usage: /cekwallet <nomor> [wallet ...]\nExample: /cekwallet 081234567890 dana ovo")
+        return
+
+    phone_number = context.args[0]
+    service_types = [EWALLET_WALLET_ALIASES.get(arg.lower(), arg.lower())
+                     for arg in context.args[1:]] or EWALLET_PROFILE_TYPES
+
+    loading_msg = await update.message.reply_text("⏳ Checking e-wallets...")
+    started = time.perf_counter()
+    profile = await cekrek_multi(phone_number, service_types)
+    elapsed = time.perf_counter() - started
+
+    lines = [f"💳 <b>E-wallet Profile</b> <code>{phone_number}</code>\n"]
+    for service_type, result in profile['results'].items():
+        if result['status'] == 'valid':
+            lines.append(
+                f"✅ {service_type.upper()}: {result.get('account_name', 'N/A')}")
+        elif result['status'] == 'invalid':
+            lines.append(f"❌ {service_type.upper()}: Tidak Terdaftar")
+        else:
+            lines.append(f"❓ {service_type.upper()}: Status Tidak Diketahui")
+    lines.append(f"\n⏱️ {elapsed:.1f}s")
+    await loading_msg.edit_text("\n".join(lines), parse_mode="HTML")
+
+    logger.info(
+        f"User {user_id} checked {len(service_types)} e-wallets for {phone_number}")
+
 # Function to get service type from service ID
 
 
@@ -762,15 +2231,192 @@ def get_service_type(service_id: str) -> str:
             return service_type
     return None
 
+# Background e-wallet validation for freshly placed orders
+
+
+def schedule_ewallet_validation(context: ContextTypes.DEFAULT_TYPE, order_id: str, service_type: str,
+                                service_id: str, service_name: str, number: str, price_display: str,
+                                order_time: str, message_id: int, chat_id: int):
+    """
+    Run cekrek after the order message is sent, edit the registration status into it and
+    switch registered numbers from monitoring to the short e-wallet cancellation. cekrek
+    can retry for a while, so an order that got its SMS or closed meanwhile is left alone.
+    """
+    async def validate():
+        phoneformat62 = number.replace(
+            "62", "0") if number.startswith("62") else number
+        validation_result = await cekrek(phoneformat62, service_type)
+        if validation_result['status'] == 'valid':
+            status_text = " | ✅ Terdaftar"
+        elif validation_result['status'] == 'invalid':
+            status_text = " | ❌ Tidak Terdaftar"
+        else:
+            status_text = " | ❓ Status Tidak Diketahui"
+
+        order = stored_order(order_id)
+        if order_lifecycle.is_closed(order_id) or (order is not None and order.sms):
+            # The monitor already drew the SMS or final status into the message
+            logger.info(
+                f"E-wallet validation for order {order_id}: {validation_result['status']} "
+                f"(order already has SMS or is closed, message kept)")
+            return
+
+        try:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=render_notice(
+                    'placed', service_name=service_name, order_id=order_id,
+                    status_text=status_text, phone_number=number, phone62=phoneformat62,
+                    price=price_display, order_time=order_time),
+                parse_mode="HTML",
+                reply_markup=order_keyboard('pending', order_id, service_id)
+            )
+        except Exception as edit_error:
+            logger.error(
+                f"Failed to edit e-wallet status for order {order_id}: {str(edit_error)}")
+
+        if validation_result['status'] == 'valid':
+            # Registered number: stop waiting for SMS and cancel after the minimum hold time
+            order_lifecycle.stop(order_id, kinds=('monitor', 'auto_cancel'))
+            order_events.emit('cancel_requested', order_id, reason='registered')
+            await schedule_order_cancellation(
+                context, order_id, delay_seconds=min_hold_delay(order_id),
+                message_id=message_id, chat_id=chat_id
+            )
+        logger.info(
+            f"E-wallet validation for order {order_id}: {validation_result['status']}")
+
+    order_lifecycle.track('ewallet', order_id, asyncio.create_task(
+        validate()), message_id, chat_id)
+
+# Cancellation deadlines from provider expiry and observed SMS latency
+
+
+class SmsLatencyStats:
+    """
+    Recent seconds-to-first-SMS per service. A high percentile of these is how long a
+    silent order is still worth holding before it is cancelled.
+    """
+
+    MIN_SAMPLES = 5
+
+    def __init__(self, window: int = 50, path: str = None):
+        self.window = window
+        self.path = path
+        self.services = {}  # {service_id: deque of seconds}
+        self._dirty = False
+        self._last_save = 0.0
+
+    def record(self, service_id: str, seconds: float) -> None:
+        if not service_id or seconds < 0:
+            return
+        self.services.setdefault(service_id, deque(maxlen=self.window)).append(round(seconds, 1))
+        self._dirty = True
+        if time.time() - self._last_save > 60:
+            self.save()
+
+    def percentile(self, service_id: str, q: float = 0.95):
+        """Latency percentile in seconds, None until MIN_SAMPLES first SMS were seen"""
+        samples = self.services.get(service_id)
+        if not samples or len(samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                raw = json.load(f)
+            self.services = {service_id: deque(samples, maxlen=self.window)
+                             for service_id, samples in raw.items()}
+            logger.info(f"Loaded SMS latency for {len(self.services)} services")
+        except Exception as e:
+            logger.error(f"Failed to load SMS latency stats: {str(e)}")
+
+    def save(self) -> None:
+        self._last_save = time.time()
+        if not self.path or not self._dirty:
+            return
+        try:
+            atomic_write_json(self.path, {service_id: list(samples)
+                                          for service_id, samples in self.services.items()})
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"Failed to save SMS latency stats: {str(e)}")
+
+    def snapshot(self) -> dict:
+        return {service_id: {'samples': len(samples), 'p95_s': self.percentile(service_id)}
+                for service_id, samples in self.services.items()}
+
+
+sms_latency_stats = SmsLatencyStats(path=SMS_LATENCY_FILE or None)
+
+
+def note_order_expiry(order_id, expired_at) -> None:
+    """Remember the provider expiredAt (epoch milliseconds) for an order"""
+    order = stored_order(order_id)
+    if expired_at and order is not None:
+        try:
+            order.expires_at = float(expired_at) / 1000
+        except (TypeError, ValueError):
+            pass
+
+
+def order_placed_at(order_id):
+    """Epoch seconds the order was placed, from order storage"""
+    order = stored_order(order_id)
+    return order.placed_at if order is not None else None
+
+
+def no_sms_deadline(service_id: str, placed_at: float, expired_at: float = None) -> float:
+    """
+    When a silent order stops being worth holding: the service's p95 SMS latency plus the
+    safety margin (or NO_SMS_FALLBACK_TIMEOUT until enough SMS were seen), never past the
+    provider expiry minus the margin and never before the provider's minimum hold.
+    """
+    latency = sms_latency_stats.percentile(service_id)
+    if latency is None:
+        deadline = placed_at + NO_SMS_FALLBACK_TIMEOUT
+    else:
+        deadline = placed_at + latency + CANCEL_SAFETY_MARGIN
+    if expired_at:
+        deadline = min(deadline, expired_at - CANCEL_SAFETY_MARGIN)
+    return max(deadline, placed_at + CANCEL_MIN_HOLD)
+
+
+def min_hold_delay(order_id) -> int:
+    """Seconds until the order can be cancelled, counted from placement rather than from now"""
+    placed_at = order_placed_at(order_id)
+    if placed_at is None:
+        return CANCEL_MIN_HOLD
+    return max(0, int(placed_at + CANCEL_MIN_HOLD - time.time()))
+
+
+def format_wait(seconds: float) -> str:
+    seconds = max(0, int(seconds))
+    return f"{seconds // 60} menit" if seconds >= 60 else f"{seconds} detik"
+
 # Enhanced async auto-cancellation
 
 
 async def schedule_auto_cancellation(context: ContextTypes.DEFAULT_TYPE, order_id: str, message_id: int = None, chat_id: int = None):
     """
-    Enhanced schedule an order to be cancelled after 10 minutes if no SMS is received
+    Enhanced schedule an order to be cancelled once no_sms_deadline passes without an SMS
     """
     async def cancel_after_delay():
-        await asyncio.sleep(600)  # 10 minutes = 600 seconds
+        placed_at = order_placed_at(order_id) or time.time()
+        service_id = getattr(stored_order(order_id), 'service_id', None)
+        # Re-evaluated periodically so expiry and latency learned while waiting move the deadline
+        while True:
+            remaining = no_sms_deadline(
+                service_id, placed_at, getattr(stored_order(order_id), 'expires_at', None)) - time.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 30))
+        waited = format_wait(time.time() - placed_at)
 
         # Check if order still has no SMS
         url = f"{BASE_URL}order/status/{order_id}"
@@ -788,26 +2434,27 @@ async def schedule_auto_cancellation(context: ContextTypes.DEFAULT_TYPE, order_i
                     if not sms_data and order_status == 'PENDING':
                         # Cancel the order using enhanced async client
                         cancel_url = f"{BASE_URL}order/{order_id}/1"
-                        cancel_status, cancel_data = await http_client.patch(cancel_url, headers=headers)
+                        outcome = await order_lifecycle.transition(
+                            order_id, 'CANCEL', lambda: http_client.patch(cancel_url, headers=headers))
+                        if outcome is None:
+                            logger.info(f"Order {order_id} already closed, skipping auto-cancellation")
+                            return
+                        cancel_status, cancel_data = outcome
 
                         logger.info(
-                            f"Auto-cancel 10min request for order {order_id}: Status {cancel_status}")
+                            f"Auto-cancel no-SMS request for order {order_id}: Status {cancel_status}")
 
                         if cancel_status == 200 and cancel_data:
                             if cancel_data.get('status'):
                                 logger.info(
-                                    f"Auto-cancelled order {order_id} after 10 minutes - no SMS received")
+                                    f"Auto-cancelled order {order_id} after {waited} - no SMS received")
 
                                 # Try to edit the original message to show auto-cancellation
                                 if message_id and chat_id:
                                     try:
-                                        cancelled_message = (
-                                            f"❌ Pesanan dibatalkan otomatis!\n"
-                                            f"🆔 Order ID: {order_id}\n"
-                                            f"🚫 Alasan: Tidak ada SMS diterima dalam 10 menit\n"
-                                            f"🕒 Dibatalkan pada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                                            f"⏰ Auto-cancelled setelah 10 menit"
-                                        )
+                                        cancelled_message = render_notice(
+                                            'cancelled_no_sms', order_id=order_id, waited=waited,
+                                            stamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
                                         await context.bot.edit_message_text(
                                             chat_id=chat_id,
@@ -822,7 +2469,7 @@ async def schedule_auto_cancellation(context: ContextTypes.DEFAULT_TYPE, order_i
                                         try:
                                             await context.bot.send_message(
                                                 chat_id=chat_id,
-                                                text=f"❌ Order #{order_id} telah dibatalkan otomatis karena tidak ada SMS diterima dalam 10 menit.",
+                                                text=f"❌ Order #{order_id} telah dibatalkan otomatis karena tidak ada SMS diterima dalam {waited}.",
                                                 parse_mode="HTML"
                                             )
                                         except Exception as send_error:
@@ -838,26 +2485,19 @@ async def schedule_auto_cancellation(context: ContextTypes.DEFAULT_TYPE, order_i
             logger.error(
                 f"Exception during auto-cancel check of order {order_id}: {str(e)}")
 
-        # Remove from auto cancel timers
-        if order_id in auto_cancel_timers:
-            del auto_cancel_timers[order_id]
-
     # Store the cancellation task with message info
-    task = asyncio.create_task(cancel_after_delay())
-    auto_cancel_timers[order_id] = {
-        'task': task,
-        'message_id': message_id,
-        'chat_id': chat_id
-    }
+    order_lifecycle.track('auto_cancel', order_id, asyncio.create_task(
+        cancel_after_delay()), message_id, chat_id)
 
 # Enhanced async order cancellation
 
 
-async def schedule_order_cancellation(context: ContextTypes.DEFAULT_TYPE, order_id: str, delay_seconds: int = 130, message_id: int = None, chat_id: int = None):
+async def schedule_order_cancellation(context: ContextTypes.DEFAULT_TYPE, order_id: str, delay_seconds: int = CANCEL_MIN_HOLD, message_id: int = None, chat_id: int = None):
     """
-    Enhanced schedule an order to be cancelled after specified delay (default 2 minutes 10 seconds)
+    Enhanced schedule an order to be cancelled after specified delay (default CANCEL_MIN_HOLD)
     """
     async def cancel_after_delay():
+        placed_at = order_placed_at(order_id) or time.time()
         await asyncio.sleep(delay_seconds)
 
         # Cancel the order
@@ -865,7 +2505,12 @@ async def schedule_order_cancellation(context: ContextTypes.DEFAULT_TYPE, order_
         url = f"{BASE_URL}order/{order_id}/1"
 
         try:
-            status_code, data = await http_client.patch(url, headers=headers)
+            outcome = await order_lifecycle.transition(
+                order_id, 'CANCEL', lambda: http_client.patch(url, headers=headers))
+            if outcome is None:
+                logger.info(f"Order {order_id} already closed, skipping cancellation")
+                return
+            status_code, data = outcome
             logger.info(
                 f"Cancel request for order {order_id}: Status {status_code}")
 
@@ -877,13 +2522,10 @@ async def schedule_order_cancellation(context: ContextTypes.DEFAULT_TYPE, order_
                     # Try to edit the original message to show auto-cancellation
                     if message_id and chat_id:
                         try:
-                            cancelled_message = (
-                                f"❌ Pesanan dibatalkan otomatis!\n"
-                                f"🆔 Order ID: {order_id}\n"
-                                f"🚫 Alasan: Nomor sudah terdaftar pada e-wallet\n"
-                                f"🕒 Dibatalkan pada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                                f"⏰ Auto-cancelled setelah {delay_seconds} detik"
-                            )
+                            cancelled_message = render_notice(
+                                'cancelled_registered', order_id=order_id,
+                                delay_seconds=int(time.time() - placed_at),
+                                stamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
                             await context.bot.edit_message_text(
                                 chat_id=chat_id,
@@ -914,23 +2556,276 @@ async def schedule_order_cancellation(context: ContextTypes.DEFAULT_TYPE, order_
             logger.error(
                 f"Exception during auto-cancel of order {order_id}: {str(e)}")
 
-        # Remove from pending cancellations
-        if order_id in pending_cancellations:
-            del pending_cancellations[order_id]
-
     # Store the cancellation task with message info
-    task = asyncio.create_task(cancel_after_delay())
-    pending_cancellations[order_id] = {
-        'task': task,
-        'message_id': message_id,
-        'chat_id': chat_id
-    }
+    order_lifecycle.track('pending_cancel', order_id, asyncio.create_task(
+        cancel_after_delay()), message_id, chat_id)
 
 # Validate environment variables
-if not API_KEY or not TELEGRAM_TOKEN or not AUTHORIZED_IDS:
+if not API_KEY or not TELEGRAM_TOKEN:
     raise ValueError(
         "Please set SMSVIRTUAL_API_KEY, TELEGRAM_BOT_TOKEN, and AUTHORIZED_IDS in your .env file.")
 
+# Compressed, indexed log segments (rotated bot.log and logorder.txt)
+
+
+class LogSegmentArchive:
+    """
+    Rotated log files become gzip segments named after the time range they cover. Each
+    segment is a series of independent gzip members of ~block_bytes, and a sidecar
+    .idx maps every order/user id (any 6+ digit number) in it to the members that
+    mention it, so a trace decompresses only those blocks. Compression runs in a
+    worker thread; the caller only renames the file.
+    """
+
+    ID_PATTERN = re.compile(rb"(?<!\d)\d{6,}(?!\d)")
+    STAMP = '%Y%m%d%H%M%S'
+    INDEX_CACHE_SIZE = 32
+
+    def __init__(self, directory: str, block_bytes: int):
+        self.directory = directory
+        self.block_bytes = block_bytes
+        self.segments_written = 0
+        self._indexes = OrderedDict()  # Recently used sidecars {segment path: index}
+        self._indexes_lock = Lock()
+
+    def stage(self, path: str, source: str) -> None:
+        """Move path aside and compress it into a segment in the background"""
+        os.makedirs(self.directory, exist_ok=True)
+        pending = os.path.join(self.directory, f"{source}-{time.time_ns()}.pending")
+        os.replace(path, pending)
+        Thread(target=self.compress, args=(pending, source), daemon=True).start()
+
+    def rotator(self, source: str, dest: str) -> None:
+        """RotatingFileHandler.rotator: segment bot.log instead of keeping .1 ... .N backups"""
+        self.stage(source, "bot")
+
+    def resume(self) -> None:
+        """Compress segments left pending by a previous run"""
+        for pending in glob.glob(os.path.join(self.directory, "*.pending")):
+            source = os.path.basename(pending).split("-", 1)[0]
+            Thread(target=self.compress, args=(pending, source), daemon=True).start()
+
+    @staticmethod
+    def line_time(line: bytes):
+        if line.startswith(b'{"ts": "'):
+            line = line[8:]  # LOG_FORMAT=json
+        try:
+            return datetime.strptime(line[:19].decode('ascii'), '%Y-%m-%d %H:%M:%S')
+        except (UnicodeDecodeError, ValueError):
+            return None
+
+    def compress(self, pending: str, source: str) -> None:
+        try:
+            blocks, ids, block, first, last = [], {}, [], None, None
+
+            def close_block():
+                data = b"".join(block)
+                for key in set(self.ID_PATTERN.findall(data)):
+                    ids.setdefault(key.decode(), []).append(len(blocks))
+                blocks.append(gzip.compress(data, compresslevel=6))
+                block.clear()
+
+            size = 0
+            with open(pending, "rb") as f:
+                for line in f:
+                    stamp = self.line_time(line)
+                    if stamp:
+                        first = first or stamp
+                        last = stamp
+                    block.append(line)
+                    size += len(line)
+                    if size >= self.block_bytes:
+                        close_block()
+                        size = 0
+            if block:
+                close_block()
+            if not blocks:
+                os.remove(pending)
+                return
+
+            fallback = datetime.fromtimestamp(os.path.getmtime(pending))
+            name = f"{source}-{(first or fallback).strftime(self.STAMP)}-{(last or fallback).strftime(self.STAMP)}"
+            path = os.path.join(self.directory, f"{name}.log.gz")
+            counter = 1
+            while os.path.exists(path):
+                path = os.path.join(self.directory, f"{name}-{counter}.log.gz")
+                counter += 1
+
+            offsets, offset = [], 0
+            with open(f"{path}.tmp", "wb") as f:
+                for member in blocks:
+                    offsets.append(offset)
+                    f.write(member)
+                    offset += len(member)
+            offsets.append(offset)
+            atomic_write_json(f"{path}.idx", {'offsets': offsets, 'ids': ids})
+            os.replace(f"{path}.tmp", path)
+            os.remove(pending)
+            self.segments_written += 1
+            logger.info(f"🗜️ Archived {source} log segment {os.path.basename(path)} ({len(blocks)} blocks)")
+        except Exception as e:
+            logger.error(f"Failed to archive log segment {pending}: {str(e)}")
+
+    def segments(self, since: datetime = None, until: datetime = None) -> list:
+        """Segment paths overlapping [since, until], oldest first"""
+        selected = []
+        for path in glob.glob(os.path.join(self.directory, "*.log.gz")):
+            parts = os.path.basename(path)[:-len(".log.gz")].split("-")
+            try:
+                first = datetime.strptime(parts[1], self.STAMP)
+                last = datetime.strptime(parts[2], self.STAMP)
+            except (IndexError, ValueError):
+                continue
+            if (until and first > until) or (since and last < since):
+                continue
+            selected.append((first, path))
+        return [path for _, path in sorted(selected)]
+
+    def index(self, path: str) -> dict:
+        with self._indexes_lock:
+            index = self._indexes.get(path)
+            if index is not None:
+                self._indexes.move_to_end(path)
+                return index
+        with open(f"{path}.idx", "r", encoding='utf-8') as f:
+            index = json.load(f)
+        with self._indexes_lock:
+            self._indexes[path] = index
+            if len(self._indexes) > self.INDEX_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+        return index
+
+    def search(self, key: str, since: datetime = None, until: datetime = None):
+        """Yield (segment name, line) for lines mentioning key, oldest first"""
+        pattern = re.compile(rb"(?<!\d)" + re.escape(key.encode()) + rb"(?!\d)")
+        for path in self.segments(since, until):
+            try:
+                index = self.index(path)
+                members = index['ids'].get(key)
+                if not members:
+                    continue
+                offsets = index['offsets']
+                with open(path, "rb") as f:
+                    for member in members:
+                        f.seek(offsets[member])
+                        data = gzip.decompress(f.read(offsets[member + 1] - offsets[member]))
+                        for line in data.splitlines():
+                            if pattern.search(line):
+                                yield os.path.basename(path), line.decode('utf-8', errors='replace')
+            except Exception as e:
+                logger.error(f"Failed to search log segment {path}: {str(e)}")
+
+    def snapshot(self) -> dict:
+        return {'segments': len(glob.glob(os.path.join(self.directory, "*.log.gz"))),
+                'written': self.segments_written}
+
+
+log_segments = LogSegmentArchive(LOG_ARCHIVE_DIR, LOG_BLOCK_BYTES)
+
+
+def rotate_order_history(path: str = "logorder.txt") -> bool:
+    """Segment logorder.txt once it holds rows from a previous day or grows past ORDER_LOG_SEGMENT_BYTES"""
+    try:
+        if os.path.getsize(path) <= len(ORDER_LOG_HEADER) + 1:
+            return False
+        with open(path, "rb") as f:
+            f.readline()
+            first = LogSegmentArchive.line_time(f.readline())
+        if os.path.getsize(path) < ORDER_LOG_SEGMENT_BYTES and (first is None or first.date() == datetime.now().date()):
+            return False
+        log_segments.stage(path, "orders")
+        with open(path, "w", encoding='utf-8') as f:
+            f.write(ORDER_LOG_HEADER + "\n")
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def search_live_log(path: str, key: str) -> list:
+    """Lines of a not yet archived log file mentioning key"""
+    pattern = re.compile(rb"(?<!\d)" + re.escape(key.encode()) + rb"(?!\d)")
+    needle = key.encode()
+    try:
+        with open(path, "rb") as f:
+            return [line.rstrip(b"\n").decode('utf-8', errors='replace')
+                    for line in f if needle in line and pattern.search(line)]
+    except FileNotFoundError:
+        return []
+
+
+async def run_log_rotation() -> None:
+    """Background job: segment the order history every day"""
+    while True:
+        await asyncio.sleep(600)
+        try:
+            rotate_order_history()
+        except Exception as e:
+            logger.error(f"Order history rotation failed: {str(e)}")
+
+# Non-blocking logging: callers only enqueue, a listener thread formats and writes
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line; 'ts' first so segments and /trace can read the time"""
+
+    def format(self, record) -> str:
+        entry = {'ts': self.formatTime(record), 'level': record.levelname, 'msg': record.getMessage(),
+                 'where': f"{record.funcName}:{record.lineno}"}
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RepeatRateLimiter(logging.Filter):
+    """
+    Let at most `limit` identical records (same call site and text) through per window;
+    the first one of the next window carries how many were dropped. This includes
+    warnings and errors, since per-poll HTTP and monitor failures are the usual floods.
+    Distinct lines - every order id /trace looks for - always pass, as does CRITICAL.
+    """
+
+    MAX_KEYS = 10000
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.sites = {}  # {(lineno, message): [window start, passed, suppressed]}
+        self.suppressed_total = 0
+
+    def filter(self, record) -> bool:
+        if not self.limit or record.levelno >= logging.CRITICAL:
+            return True
+        key = (record.lineno, record.getMessage())
+        site = self.sites.get(key)
+        if site is None or record.created - site[0] >= self.window:
+            suppressed = site[2] if site else 0
+            if site is None and len(self.sites) >= self.MAX_KEYS:
+                self.sites = {k: v for k, v in self.sites.items() if record.created - v[0] < self.window}
+                if len(self.sites) >= self.MAX_KEYS:
+                    self.sites = {}  # All distinct and recent: nothing repetitive to remember
+            self.sites[key] = [record.created, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+                record.msg = f"{record.msg} [+{suppressed} similar suppressed]"
+            return True
+        if site[1] < self.limit:
+            site[1] += 1
+            return True
+        site[2] += 1
+        self.suppressed_total += 1
+        return False
+
+
+class EnqueueHandler(QueueHandler):
+    """QueueHandler that skips formatting on the caller's thread; the listener formats"""
+
+    def prepare(self, record):
+        return record
+
+
 # Setup colorful logging
 logger = colorlog.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -944,11 +2839,193 @@ console_handler.setFormatter(colorlog.ColoredFormatter(
 console_handler.stream = open(
     sys.stdout.fileno(), mode='w', encoding='utf-8', errors='replace')
 file_handler = RotatingFileHandler("bot.log", maxBytes=10485760, backupCount=5)
+file_handler.rotator = log_segments.rotator  # Rotated files become indexed gzip segments
 file_handler.setFormatter(logging.Formatter(
     "%(asctime)s - %(levelname)s - %(message)s"))
-logger.addHandler(console_handler)
+if LOG_FORMAT == "json":
+    console_handler.setFormatter(JsonLogFormatter())
+    file_handler.setFormatter(JsonLogFormatter())
 file_handler.setLevel(logging.INFO)
-logger.addHandler(file_handler)
+
+# Console output, file writes and rotation happen on the listener thread
+log_rate_limiter = RepeatRateLimiter(LOG_RATE_LIMIT, LOG_RATE_WINDOW)
+log_queue = queue.SimpleQueue()
+queue_handler = EnqueueHandler(log_queue)
+queue_handler.addFilter(log_rate_limiter)
+logger.addHandler(queue_handler)
+log_listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+log_listener.start()
+
+# Authorization store (roles and per-user quotas)
+
+
+class AuthorizationStore:
+    """
+    In-memory registry of authorized users persisted to a JSON file with atomic rename.
+    Each entry is {'role': 'user' | 'admin', 'quota': int | None}, where quota is the
+    maximum number of orders per day (None = unlimited). Today's order counts are saved
+    in the same file so a restart does not reset anyone's quota; consuming quota only
+    marks the store dirty and is written at most once a minute and on shutdown. A file
+    that fails to parse is copied to .bak and never overwritten by this process.
+    """
+
+    ROLES = ('user', 'admin')
+
+    def __init__(self, path: str = AUTH_STORE_FILE):
+        self.path = path
+        self.users = {}  # {user_id: {'role': str, 'quota': int | None}}
+        self._ordered_ids = None  # Cached listing order for admin pagination
+        self._usage_day = None
+        self._usage = {}  # {user_id: orders placed today}
+        self._dirty = False
+        self._last_save = 0.0
+        self._read_only = False  # Set when the file on disk could not be parsed
+
+    def load(self, seed_user_ids=(), seed_admin_ids=()):
+        """Load users from disk, seeding from .env on first run"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding='utf-8') as f:
+                    raw = json.load(f)
+                self.users = {
+                    str(uid): {
+                        'role': entry.get('role', 'user') if entry.get('role') in self.ROLES else 'user',
+                        'quota': entry.get('quota')
+                    }
+                    for uid, entry in raw.get('users', {}).items()
+                }
+                usage = raw.get('usage') or {}
+                self._usage_day = usage.get('day')
+                self._usage = {str(uid): int(count) for uid, count in usage.get('orders', {}).items()}
+                seed_user_ids = ()
+        except Exception as e:
+            # Keep the file (and a .bak copy) for manual repair; .env seeds only live in memory
+            self._read_only = True
+            self.users = {}
+            self._usage_day, self._usage = None, {}
+            try:
+                shutil.copy2(self.path, self.path + ".bak")
+            except OSError as copy_error:
+                logger.error(f"Failed to back up authorization store: {str(copy_error)}")
+            logger.error(
+                f"Failed to load authorization store {self.path}: {str(e)}. Copied to {self.path}.bak; "
+                f"running with .env users only and not saving changes until the file is fixed")
+
+        changed = False
+        for uid in seed_user_ids:
+            uid = uid.strip()
+            if uid and uid not in self.users:
+                self.users[uid] = {'role': 'user', 'quota': None}
+                changed = True
+        # Admins from .env are always admins so access can be recovered
+        for uid in seed_admin_ids:
+            uid = uid.strip()
+            if uid and self.users.get(uid, {}).get('role') != 'admin':
+                entry = self.users.setdefault(uid, {'role': 'user', 'quota': None})
+                entry['role'] = 'admin'
+                changed = True
+
+        self._ordered_ids = None
+        if changed or not os.path.exists(self.path):
+            self.save()
+        logger.info(f"Loaded {len(self.users)} authorized users from store")
+
+    def save(self) -> bool:
+        if self._read_only:
+            logger.error(f"Not saving authorization store: {self.path} failed to load and is kept as is")
+            return False
+        try:
+            atomic_write_json(self.path, {
+                'users': self.users,
+                'usage': {'day': self._usage_day, 'orders': self._usage}
+            })
+            self._dirty = False
+            self._last_save = time.time()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save authorization store: {str(e)}")
+            return False
+
+    def flush(self) -> None:
+        """Write pending quota usage, called on shutdown"""
+        if self._dirty:
+            self.save()
+
+    def is_authorized(self, user_id: str) -> bool:
+        return user_id in self.users
+
+    def is_admin(self, user_id: str) -> bool:
+        entry = self.users.get(user_id)
+        return entry is not None and entry['role'] == 'admin'
+
+    def add_user(self, user_id: str, role: str = 'user', quota=None) -> bool:
+        """Add a user, returns False if already authorized"""
+        if user_id in self.users:
+            return False
+        self.users[user_id] = {'role': role, 'quota': quota}
+        self._ordered_ids = None
+        self.save()
+        return True
+
+    def remove_user(self, user_id: str) -> bool:
+        if self.users.pop(user_id, None) is None:
+            return False
+        self._usage.pop(user_id, None)
+        self._ordered_ids = None
+        self.save()
+        return True
+
+    def set_role(self, user_id: str, role: str) -> bool:
+        if role not in self.ROLES or user_id not in self.users:
+            return False
+        self.users[user_id]['role'] = role
+        self.save()
+        return True
+
+    def set_quota(self, user_id: str, quota) -> bool:
+        if user_id not in self.users:
+            return False
+        self.users[user_id]['quota'] = quota
+        self.save()
+        return True
+
+    def _roll_usage_day(self):
+        today = datetime.now().strftime('%Y-%m-%d')
+        if self._usage_day != today:
+            self._usage_day = today
+            self._usage = {}
+
+    def remaining_quota(self, user_id: str):
+        """Orders left today for user_id, None if unlimited"""
+        entry = self.users.get(user_id)
+        if entry is None:
+            return 0
+        if entry['quota'] is None:
+            return None
+        self._roll_usage_day()
+        return max(0, entry['quota'] - self._usage.get(user_id, 0))
+
+    def consume_quota(self, user_id: str, amount: int = 1) -> None:
+        self._roll_usage_day()
+        self._usage[user_id] = self._usage.get(user_id, 0) + amount
+        self._dirty = True
+        if time.time() - self._last_save > 60:
+            self.save()
+
+    def list_page(self, page: int = 1, per_page: int = 10):
+        """Return (user_ids on page, total) without touching disk"""
+        if self._ordered_ids is None:
+            self._ordered_ids = list(self.users)
+        start = (page - 1) * per_page
+        return self._ordered_ids[start:start + per_page], len(self._ordered_ids)
+
+
+auth_store = AuthorizationStore()
+auth_store.load(AUTHORIZED_IDS, ADMIN_IDS)
+
+if not auth_store.users:
+    raise ValueError(
+        "Please set AUTHORIZED_IDS in your .env file or add users to the authorization store.")
 
 
 def log_user_id(user_id: str) -> None:
@@ -969,14 +3046,7 @@ def log_user_id(user_id: str) -> None:
 
 
 def get_user_list(page=1, per_page=10):
-    with open(".env", "r", encoding='utf-8') as f:
-        for line in f:
-            if line.startswith("AUTHORIZED_IDS="):
-                ids = line.strip().split("=")[1].split(",")
-                start = (page - 1) * per_page
-                end = start + per_page
-                return ids[start:end], len(ids)
-    return [], 0
+    return auth_store.list_page(page, per_page)
 
 
 def get_service_list(page=1, per_page=10):
@@ -992,22 +3062,8 @@ def get_service_list(page=1, per_page=10):
         return [], 0
 
 
-def delete_user_from_env(user_id):
-    with open(".env", "r", encoding='utf-8') as f:
-        lines = f.readlines()
-    new_lines = []
-    for line in lines:
-        if line.startswith("AUTHORIZED_IDS="):
-            ids = line.strip().split("=")[1].split(",")
-            ids = [id for id in ids if id != user_id]
-            new_line = f"AUTHORIZED_IDS={','.join(ids)}\n"
-            new_lines.append(new_line)
-        else:
-            new_lines.append(line)
-    with open(".env", "w", encoding='utf-8') as f:
-        f.writelines(new_lines)
-    if user_id in AUTHORIZED_IDS:
-        AUTHORIZED_IDS.remove(user_id)
+def delete_user(user_id):
+    return auth_store.remove_user(user_id)
 
 
 def delete_service_from_txt(service_id):
@@ -1054,7 +3110,7 @@ async def show_list(query, context, type, page=1):
 async def check_authorized(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     user_id = str(update.effective_user.id)
     log_user_id(user_id)
-    if user_id not in AUTHORIZED_IDS:
+    if not auth_store.is_authorized(user_id):
         await update.message.reply_text("🚫 Oops! You don't have access yet. Please contact an admin to get started! 😊")
         logger.warning(f"Unauthorized access attempt by user ID: {user_id}")
         return False
@@ -1258,7 +3314,7 @@ async def order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def order_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(query.from_user.id)
-    if user_id not in AUTHORIZED_IDS:
+    if not auth_store.is_authorized(user_id):
         await query.message.reply_text("🚫 Akses ditolak! Silakan hubungi admin untuk mendapatkan akses. 😊")
         logger.warning(f"Unauthorized access attempt by user ID: {user_id}")
         return
@@ -1289,224 +3345,722 @@ async def order_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     logger.info(f"User {user_id} clicked Order Service button")
 
-# Enhanced async place_order function
-
+# Background price and availability prefetcher
 
-async def place_order(query, context: ContextTypes.DEFAULT_TYPE, service_id: str) -> None:
-    user_id = str(query.from_user.id)
 
-    # Get service name from serviceotp.txt
-    service_name = "Unknown Service"
+def read_service_list() -> list:
+    """[(service_id, service_name)] from serviceotp.txt"""
     try:
         with open("serviceotp.txt", "r", encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split(maxsplit=1)
-                if len(parts) == 2 and parts[0] == service_id:
-                    service_name = parts[1]
-                    break
+            return [tuple(parts) for parts in (line.strip().split(maxsplit=1) for line in f) if len(parts) == 2]
     except FileNotFoundError:
-        pass
+        return []
+
+
+class PriceSnapshot:
+    """Latest price/availability payload per service, refreshed in the background"""
+
+    def __init__(self, interval: int, concurrency: int, max_age: int):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.max_age = max_age
+        self.entries = {}  # {service_id: {'data': price_data, 'fetched_at': epoch seconds}}
+        self.last_cycle = None
+        self.failures = 0
+
+    def store(self, service_id: str, price_data) -> float:
+        fetched_at = time.time()
+        self.entries[service_id] = {'data': price_data, 'fetched_at': fetched_at}
+        return fetched_at
+
+    def get(self, service_id: str, max_age: int = None):
+        """Snapshot entry if it is younger than max_age seconds, else None"""
+        entry = self.entries.get(service_id)
+        max_age = self.max_age if max_age is None else max_age
+        if entry is None or time.time() - entry['fetched_at'] > max_age:
+            return None
+        return entry
+
+    async def refresh_service(self, service_id: str, semaphore: asyncio.Semaphore) -> None:
+        # Jitter spreads the burst so the provider never sees every service at once
+        await asyncio.sleep(random.uniform(0, self.interval * 0.2))
+        async with semaphore:
+            status_code, data = await http_client.get(
+                f"{BASE_URL}price/{service_id}/", {"X-Api-Key": API_KEY})
+        if status_code == 200 and data and data.get('status') and data.get('data'):
+            self.store(service_id, data['data'])
+        else:
+            self.failures += 1
 
-    url_price = f"{BASE_URL}price/{service_id}/"
-    headers = {"X-Api-Key": API_KEY}
+    async def run(self) -> None:
+        """Refresh every configured service forever"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            service_ids = [service_id for service_id, _ in read_service_list()]
+            try:
+                await asyncio.gather(*(self.refresh_service(service_id, semaphore)
+                                       for service_id in service_ids))
+                # Drop services that were removed from serviceotp.txt
+                for service_id in set(self.entries) - set(service_ids):
+                    del self.entries[service_id]
+                self.last_cycle = time.time()
+            except Exception as e:
+                logger.error(f"Price prefetch cycle failed: {str(e)}")
+            await asyncio.sleep(self.interval)
 
-    try:
-        # Enhanced async price retrieval
-        status_code, data = await http_client.get(url_price, headers)
+    def snapshot(self) -> dict:
+        now = time.time()
+        ages = [now - entry['fetched_at'] for entry in self.entries.values()]
+        return {
+            'services': len(self.entries),
+            'oldest_age_s': round(max(ages), 1) if ages else None,
+            'last_cycle': datetime.fromtimestamp(self.last_cycle).isoformat() if self.last_cycle else None,
+            'failures': self.failures
+        }
 
-        if status_code != 200:
-            await query.message.reply_text(f"❌ Gagal mengambil harga: HTTP Error {status_code}")
+
+price_snapshot = PriceSnapshot(
+    PRICE_REFRESH_INTERVAL, PRICE_REFRESH_CONCURRENCY, PRICE_MAX_AGE)
+
+
+async def get_price_data(service_id: str):
+    """
+    Price data from the prefetch snapshot, falling back to a live request.
+    Returns (status_code, data, fetched_at) shaped like http_client.get.
+    """
+    entry = price_snapshot.get(service_id)
+    if entry is not None:
+        return 200, {'status': True, 'data': entry['data']}, entry['fetched_at']
+
+    status_code, data = await http_client.get(f"{BASE_URL}price/{service_id}/", {"X-Api-Key": API_KEY})
+    fetched_at = time.time()
+    if status_code == 200 and data and data.get('status') and data.get('data'):
+        fetched_at = price_snapshot.store(service_id, data['data'])
+    return status_code, data, fetched_at
+
+
+def format_freshness(fetched_at: float) -> str:
+    age = max(0, int(time.time() - fetched_at))
+    return f"{datetime.fromtimestamp(fetched_at).strftime('%Y-%m-%d %H:%M:%S')} ({age}s ago)"
+
+# Learned starting tier for the customPrice ladder
+
+
+class PriceTierStats:
+    """
+    Per-service success counts for each price tier, split by how many numbers the
+    provider reported as available. Used to start the ladder at the cheapest tier that
+    is likely to succeed instead of always at the cheapest tier.
+    """
+
+    AVAILABLE_BUCKETS = (0, 10, 100, 1000)
+
+    def __init__(self, min_success: float, path: str = None):
+        self.min_success = min_success
+        self.path = path
+        # {service_id: {price_key: {'all': [successes, attempts], bucket: [successes, attempts]}}}
+        self.services = {}
+        self._dirty = False
+        self._last_save = 0.0
+
+    @classmethod
+    def _bucket(cls, available) -> str:
+        try:
+            available = int(available)
+        except (TypeError, ValueError):
+            return 'unknown'
+        for limit in reversed(cls.AVAILABLE_BUCKETS):
+            if available >= limit:
+                return f">={limit}"
+        return 'unknown'
+
+    @staticmethod
+    def _price_key(price) -> str:
+        return f"{float(price):.5f}"
+
+    def success_rate(self, service_id: str, price, available) -> float:
+        """Laplace-smoothed success rate; unseen tiers score 0.5"""
+        tier = self.services.get(service_id, {}).get(self._price_key(price))
+        if not tier:
+            return 0.5
+        successes, attempts = tier.get(self._bucket(available), (0, 0))
+        # Fall back to the tier-wide rate until the availability bucket has data
+        if attempts < 3:
+            successes, attempts = tier['all']
+        return (successes + 1) / (attempts + 2)
+
+    def start_index(self, service_id: str, prices, available) -> int:
+        """Index of the cheapest tier expected to succeed, else the most promising one"""
+        rates = [self.success_rate(service_id, price, available)
+                 for price in prices]
+        for i, rate in enumerate(rates):
+            if rate >= self.min_success:
+                return i
+        return max(range(len(rates)), key=lambda i: (rates[i], -i))
+
+    def record(self, service_id: str, price, available, success: bool) -> None:
+        tier = self.services.setdefault(service_id, {}).setdefault(
+            self._price_key(price), {'all': [0, 0]})
+        for key in ('all', self._bucket(available)):
+            counts = tier.setdefault(key, [0, 0])
+            counts[0] += 1 if success else 0
+            counts[1] += 1
+        self._dirty = True
+        if time.time() - self._last_save > 60:
+            self.save()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
             return
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                self.services = json.load(f)
+            logger.info(
+                f"Loaded price tier stats for {len(self.services)} services")
+        except Exception as e:
+            logger.error(f"Failed to load price tier stats: {str(e)}")
 
-        if not (data and data.get('status') and data.get('data')):
-            await query.message.reply_text("❌ Data harga tidak tersedia untuk layanan ini!")
+    def save(self) -> None:
+        self._last_save = time.time()
+        if not self.path or not self._dirty:
             return
+        try:
+            atomic_write_json(self.path, self.services)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"Failed to save price tier stats: {str(e)}")
 
-        price_data = data['data']
-        country_data = next(
-            (item for item in price_data if item.get('country') == 7), None)
 
-        if not country_data:
-            await query.message.reply_text("❌ Data harga untuk negara ID 7 tidak ditemukan!")
+price_tier_stats = PriceTierStats(
+    PRICE_TIER_MIN_SUCCESS, PRICE_TIER_STATS_FILE or None)
+
+# Order placement shared by single orders and /bulkorder
+
+
+class OrderRateLimiter:
+    """Token bucket shared by every order POST so bulk fan-out cannot burst the provider"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
             return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
-        # Prepare pricing for order attempts
-        standard_price = country_data.get('priceUsd', 0)
-        custom_prices = country_data.get('customPrice', [])
 
-        if custom_prices:
-            prices_to_try = sorted(
-                [cp.get('price', cp.get('amount', standard_price)) for cp in custom_prices])
-        else:
-            prices_to_try = [standard_price]
-
-        max_attempts = min(3, len(prices_to_try))
-        min_price = min(prices_to_try)
-        max_price = max(prices_to_try)
-
-        # Start order attempts
-        for attempt in range(max_attempts):
-            custom_price = prices_to_try[attempt]
-            payload = {
-                "country": 7,
-                "service": int(service_id),
-                "operator": "",
-                "customPrice": custom_price + 0.00002,
-                "rangePrice": {"min": min_price, "max": max_price}
-            }
+order_rate_limiter = OrderRateLimiter(ORDER_RATE_LIMIT, ORDER_RATE_BURST)
 
-            order_url = "https://api.smsvirtual.co/v1/order/"
-            headers_order = {**headers, "Content-Type": "application/json"}
 
-            # Use enhanced async client for order
-            status_code, order_data = await http_client.post(order_url, json_data=payload, headers=headers_order)
+class OrderAttempt(NamedTuple):
+    """Outcome of one walk up the customPrice ladder"""
+    order: Optional[dict]  # order_data['data'] on success
+    error: str  # User-facing message, empty on success
+    no_number: bool  # True when every tier answered "no number"
+    attempt: int
+    tier: int
 
-            if status_code == 200 and order_data:
-                if order_data.get('status'):
-                    # Order successful
-                    order_id = order_data['data'].get('id', 'N/A')
-                    number = order_data['data'].get('phone', 'N/A')
-                    phoneformat62 = number.replace(
-                        "62", "0") if number.startswith("62") else number
-                    price = order_data['data'].get('price', 'N/A')
-
-                    # Check if the service requires account validation
-                    service_type = get_service_type(service_id)
-                    status_text = ""
-
-                    if service_type:
-                        validation_result = await cekrek(phoneformat62, service_type)
-                        if validation_result['status'] == 'valid':
-                            status_text = " | ✅ Terdaftar"
-                            await schedule_order_cancellation(context, order_id)
-                        elif validation_result['status'] == 'invalid':
-                            status_text = " | ❌ Tidak Terdaftar"
-                        else:
-                            status_text = " | ❓ Status Tidak Diketahui"
-
-                    message = (
-                        f"✅ Pesanan berhasil {service_name}!\n"
-                        f"🆔 Order ID: {order_id}{status_text}\n"
-                        f"📞 Nomor: <code>{number}</code> | <code>{phoneformat62}</code>\n"
-                        f"💵 Harga: ${price:.5f}\n"
-                        f"🕒 Dipesan pada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                    )
 
-                    # Add action buttons for successful order
-                    action_buttons = [
-                        [
-                            InlineKeyboardButton(
-                                "❌ Batalkan OTP", callback_data=f"cancel_order_{order_id}"),
-                            InlineKeyboardButton(
-                                "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
-                        ],
-                        [
-                            InlineKeyboardButton(
-                                "🔄 Resend", callback_data=f"resend_order_{order_id}"),
-                            InlineKeyboardButton(
-                                "📱 Get SMS", callback_data=f"get_sms_{order_id}")
-                        ],
-                        [
-                            InlineKeyboardButton(
-                                f"🔄 Order Again", callback_data=f"order_service_{service_id}")
-                        ]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(action_buttons)
-
-                    sent_message = await query.message.reply_text(message, parse_mode="HTML", reply_markup=reply_markup)
-
-                    # Schedule appropriate cancellation/monitoring
-                    if service_type and status_text == " | ✅ Terdaftar":
-                        await schedule_order_cancellation(
-                            context, order_id, delay_seconds=130,
-                            message_id=sent_message.message_id, chat_id=sent_message.chat_id
-                        )
-                    else:
-                        await schedule_auto_cancellation(
-                            context, order_id,
-                            message_id=sent_message.message_id, chat_id=sent_message.chat_id
-                        )
-                        await monitor_order_sms(
-                            context, order_id, sent_message.message_id, sent_message.chat_id, initial_sms_count=0
-                        )
-
-                    # Log order
-                    try:
-                        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        log_entry = f"{timestamp},{user_id},{order_id},{service_id},{service_name},{number},{price:.5f},ORDERED,\n"
-                        with open("logorder.txt", "a", encoding='utf-8') as f:
-                            f.write(log_entry)
-                    except Exception as e:
-                        logger.error(
-                            f"Failed to log order {order_id}: {str(e)}")
-
-                    # Store order information
-                    store_order_info(order_id, service_id,
-                                     service_name, number, price, user_id)
-                    logger.info(
-                        f"User {user_id} placed an order for service {service_id} on attempt {attempt+1}")
-                    return
-                else:
-                    # If failed, check if it's due to "no number"
-                    error_message = order_data.get(
-                        'message', 'Kesalahan tidak diketahui')
-                    if "no number" not in error_message.lower():
-                        await query.message.reply_text(f"⚠️ Gagal: {error_message}")
-                        return
+def get_service_name(service_id: str) -> str:
+    return next((name for sid, name in read_service_list() if sid == service_id), "Unknown Service")
+
+
+async def load_order_prices(service_id: str):
+    """(country_data, prices_to_try, error) for country 7; error is a user-facing message"""
+    status_code, data, _ = await get_price_data(service_id)
+
+    if status_code != 200:
+        return None, [], f"❌ Gagal mengambil harga: HTTP Error {status_code}"
+
+    if not (data and data.get('status') and data.get('data')):
+        return None, [], "❌ Data harga tidak tersedia untuk layanan ini!"
+
+    country_data = next(
+        (item for item in data['data'] if item.get('country') == 7), None)
+
+    if not country_data:
+        return None, [], "❌ Data harga untuk negara ID 7 tidak ditemukan!"
+
+    standard_price = country_data.get('priceUsd', 0)
+    custom_prices = country_data.get('customPrice', [])
+
+    if custom_prices:
+        prices_to_try = sorted(
+            [cp.get('price', cp.get('amount', standard_price)) for cp in custom_prices])
+    else:
+        prices_to_try = [standard_price]
+
+    if ORDER_PRICE_CAP:
+        prices_to_try = [
+            p for p in prices_to_try if p <= ORDER_PRICE_CAP]
+        if not prices_to_try:
+            return None, [], f"❌ Semua harga di atas batas ${ORDER_PRICE_CAP:.5f}!"
+
+    return country_data, prices_to_try, ""
+
+
+def order_ladder(service_id: str, country_data: dict, prices_to_try: list):
+    """(start_tier, ladder) starting at the tier most likely to succeed instead of always the cheapest"""
+    start_tier = price_tier_stats.start_index(
+        service_id, prices_to_try, country_data.get('available', 0))
+    return start_tier, prices_to_try[start_tier:start_tier + 3]
+
+
+async def submit_order(service_id: str, country_data: dict, prices_to_try: list) -> OrderAttempt:
+    """POST order/ up the price ladder until a number is assigned or a hard error occurs"""
+    headers_order = {"X-Api-Key": API_KEY, "Content-Type": "application/json"}
+    order_url = "https://api.smsvirtual.co/v1/order/"
+    min_price = min(prices_to_try)
+    max_price = max(prices_to_try)
+    available = country_data.get('available', 0)
+    start_tier, ladder = order_ladder(service_id, country_data, prices_to_try)
+
+    for attempt, custom_price in enumerate(ladder):
+        payload = {
+            "country": 7,
+            "service": int(service_id),
+            "operator": "",
+            "customPrice": custom_price + 0.00002,
+            "rangePrice": {"min": min_price, "max": max_price}
+        }
+
+        await order_rate_limiter.acquire()
+        status_code, order_data = await http_client.post(order_url, json_data=payload, headers=headers_order)
+
+        if status_code != 200 or not order_data:
+            return OrderAttempt(None, f"❌ HTTP Error {status_code}", False, attempt + 1, start_tier + attempt)
+
+        if order_data.get('status'):
+            price_tier_stats.record(service_id, custom_price, available, True)
+            return OrderAttempt(order_data['data'], "", False, attempt + 1, start_tier + attempt)
+
+        # If failed, check if it's due to "no number"
+        error_message = order_data.get('message', 'Kesalahan tidak diketahui')
+        if "no number" not in error_message.lower():
+            return OrderAttempt(None, f"⚠️ Gagal: {error_message}", False, attempt + 1, start_tier + attempt)
+        price_tier_stats.record(service_id, custom_price, available, False)
+
+    return OrderAttempt(
+        None, f"❌ Gagal memesan nomor setelah {len(ladder)} percobaan. Tidak ada nomor tersedia.",
+        True, len(ladder), start_tier + len(ladder) - 1)
+
+
+def record_placed_order(user_id: str, service_id: str, service_name: str, order: dict) -> None:
+    """Log, store and charge quota for a freshly placed order"""
+    order_id = order.get('id', 'N/A')
+    number = order.get('phone', 'N/A')
+    price = order.get('price', 'N/A')
+    try:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log_entry = f"{timestamp},{user_id},{order_id},{service_id},{service_name},{number},{price:.5f},ORDERED,\n"
+        with open("logorder.txt", "a", encoding='utf-8') as f:
+            f.write(log_entry)
+    except Exception as e:
+        logger.error(
+            f"Failed to log order {order_id}: {str(e)}")
+
+    store_order_info(order_id, service_id, service_name, number, price, user_id)
+    order_events.emit('ordered', order_id, price=price)
+    auth_store.consume_quota(user_id)
+
+
+async def announce_order(context: ContextTypes.DEFAULT_TYPE, chat_id: int, service_id: str,
+                         service_name: str, order: dict, message_id: int = None,
+                         replaces=None, reorder_round: int = 0):
+    """
+    Send the order message (or edit message_id in place when the order replaces another),
+    then start monitoring, auto-cancel and e-wallet validation for it
+    """
+    order_id = order.get('id', 'N/A')
+    number = order.get('phone', 'N/A')
+    phoneformat62 = number.replace(
+        "62", "0") if number.startswith("62") else number
+    price = order.get('price', 'N/A')
+    note_order_expiry(order_id, order.get('expiredAt'))
+
+    # E-wallet services are validated in the background after the number is shown,
+    # unless the local index already knows the number is registered
+    service_type = get_service_type(service_id)
+    known_registered = bool(service_type) and registered_index.contains(
+        phoneformat62, EWALLET_TYPE_ALIASES.get(service_type, service_type))
+    if known_registered:
+        status_text = " | ✅ Terdaftar"
+    else:
+        status_text = " | ⏳ Cek e-wallet..." if service_type else ""
+    if replaces is not None:
+        status_text = f" | 🔁 Pengganti #{replaces}{status_text}"
+    order_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    message = render_notice(
+        'placed', service_name=service_name, order_id=order_id,
+        status_text=status_text, phone_number=number, phone62=phoneformat62,
+        price=f"${price:.5f}", order_time=order_time)
+
+    # Add action buttons for successful order
+    reply_markup = order_keyboard('pending', order_id, service_id)
+
+    # The order is already paid for: wait out flood control, and never let a failed
+    # send skip the monitoring and auto-cancel scheduled below
+    sent_message = None
+    for _ in range(3):
+        try:
+            if message_id is None:
+                sent_message = await context.bot.send_message(
+                    chat_id=chat_id, text=message, parse_mode="HTML", reply_markup=reply_markup)
             else:
-                await query.message.reply_text(f"❌ HTTP Error {status_code}")
+                sent_message = await context.bot.edit_message_text(
+                    chat_id=chat_id, message_id=message_id, text=message,
+                    parse_mode="HTML", reply_markup=reply_markup)
+            break
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.error(f"Failed to send order message for order {order_id}: {str(e)}")
+            break
+    if sent_message is not None:
+        chat_id, message_id = sent_message.chat_id, sent_message.message_id
+        stored = stored_order(order_id)
+        if stored is not None:
+            # Lets reconciliation re-attach monitoring to this message after a restart
+            stored.chat_id, stored.message_id = chat_id, message_id
+            save_order_storage()
+
+    # Schedule auto-cancellation/monitoring; a registered e-wallet swaps these out later
+    if known_registered:
+        await schedule_order_cancellation(
+            context, order_id, delay_seconds=min_hold_delay(order_id),
+            message_id=message_id, chat_id=chat_id
+        )
+    else:
+        if service_id in AUTO_REORDER_SERVICES and reorder_round < AUTO_REORDER_MAX:
+            schedule_auto_reorder(
+                context, order_id, service_id, service_name, reorder_round,
+                message_id=message_id, chat_id=chat_id
+            )
+        else:
+            await schedule_auto_cancellation(
+                context, order_id, message_id=message_id, chat_id=chat_id
+            )
+        await monitor_order_sms(
+            context, order_id, message_id, chat_id, initial_sms_count=0
+        )
+    if service_type and not known_registered and message_id:
+        schedule_ewallet_validation(
+            context, order_id, service_type, service_id, service_name, number,
+            f"${price:.5f}", order_time, message_id, chat_id
+        )
+    return sent_message
+
+# Automatic cancel-and-reorder for services that opt in
+
+
+def schedule_auto_reorder(context: ContextTypes.DEFAULT_TYPE, order_id, service_id: str, service_name: str,
+                          reorder_round: int, message_id: int, chat_id: int):
+    """
+    After the service's silence window, place a replacement for an order that has no SMS,
+    cancel the old one and show the new number in the same message. Falls back to the
+    normal no-SMS auto-cancellation when no replacement can be placed.
+    """
+    async def reorder_after_silence():
+        headers = {"X-Api-Key": API_KEY}
+        placed_at = order_placed_at(order_id) or time.time()
+        silence = max(AUTO_REORDER_SERVICES[service_id], CANCEL_MIN_HOLD)
+        await asyncio.sleep(max(0, placed_at + silence - time.time()))
+
+        fallback = True
+        try:
+            status_code, data = await http_client.get(f"{BASE_URL}order/status/{order_id}", headers)
+            order_data = data.get('data') if status_code == 200 and data and data.get('status') else None
+            if not order_data:
+                return
+            if order_data.get('Sms') or order_data.get('orderStatus') != 'PENDING':
+                fallback = False
+                return
+
+            user_id = getattr(stored_order(order_id), 'user_id', None) or 'N/A'
+            if auth_store.remaining_quota(user_id) == 0:
+                return
+
+            # Replacement first so the user is never left without a number
+            country_data, prices_to_try, error = await load_order_prices(service_id)
+            if error:
                 return
+            result = await submit_order(service_id, country_data, prices_to_try)
+            if result.order is None:
+                logger.info(f"Auto-reorder for order {order_id} found no replacement: {result.error}")
+                return
+            fallback = False
+
+            record_placed_order(user_id, service_id, service_name, result.order)
+            outcome = await order_lifecycle.transition(
+                order_id, 'CANCEL', lambda: http_client.patch(f"{BASE_URL}order/{order_id}/1", headers=headers))
+            if outcome is None:
+                # Closed while the replacement was placed: keep the old message, announce separately
+                await announce_order(context, chat_id, service_id, service_name, result.order,
+                                     reorder_round=reorder_round + 1)
+                return
+            cancel_status, cancel_data = outcome
+            if cancel_status != 200 or not cancel_data or not cancel_data.get('status'):
+                # Still live and billed: keep it (and its message) open, let the normal
+                # no-SMS cancellation retry it, and announce the replacement separately
+                logger.error(f"Auto-reorder failed to cancel replaced order {order_id}: {cancel_status}")
+                fallback = True
+                await announce_order(context, chat_id, service_id, service_name, result.order,
+                                     reorder_round=reorder_round + 1)
+                return
+
+            await announce_order(
+                context, chat_id, service_id, service_name, result.order,
+                message_id=message_id, replaces=order_id, reorder_round=reorder_round + 1)
+            logger.info(
+                f"Auto-reorder replaced order {order_id} with {result.order.get('id')} after {int(time.time() - placed_at)}s of silence")
+        except asyncio.CancelledError:
+            # Finished, cancelled or found registered meanwhile
+            fallback = False
+            raise
+        except Exception as e:
+            logger.error(f"Exception during auto-reorder of order {order_id}: {str(e)}")
+        finally:
+            if fallback:
+                await schedule_auto_cancellation(context, order_id, message_id=message_id, chat_id=chat_id)
+
+    # Tracked like the auto-cancel timer so finish/cancel/e-wallet validation stop it
+    order_lifecycle.track('auto_cancel', order_id, asyncio.create_task(
+        reorder_after_silence()), message_id, chat_id)
+
+# Enhanced async place_order function
+
+
+async def place_order(query, context: ContextTypes.DEFAULT_TYPE, service_id: str) -> None:
+    user_id = str(query.from_user.id)
+
+    if auth_store.remaining_quota(user_id) == 0:
+        await query.message.reply_text("🚫 Kuota order harian Anda sudah habis. Silakan hubungi admin.")
+        logger.warning(f"User {user_id} exceeded daily order quota")
+        return
+
+    service_name = get_service_name(service_id)
 
-        # If all attempts failed
-        await query.message.reply_text("❌ Gagal memesan nomor setelah 3 percobaan. Tidak ada nomor tersedia.")
+    try:
+        # Prefetched tiers let the order go straight to POST order/
+        country_data, prices_to_try, error = await load_order_prices(service_id)
+        if error:
+            await query.message.reply_text(error)
+            return
+
+        result = await submit_order(service_id, country_data, prices_to_try)
+        if result.order is None:
+            await query.message.reply_text(result.error)
+            return
+
+        record_placed_order(user_id, service_id, service_name, result.order)
+        await announce_order(context, query.message.chat_id, service_id, service_name, result.order)
+        logger.info(
+            f"User {user_id} placed an order for service {service_id} on attempt {result.attempt} (tier {result.tier + 1}/{len(prices_to_try)})")
 
     except Exception as e:
         await query.message.reply_text(f"❌ Terjadi kesalahan: {str(e)}")
         logger.error(f"Error placing order for user {user_id}: {str(e)}")
 
-# Enhanced button callback handler
+# Bulk ordering: bounded fan-out with one live summary message
+
+
+class BulkOrderJob:
+    """State of one /bulkorder run, rendered into a single summary message"""
+
+    def __init__(self, service_id: str, service_name: str, count: int, spend_cap: float):
+        self.service_id = service_id
+        self.service_name = service_name
+        self.count = count
+        self.spend_cap = spend_cap
+        self.placed = []  # order_data['data'] per successful order
+        self.failed = 0
+        self.in_flight = 0
+        self.dispatched = 0
+        self.spent = 0.0
+        self.reserved = 0.0  # Worst-case price of orders still in flight
+        self.stop_reason = ""
+        self.done = False
+
+    def reserve(self, worst_price: float):
+        """
+        Claim the next slot. Returns True if claimed, False when the run is over and
+        None when the spend cap may still fit once in-flight orders settle.
+        """
+        if self.stop_reason or self.dispatched >= self.count:
+            return False
+        if self.spend_cap and self.spent + self.reserved + worst_price > self.spend_cap:
+            if self.in_flight:
+                return None
+            self.stop_reason = f"Batas belanja ${self.spend_cap:.5f} tercapai"
+            return False
+        self.dispatched += 1
+        self.in_flight += 1
+        self.reserved += worst_price
+        return True
+
+    def settle(self, worst_price: float, result: OrderAttempt) -> None:
+        self.in_flight -= 1
+        self.reserved -= worst_price
+        if result.order is not None:
+            self.placed.append(result.order)
+            price = result.order.get('price', 0)
+            self.spent += price if isinstance(price, (int, float)) else 0
+        else:
+            self.failed += 1
+            # The same error would repeat for every remaining slot
+            self.stop_reason = self.stop_reason or result.error
+
+    def render(self) -> str:
+        cap = f" / ${self.spend_cap:.5f}" if self.spend_cap else ""
+        lines = [
+            f"📦 <b>Bulk Order — {self.service_name}</b>",
+            f"🆔 Service ID: {self.service_id}",
+            f"✅ Berhasil: {len(self.placed)}/{self.count}",
+            f"❌ Gagal: {self.failed}",
+            f"⏳ Diproses: {self.in_flight}",
+            f"💵 Total: ${self.spent:.5f}{cap}",
+        ]
+        if self.stop_reason:
+            lines.append(f"🛑 Dihentikan: {self.stop_reason}")
+        lines.append("🏁 Selesai" if self.done else "🔄 Memproses...")
+        return "\n".join(lines)
 
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
-    user_id = str(query.from_user.id)
-    log_user_id(user_id)
+async def edit_bulk_summary(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, job: BulkOrderJob) -> None:
+    try:
+        await context.bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=job.render(), parse_mode="HTML")
+    except Exception as edit_error:
+        logger.error(f"Failed to edit bulk summary: {str(edit_error)}")
 
-    if user_id not in AUTHORIZED_IDS:
-        await query.message.reply_text("🚫 Access denied! Please contact an admin to gain access. 😊")
-        logger.warning(
-            f"Unauthorized button access attempt by user ID: {user_id}")
+
+async def run_bulk_order(context: ContextTypes.DEFAULT_TYPE, user_id: str, chat_id: int,
+                         message_id: int, job: BulkOrderJob, country_data: dict, prices_to_try: list) -> None:
+    """
+    Place job.count orders with at most BULK_ORDER_CONCURRENCY in flight. Each order is
+    announced (and its monitoring and auto-cancel started) as soon as it is placed, in its
+    own task so flood-control waits never hold up the remaining placements.
+    """
+    progress = asyncio.Event()
+    settled = asyncio.Condition()
+    announcements = []
+
+    async def announce(order):
+        try:
+            await announce_order(context, chat_id, job.service_id, job.service_name, order)
+        except Exception as e:
+            logger.error(f"Failed to announce bulk order {order.get('id')}: {str(e)}")
+
+    async def worker():
+        while True:
+            _, ladder = order_ladder(job.service_id, country_data, prices_to_try)
+            worst_price = max(ladder) + 0.00002
+            claimed = job.reserve(worst_price)
+            if claimed is None:
+                async with settled:
+                    await settled.wait()
+                continue
+            if not claimed:
+                return
+            try:
+                result = await submit_order(job.service_id, country_data, prices_to_try)
+            except Exception as e:
+                result = OrderAttempt(None, f"❌ Terjadi kesalahan: {str(e)}", False, 0, 0)
+            job.settle(worst_price, result)
+            if result.order is not None:
+                record_placed_order(user_id, job.service_id, job.service_name, result.order)
+                announcements.append(asyncio.create_task(announce(result.order)))
+            progress.set()
+            async with settled:
+                settled.notify_all()
+
+    async def report():
+        # Telegram throttles edits, so the summary is refreshed at most every 2 seconds
+        while not job.done:
+            await progress.wait()
+            progress.clear()
+            await edit_bulk_summary(context, chat_id, message_id, job)
+            await asyncio.sleep(2)
+
+    reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(BULK_ORDER_CONCURRENCY, job.count))))
+        if announcements:
+            # asyncio.wait, not gather: stopping the run must not cancel announcements of placed orders
+            await asyncio.wait(announcements)
+    finally:
+        job.done = True
+        reporter.cancel()
+        bulk_orders.pop(user_id, None)
+        await edit_bulk_summary(context, chat_id, message_id, job)
+
+    logger.info(
+        f"User {user_id} bulk ordered {len(job.placed)}/{job.count} numbers for service {job.service_id} (${job.spent:.5f})")
+
+
+async def bulk_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/bulkorder <service_id> <count> [max_spend_usd]"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
         return
 
-    # Handle all callback data efficiently
-    if query.data == "balance":
-        await balance_callback(query, context)
-    elif query.data == "services":
-        await services_callback(query, context)
-    elif query.data == "cekprice":
-        waiting_for_service_id[user_id] = True
-        await query.message.reply_text("🔍 Please send the service ID to check its price (e.g., 399):")
-    elif query.data == "order":
-        await order_callback(query, context)
-    elif query.data == "active_orders":
-        await active_orders_callback(query, context)
-    elif query.data.startswith("order_service_"):
-        service_id = query.data.split("_")[2]
-        await place_order(query, context, service_id)
-    elif query.data == "admin_tools" and user_id in ADMIN_IDS:
-        admin_keyboard = [
-            [InlineKeyboardButton("🔐 Add User", callback_data="add_user")],
-            [InlineKeyboardButton(
-                "🗑️ Delete User", callback_data="delete_user")],
-            [InlineKeyboardButton(
-                "➕ Add Service", callback_data="add_service")],
-            [InlineKeyboardButton("➖ Delete Service",
-                                  callback_data="delete_service")]
-        ]
-        reply_markup = InlineKeyboardMarkup(admin_keyboard)
-        await query.message.reply_text("🔧 Admin Tools:", reply_markup=reply_markup)
-    # ... other callback handlers would continue here
+    args = context.args or []
+    if len(args) not in (2, 3) or not args[0].isdigit() or not args[1].isdigit():
+        await update.message.reply_text(
+            f"📦 Usage: /bulkorder <service_id> <jumlah> [maks_usd]\nMaksimal {BULK_ORDER_MAX} nomor per bulk.")
+        return
+
+    service_id, count = args[0], int(args[1])
+    try:
+        spend_cap = float(args[2]) if len(args) == 3 else BULK_SPEND_CAP
+    except ValueError:
+        await update.message.reply_text("❌ Batas belanja harus berupa angka!")
+        return
+
+    if not 1 <= count <= BULK_ORDER_MAX:
+        await update.message.reply_text(f"❌ Jumlah harus antara 1 dan {BULK_ORDER_MAX}!")
+        return
+
+    if user_id in bulk_orders:
+        await update.message.reply_text("⏳ Bulk order sebelumnya masih berjalan.")
+        return
+
+    remaining = auth_store.remaining_quota(user_id)
+    if remaining == 0:
+        await update.message.reply_text("🚫 Kuota order harian Anda sudah habis. Silakan hubungi admin.")
+        logger.warning(f"User {user_id} exceeded daily order quota")
+        return
+    if remaining is not None:
+        count = min(count, remaining)
+
+    country_data, prices_to_try, error = await load_order_prices(service_id)
+    if error:
+        await update.message.reply_text(error)
+        return
+
+    job = BulkOrderJob(service_id, get_service_name(service_id), count, spend_cap)
+    summary = await update.message.reply_text(job.render(), parse_mode="HTML")
+
+    task = asyncio.create_task(run_bulk_order(
+        context, user_id, summary.chat_id, summary.message_id, job, country_data, prices_to_try))
+    bulk_orders[user_id] = {
+        'task': task,
+        'message_id': summary.message_id,
+        'chat_id': summary.chat_id
+    }
+    logger.info(f"User {user_id} started bulk order of {count} for service {service_id}")
 
 
 async def balance_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1561,11 +4115,8 @@ async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # Send loading message
     loading_msg = await update.message.reply_text("⏳ Checking price...")
 
-    url = f"{BASE_URL}price/{service_id}/"
-    headers = {"X-Api-Key": API_KEY}
-
     try:
-        status_code, data = await http_client.get(url, headers)
+        status_code, data, fetched_at = await get_price_data(service_id)
 
         if status_code == 200 and data:
             if data.get('status') and data.get('data'):
@@ -1599,7 +4150,7 @@ async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
                     message += f"\n" + "─" * 30 + "\n"
 
-                message += f"🕒 Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                message += f"🕒 Updated: {format_freshness(fetched_at)}"
                 await loading_msg.edit_text(message, parse_mode="Markdown")
             else:
                 await loading_msg.edit_text(f"⚠️ Error: {data.get('message', 'No price data available')}")
@@ -1670,7 +4221,7 @@ async def active_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                     message += f"⏰ Expired: {expired_date}\n"
                     message += "─" * 30 + "\n"
 
-                await loading_msg.edit_text(message, parse_mode="Markdown")
+                await loading_msg.edit_text(message, parse_mode="Markdown", reply_markup=active_orders_keyboard())
             else:
                 await loading_msg.edit_text(f"⚠️ Error: {data.get('message', 'No active orders found')}")
         else:
@@ -1724,7 +4275,7 @@ async def active_orders_callback(query, context: ContextTypes.DEFAULT_TYPE) -> N
                     message += f"📧 SMS: {sms_count}\n"
                     message += "─" * 20 + "\n"
 
-                await loading_msg.edit_text(message, parse_mode="Markdown")
+                await loading_msg.edit_text(message, parse_mode="Markdown", reply_markup=active_orders_keyboard())
             else:
                 await loading_msg.edit_text(f"⚠️ Error: {data.get('message', 'No active orders found')}")
         else:
@@ -1734,6 +4285,273 @@ async def active_orders_callback(query, context: ContextTypes.DEFAULT_TYPE) -> N
 
     logger.info(f"User {user_id} checked active orders via callback")
 
+# Bulk cancel/finish from the active orders view
+
+
+def active_orders_keyboard():
+    """Bulk action buttons shown under the active orders list"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"🛑 Batalkan tanpa SMS >{minutes} mnt", callback_data=f"bulk_cancel_{minutes}")
+         for minutes in BULK_CANCEL_AGES],
+        [InlineKeyboardButton("✅ Selesaikan semua yang ada SMS",
+                              callback_data="bulk_finish")]
+    ])
+
+
+def select_bulk_targets(orders: list, action: str, user_id: str, min_age_minutes: int = 0):
+    """
+    Active orders the action applies to: 'cancel' takes PENDING orders without SMS older
+    than min_age_minutes (never younger than CANCEL_MIN_HOLD, which the provider refuses),
+    'finish' takes orders with SMS. Non-admins only touch their own orders. Returns
+    (targets, skipped) where skipped orders had no known order time.
+    """
+    is_admin = auth_store.is_admin(user_id)
+    now = time.time()
+    min_age = max(min_age_minutes * 60, CANCEL_MIN_HOLD)
+    targets, skipped = [], 0
+    for order in orders:
+        stored = stored_order(order.get('orderId'))
+        if not is_admin and getattr(stored, 'user_id', None) != user_id:
+            continue
+        has_sms = bool(order.get('Sms'))
+        if action == 'finish':
+            if has_sms:
+                targets.append(order)
+            continue
+        if has_sms or order.get('orderStatus') != 'PENDING':
+            continue
+        if stored is None or stored.placed_at is None:
+            skipped += 1
+            continue
+        if now - stored.placed_at >= min_age:
+            targets.append(order)
+    return targets, skipped
+
+
+async def batch_edit_messages(bot, edits: list, concurrency: int = BULK_ACTION_CONCURRENCY) -> int:
+    """
+    Apply [(chat_id, message_id, text)] edits with bounded parallelism, honouring
+    Telegram flood-control waits once per message. Returns the number of edits applied.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def edit(chat_id, message_id, text):
+        async with semaphore:
+            for _ in range(2):
+                try:
+                    await bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+                                                text=text, parse_mode="HTML")
+                    return True
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except Exception as edit_error:
+                    logger.error(
+                        f"Failed to edit message {message_id} in batch: {str(edit_error)}")
+                    return False
+            return False
+
+    results = await asyncio.gather(*(edit(*item) for item in edits))
+    return sum(results)
+
+
+async def bulk_order_action(query, context: ContextTypes.DEFAULT_TYPE, action: str, min_age_minutes: int = 0) -> None:
+    """PATCH every matching active order concurrently, then update their messages in one batch"""
+    user_id = str(query.from_user.id)
+    headers = {"X-Api-Key": API_KEY}
+
+    status_code, data = await http_client.get(f"{BASE_URL}order/active", headers)
+    if status_code != 200 or not data or not data.get('status'):
+        await query.message.reply_text(f"❌ Gagal memuat pesanan aktif: HTTP Error {status_code}")
+        return
+
+    targets, skipped = select_bulk_targets(
+        data.get('data') or [], action, user_id, min_age_minutes)
+    if not targets:
+        await query.message.reply_text("📋 Tidak ada pesanan yang cocok untuk aksi ini.")
+        return
+
+    status_path = 1 if action == 'cancel' else 3  # 1 = Cancel, 3 = Finish
+    terminal_status = 'CANCEL' if action == 'cancel' else 'SUCCESS'
+    semaphore = asyncio.Semaphore(BULK_ACTION_CONCURRENCY)
+
+    async def patch(order):
+        """(ok, message location); ok is None when the order was already closed"""
+        order_id = order.get('orderId')
+        location = order_lifecycle.location(order_id)  # Before closing drops the tracking tasks
+        if location is None:
+            # Untracked (e.g. adopted after a restart): fall back to the stored message
+            stored = stored_order(order_id)
+            if stored is not None and stored.chat_id and stored.message_id:
+                location = (stored.chat_id, stored.message_id)
+        async with semaphore:
+            outcome = await order_lifecycle.transition(
+                order_id, terminal_status,
+                lambda: http_client.patch(f"{BASE_URL}order/{order_id}/{status_path}", headers=headers))
+        if outcome is None:
+            return None, location
+        status_code, data = outcome
+        ok = status_code == 200 and bool(data) and bool(data.get('status'))
+        if not ok:
+            logger.error(
+                f"Bulk {action} failed for order {order_id}: {data.get('message') if data else status_code}")
+        return ok, location
+
+    results = await asyncio.gather(*(patch(order) for order in targets))
+
+    stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    edits = []
+    for order, (ok, location) in zip(targets, results):
+        if not ok:
+            continue
+        order_id = order.get('orderId')
+
+        if action == 'cancel':
+            text = render_notice('cancelled_manual', order_id=order_id, stamp=stamp)
+        else:
+            stored = get_order_info(order_id)
+            service_name = stored.service_name or 'Unknown Service'
+            phone_number = order.get('number', stored.phone_number or 'N/A')
+            price = order.get('price', stored.price or 0)
+            price = f"${float(price):.5f}" if isinstance(price, (int, float)) else "$0.00000"
+            save_completion(user_id, order_id, service_name,
+                            phone_number, price, "bulk_finish", service_id=stored.service_id)
+            phoneformat62 = phone_number.replace(
+                "62", "0") if phone_number.startswith("62") else phone_number
+            text = render_notice(
+                'finished', service_name=service_name, order_id=order_id,
+                phone_display=f"<code>{phone_number}</code> | <code>{phoneformat62}</code>",
+                price=price, order_time=stored.order_time, stamp=stamp)
+        if location:
+            edits.append((*location, text))
+
+    done = sum(1 for ok, _ in results if ok)
+    already_closed = sum(1 for ok, _ in results if ok is None)
+    edited = await batch_edit_messages(context.bot, edits)
+    verb = "dibatalkan" if action == 'cancel' else "diselesaikan"
+    summary = f"{'🛑' if action == 'cancel' else '✅'} {done}/{len(targets)} pesanan {verb}"
+    if done + already_closed < len(targets):
+        summary += f"\n❌ Gagal: {len(targets) - done - already_closed}"
+    if already_closed:
+        summary += f"\n⏭️ Sudah selesai/dibatalkan sebelumnya: {already_closed}"
+    if skipped:
+        summary += f"\n⏭️ Dilewati (waktu order tidak diketahui): {skipped}"
+    summary += f"\n📝 Pesan diperbarui: {edited}"
+    await query.message.reply_text(summary)
+    logger.info(
+        f"User {user_id} bulk {action} {done}/{len(targets)} orders (min age {min_age_minutes} min)")
+
+
+async def bulk_cancel_callback(query, context: ContextTypes.DEFAULT_TYPE, minutes: str) -> None:
+    if minutes.isdigit():
+        await bulk_order_action(query, context, 'cancel', int(minutes))
+
+
+async def bulk_finish_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await bulk_order_action(query, context, 'finish')
+
+
+# Reconciliation of local order state with provider order/active
+
+
+class OrderReconciler:
+    """
+    Periodically diff order_storage against the provider's active orders: record provider
+    status, adopt live orders nobody watches (e.g. placed before a restart) and retire
+    entries the provider no longer lists. Orders this bot did not place (web panel, other
+    clients) are only counted; they never enter order_storage, the event log or exports.
+    """
+
+    def __init__(self, interval: int, grace: int):
+        self.interval = interval
+        self.grace = grace  # Fresh orders may not be listed in order/active yet
+        self.last_report = {}
+        self.passes = 0
+
+    async def reconcile(self, context) -> dict:
+        status_code, data = await http_client.get(f"{BASE_URL}order/active", {"X-Api-Key": API_KEY})
+        if status_code != 200 or not data or not data.get('status'):
+            raise RuntimeError(f"order/active HTTP {status_code}")
+
+        active = {str(order.get('orderId')): order for order in data.get('data') or []}
+        report = {'active': len(active), 'status_fixed': 0, 'adopted': 0, 'foreign': 0, 'retired': 0,
+                  'dropped': 0}
+        changed = False
+
+        for order_id, order in active.items():
+            stored = order_storage.get(order_id)
+            if stored is None or self.is_foreign(stored):
+                # Placed outside the bot (web panel, another client): observe only
+                report['foreign'] += 1
+                continue
+            note_order_expiry(order_id, order.get('expiredAt'))
+            status = order.get('orderStatus')
+            if stored.status != status:
+                stored.status = status
+                report['status_fixed'] += 1
+                changed = True
+
+            if status == 'PENDING' and not stored.closed_at and not order_lifecycle.tracked(order_id):
+                chat_id, message_id = stored.chat_id, stored.message_id
+                if chat_id and message_id:
+                    await monitor_order_sms(context, order_id, message_id, chat_id,
+                                            initial_sms_count=len(order.get('Sms') or []))
+                if not order.get('Sms'):
+                    await schedule_auto_cancellation(context, order_id, message_id=message_id, chat_id=chat_id)
+                if order_lifecycle.tracked(order_id):
+                    report['adopted'] += 1
+
+        cutoff = time.time() - self.grace
+        for order_id in [oid for oid, stored in order_storage.items()
+                         if oid not in active and not stored.closed_at]:
+            stored = order_storage[order_id]
+            if self.is_foreign(stored):
+                # Adopted from order/active by older versions: forget without close events
+                del order_storage[order_id]
+                report['dropped'] += 1
+                changed = True
+                continue
+            if stored.placed_at is not None and stored.placed_at > cutoff:
+                continue
+            order_lifecycle.close(order_id, 'CLOSED')
+            report['retired'] += 1
+            changed = True
+
+        if changed:
+            save_order_storage()
+        report['archived'] = archive_closed_orders()
+        report['leaks'] = order_lifecycle.leak_check()
+        self.passes += 1
+        report['at'] = datetime.now().isoformat()
+        self.last_report = report
+        if report['status_fixed'] or report['adopted'] or report['retired'] or report['dropped'] or report['archived']:
+            logger.info(
+                f"🔄 Reconciled orders: {report['active']} active, {report['foreign']} foreign, "
+                f"{report['status_fixed']} status fixed, {report['adopted']} adopted, "
+                f"{report['retired']} retired, {report['dropped']} foreign dropped, "
+                f"{report['archived']} archived")
+        return report
+
+    @staticmethod
+    def is_foreign(stored: Order) -> bool:
+        """No owner and no bot message: the order was not placed through this bot"""
+        return not stored.user_id and not (stored.chat_id and stored.message_id)
+
+    async def run(self, application) -> None:
+        context = CallbackContext(application)
+        while True:
+            try:
+                await self.reconcile(context)
+            except Exception as e:
+                logger.error(f"Order reconciliation failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self) -> dict:
+        return {'passes': self.passes, **self.last_report}
+
+
+order_reconciler = OrderReconciler(RECONCILE_INTERVAL, RECONCILE_GRACE)
+
+
 # Enhanced text message handler
 
 
@@ -1748,26 +4566,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 return
 
             try:
-                with open(".env", "r", encoding='utf-8') as f:
-                    lines = f.readlines()
-
-                new_lines = []
-                for line in lines:
-                    if line.startswith("AUTHORIZED_IDS="):
-                        ids = line.strip().split("=")[1].split(",")
-                        if new_user_id in ids:
-                            await update.message.reply_text(f"❌ User {new_user_id} is already authorized!")
-                            return
-                        ids.append(new_user_id)
-                        new_line = f"AUTHORIZED_IDS={','.join(ids)}\n"
-                        new_lines.append(new_line)
-                    else:
-                        new_lines.append(line)
-
-                with open(".env", "w", encoding='utf-8') as f:
-                    f.writelines(new_lines)
+                if not auth_store.add_user(new_user_id):
+                    await update.message.reply_text(f"❌ User {new_user_id} is already authorized!")
+                    return
 
-                AUTHORIZED_IDS.add(new_user_id)
                 await update.message.reply_text(f"✅ Success! User {new_user_id} has been added! 🎉")
                 logger.info(f"Admin {user_id} added user {new_user_id}")
             except Exception as e:
@@ -1824,11 +4626,8 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Send loading message
         loading_msg = await update.message.reply_text("⏳ Checking price...")
 
-        url = f"{BASE_URL}price/{service_id}/"
-        headers = {"X-Api-Key": API_KEY}
-
         try:
-            status_code, data = await http_client.get(url, headers)
+            status_code, data, fetched_at = await get_price_data(service_id)
 
             if status_code == 200 and data:
                 if data.get('status') and data.get('data'):
@@ -1860,7 +4659,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 
                         message += "─" * 25 + "\n"
 
-                    message += f"🕒 Updated: {datetime.now().strftime('%H:%M:%S')}"
+                    message += f"🕒 Updated: {format_freshness(fetched_at)}"
                     await loading_msg.edit_text(message, parse_mode="Markdown")
                 else:
                     await loading_msg.edit_text(f"⚠️ Error: {data.get('message', 'No price data')}")
@@ -1878,7 +4677,7 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await check_authorized(update, context):
         return
 
-    if user_id not in ADMIN_IDS:
+    if not auth_store.is_admin(user_id):
         await update.message.reply_text("🚫 Sorry, only admins can add new users! 😊")
         logger.warning(f"Non-admin user {user_id} attempted to add user")
         return
@@ -1889,26 +4688,10 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     new_user_id = context.args[0]
     try:
-        with open(".env", "r", encoding='utf-8') as f:
-            lines = f.readlines()
-
-        new_lines = []
-        for line in lines:
-            if line.startswith("AUTHORIZED_IDS="):
-                ids = line.strip().split("=")[1].split(",")
-                if new_user_id in ids:
-                    await update.message.reply_text(f"❌ User {new_user_id} is already authorized!")
-                    return
-                ids.append(new_user_id)
-                new_line = f"AUTHORIZED_IDS={','.join(ids)}\n"
-                new_lines.append(new_line)
-            else:
-                new_lines.append(line)
-
-        with open(".env", "w", encoding='utf-8') as f:
-            f.writelines(new_lines)
+        if not auth_store.add_user(new_user_id):
+            await update.message.reply_text(f"❌ User {new_user_id} is already authorized!")
+            return
 
-        AUTHORIZED_IDS.add(new_user_id)
         await update.message.reply_text(f"✅ Success! User {new_user_id} has been added! 🎉")
         logger.info(f"Admin {user_id} added user {new_user_id}")
     except Exception as e:
@@ -1916,13 +4699,303 @@ async def add_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.error(f"Error adding user {new_user_id}: {str(e)}")
 
 
+async def set_quota(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command: /setquota <user_id> <orders_per_day|0 for unlimited>"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can change quotas! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to set quota")
+        return
+
+    if len(context.args) != 2 or not context.args[1].isdigit():
+        await update.message.reply_text("📊 Usage: /setquota <user_id> <orders_per_day>\n0 = unlimited")
+        return
+
+    target_id, limit = context.args[0], int(context.args[1])
+    if not auth_store.set_quota(target_id, limit or None):
+        await update.message.reply_text(f"❌ User {target_id} is not authorized!")
+        return
+
+    await update.message.reply_text(f"✅ Quota for user {target_id}: {limit or 'unlimited'} orders/day")
+    logger.info(f"Admin {user_id} set quota {limit} for user {target_id}")
+
+
+async def set_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command: /setrole <user_id> <user|admin>"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can change roles! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to set role")
+        return
+
+    if len(context.args) != 2 or context.args[1] not in AuthorizationStore.ROLES:
+        await update.message.reply_text("👤 Usage: /setrole <user_id> <user|admin>")
+        return
+
+    target_id, role = context.args
+    if not auth_store.set_role(target_id, role):
+        await update.message.reply_text(f"❌ User {target_id} is not authorized!")
+        return
+
+    await update.message.reply_text(f"✅ User {target_id} is now {role}")
+    logger.info(f"Admin {user_id} set role {role} for user {target_id}")
+
+
+def format_stats_report(report: dict, days: int) -> str:
+    """Telegram rendering of OrderAnalytics.report(), busiest services first"""
+    def pct(rate):
+        return f"{rate * 100:.0f}%" if rate is not None else "-"
+
+    def secs(value):
+        return f"{value:.0f}s" if value is not None else "-"
+
+    lines = [f"📈 <b>Statistik {days} hari</b> (sejak {report['since']})", ""]
+    services = sorted(report['services'].items(), key=lambda item: item[1]['orders'], reverse=True)
+    if not services:
+        lines.append("Belum ada data pesanan.")
+    for service_id, row in services[:STATS_MAX_SERVICES]:
+        cost = f"${row['cost_per_success']:.4f}" if row['cost_per_success'] is not None else "-"
+        lines.append(
+            f"<b>{get_service_name(service_id)}</b> ({service_id})\n"
+            f"  📦 {row['orders']} | ✅ {pct(row['success_rate'])} | ❌ {pct(row['cancel_rate'])}\n"
+            f"  ⏱️ SMS p50 {secs(row['first_sms_p50_s'])} / p95 {secs(row['first_sms_p95_s'])}\n"
+            f"  💰 ${row['spend']:.4f} | per sukses {cost}")
+    if len(services) > STATS_MAX_SERVICES:
+        lines.append(f"\n… {len(services) - STATS_MAX_SERVICES} layanan lainnya di /stats HTTP endpoint")
+    return "\n".join(lines)
+
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command: /stats [days] [service_id]"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can view statistics! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to view statistics")
+        return
+
+    args = context.args or []
+    if len(args) > 2 or (args and not args[0].isdigit()):
+        await update.message.reply_text("📈 Usage: /stats [hari] [service_id]\nExample: /stats 7 123")
+        return
+
+    days = max(1, int(args[0])) if args else 7
+    report = order_analytics.report(days=days, service_id=args[1] if len(args) > 1 else None)
+    await update.message.reply_text(format_stats_report(report, days), parse_mode="HTML")
+
+
+# Streaming order history export
+
+EXPORT_COLUMNS = ('order_id', 'order_time', 'closed_time', 'user_id', 'service_id', 'service_name',
+                  'phone_number', 'price', 'status')
+
+
+def iter_order_history(recent: list, since: float = None, until: float = None, user_id: str = None,
+                       service_id: str = None):
+    """
+    Orders from `recent` (a snapshot of the working set taken on the event loop) and the
+    archive matching the filters, one at a time
+    """
+    recent_ids = {order.order_id for order in recent}
+
+    def matches(order) -> bool:
+        if user_id and order.user_id != user_id:
+            return False
+        if service_id and order.service_id != service_id:
+            return False
+        if since is not None and (order.placed_at is None or order.placed_at < since):
+            return False
+        if until is not None and (order.placed_at is None or order.placed_at >= until):
+            return False
+        return True
+
+    for order in recent:
+        if matches(order):
+            yield order
+    for order in order_archive.iter_orders():
+        if order.order_id not in recent_ids and matches(order):
+            yield order
+
+
+def export_row(order) -> tuple:
+    closed_time = datetime.fromtimestamp(order.closed_at).strftime(
+        '%Y-%m-%d %H:%M:%S') if order.closed_at else ''
+    return (order.order_id, order.order_time if order.placed_at else '', closed_time, order.user_id or '',
+            order.service_id or '', order.service_name or '', order.phone_number or '',
+            order.price if order.price is not None else '', order.status or '')
+
+
+def write_export_part(orders, max_bytes: int):
+    """
+    Stream orders into a gzip'd CSV temp file until it reaches max_bytes compressed.
+    Returns (path, rows written, whether orders is exhausted).
+    """
+    handle = tempfile.NamedTemporaryFile(suffix=".csv.gz", delete=False)
+    count, exhausted = 0, True
+    try:
+        with handle, gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=6) as compressed, \
+                io.TextIOWrapper(compressed, encoding='utf-8', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow(EXPORT_COLUMNS)
+            for order in orders:
+                writer.writerow(export_row(order))
+                count += 1
+                if handle.tell() >= max_bytes:
+                    exhausted = False
+                    break
+    except BaseException:
+        os.remove(handle.name)
+        raise
+    return handle.name, count, exhausted
+
+
+def parse_export_args(args: list):
+    """/export arguments -> (since, until, user_id, service_id); dates are YYYY-MM-DD, `until` inclusive"""
+    dates, user_id, service_id = [], None, None
+    for arg in args:
+        if arg.startswith("user="):
+            user_id = arg[5:]
+        elif arg.startswith("service="):
+            service_id = arg[8:]
+        else:
+            dates.append(datetime.strptime(arg, '%Y-%m-%d').timestamp())
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    since = dates[0] if dates else None
+    until = dates[1] + 86400 if len(dates) == 2 else None
+    return since, until, user_id, service_id
+
+
+async def export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command: /export [from YYYY-MM-DD] [to YYYY-MM-DD] [user=<id>] [service=<id>]"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can export order history! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to export order history")
+        return
+
+    try:
+        since, until, filter_user, filter_service = parse_export_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(
+            "📤 Usage: /export [dari YYYY-MM-DD] [sampai YYYY-MM-DD] [user=<id>] [service=<id>]\n"
+            "Example: /export 2024-01-01 2024-01-31 service=123")
+        return
+
+    status_message = await update.message.reply_text("📤 Menyiapkan export...")
+    # Snapshot on the loop; the generator (and its SQLite cursor) then lives on one worker
+    # thread for every part, including its final close()
+    orders = iter_order_history(list(order_storage.values()), since, until, filter_user, filter_service)
+    loop = asyncio.get_running_loop()
+    worker = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    part, total = 0, 0
+    try:
+        while True:
+            path, number = None, part + 1
+            try:
+                path, count, exhausted = await loop.run_in_executor(
+                    worker, write_export_part, orders, EXPORT_PART_BYTES)
+                if count or not part:
+                    part += 1
+                    total += count
+                    with open(path, "rb") as f:
+                        await context.bot.send_document(
+                            chat_id=update.effective_chat.id, document=f,
+                            filename=f"orders_{stamp}_part{part}.csv.gz",
+                            caption=f"📤 Part {part}: {count} pesanan")
+            except Exception as e:
+                logger.error(f"Failed to export part {number}: {str(e)}")
+                await status_message.edit_text(f"❌ Export gagal pada part {number}: {str(e)}")
+                return
+            finally:
+                if path:
+                    os.remove(path)
+            if exhausted:
+                break
+    finally:
+        await loop.run_in_executor(worker, orders.close)
+        worker.shutdown(wait=False)
+
+    await status_message.edit_text(f"✅ Export selesai: {total} pesanan dalam {part} file")
+    logger.info(f"Admin {user_id} exported {total} orders in {part} parts")
+
+
+async def trace_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command: /trace <order_id|user_id> - events plus every log line mentioning the id"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can trace orders! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to trace an order")
+        return
+
+    if len(context.args or []) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("🔎 Usage: /trace <order_id|user_id>")
+        return
+
+    key = context.args[0]
+    stored = get_order_info(key)
+    since = until = None
+    if stored.placed_at:
+        # Only segments around the order's lifetime need to be opened
+        since = datetime.fromtimestamp(stored.placed_at - 300)
+        until = datetime.fromtimestamp((stored.closed_at or time.time()) + 3600)
+
+    def collect() -> list:
+        lines = deque(maxlen=TRACE_MAX_LINES)  # Most recent lines win for busy user ids
+        for segment, line in log_segments.search(key, since, until):
+            lines.append(f"[{segment}] {line}")
+        for path in ("logorder.txt", "bot.log"):
+            lines.extend(search_live_log(path, key))
+        return list(lines)
+
+    started = time.perf_counter()
+    lines = await asyncio.to_thread(collect)
+    events = order_events.for_order(key)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    report = [f"🔎 Trace {key} ({elapsed_ms:.0f} ms)"]
+    if stored.service_id or stored.placed_at:
+        report.append(f"{stored.service_name or stored.service_id} | {stored.phone_number or 'N/A'} | "
+                      f"{stored.status or 'N/A'} | dipesan {stored.order_time} | user {stored.user_id or 'N/A'}")
+    if events:
+        report.append("\nEvents:")
+        report.extend(f"{datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')} {event} "
+                      f"{json.dumps(data) if data else ''}".rstrip() for ts, event, data in events)
+    report.append(f"\nLog ({len(lines)} baris):")
+    report.extend(lines or ["(tidak ada)"])
+    text = "\n".join(report)
+
+    if len(text) <= 3800:
+        await update.message.reply_text(text)
+    else:
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id, document=io.BytesIO(text.encode('utf-8')),
+            filename=f"trace_{key}.txt", caption=report[0])
+    logger.info(f"Admin {user_id} traced {key}: {len(events)} events, {len(lines)} lines")
+
+
 async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Admin tools command"""
     user_id = str(update.effective_user.id)
     if not await check_authorized(update, context):
         return
 
-    if user_id not in ADMIN_IDS:
+    if not auth_store.is_admin(user_id):
         await update.message.reply_text("🚫 Sorry, only admins can access these tools! 😊")
         logger.warning(
             f"Non-admin user {user_id} attempted to access admin tools")
@@ -1957,24 +5030,16 @@ async def get_sms(query, context: ContextTypes.DEFAULT_TYPE, order_id: str) -> N
                 order_status = order_data.get('orderStatus', 'Unknown')
                 sms_data = order_data.get('Sms', [])
 
-                # Status emoji mapping
-                status_emoji = {
-                    'PENDING': '🟡',
-                    'SUCCESS': '🟢',
-                    'CANCEL': '🔴',
-                    'REFUND': '🟠'
-                }.get(order_status, '⚪')
-
                 # Get order info from storage first
-                stored_order = get_order_info(order_id)
-                service_name = stored_order['service_name']
-                service_id = stored_order['service_id']
-                order_time = stored_order['order_time']
-                stored_price = stored_order['price']
+                stored = get_order_info(order_id)
+                service_name = stored.service_name or 'Unknown Service'
+                service_id = stored.service_id or 'N/A'
+                order_time = stored.order_time
+                stored_price = stored.price if stored.price is not None else 'N/A'
 
                 # Get phone number from API response or storage
                 phone_number = order_data.get(
-                    'number', stored_order['phone_number'])
+                    'number', stored.phone_number or 'N/A')
                 phoneformat62 = phone_number.replace(
                     "62", "0") if phone_number.startswith("62") else phone_number
 
@@ -2002,121 +5067,15 @@ async def get_sms(query, context: ContextTypes.DEFAULT_TYPE, order_id: str) -> N
                         if price in ["N/A"] and service_info['price'] != "N/A":
                             price = service_info['price']
 
-                # Build message based on status
-                if order_status in ['CANCEL', 'REFUND']:
-                    cancel_reason = "Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses"
-                    message = f"📱 Order {service_name} {status_emoji}\n"
-                    message += f"🆔 Order ID: {order_id}\n"
-                    message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                    message += f"💵 Harga: {price}\n"
-                    message += f"📊 Status: {order_status}\n"
-                    message += f"🚫 {cancel_reason}\n"
-                    message += f"🕒 Dipesan pada: {order_time}\n"
-                    message += f"🔄 Final Update: {datetime.now().strftime('%H:%M:%S')}"
-                    reply_markup = None
-
-                elif order_status == 'SUCCESS':
-                    if sms_data:
-                        message = f"📱 SMS Order {service_name} {status_emoji}\n"
-                        message += f"🆔 Order ID: {order_id}\n"
-                        message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                        message += f"💵 Harga: {price}\n"
-                        message += f"📊 Status: {order_status}\n"
-                        message += f"📧 Total SMS: {len(sms_data)}\n"
-                        message += f"🕒 Dipesan pada: {order_time}\n\n"
-
-                        for i, sms in enumerate(sms_data, 1):
-                            sms_text = sms.get(
-                                'sms', sms.get('fullSms', 'No text'))
-                            full_sms = sms.get('fullSms', sms_text)
-
-                            if sms_text:
-                                sms_text = sms_text.strip()
-                            if full_sms:
-                                full_sms = full_sms.strip()
-
-                            message += f"📧 SMS #{i}: <code>{sms_text}</code>\n"
-                            if full_sms and full_sms != sms_text and len(full_sms) > len(sms_text):
-                                message += f"📄 Full SMS: <code>{full_sms}</code>\n"
-                            message += "\n"
-                    else:
-                        message = f"📱 Order {service_name} {status_emoji}\n"
-                        message += f"🆔 Order ID: {order_id}\n"
-                        message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                        message += f"💵 Harga: {price}\n"
-                        message += f"📊 Status: {order_status}\n"
-                        message += f"✅ Order berhasil diselesaikan\n"
-                        message += f"🕒 Dipesan pada: {order_time}"
-
-                    # Success order buttons
-                    action_buttons = [
-                        [InlineKeyboardButton(
-                            "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")],
-                        [
-                            InlineKeyboardButton(
-                                "🔄 Resend", callback_data=f"resend_order_{order_id}"),
-                            InlineKeyboardButton(
-                                "📱 Get SMS", callback_data=f"get_sms_{order_id}")
-                        ]
-                    ]
-                    if service_id != "N/A":
-                        action_buttons.append([InlineKeyboardButton(
-                            f"🔄 Order Again", callback_data=f"order_service_{service_id}")])
-                    reply_markup = InlineKeyboardMarkup(action_buttons)
-
-                else:
-                    # Pending orders
-                    if not sms_data:
-                        message = f"📱 Status Order {service_name} {status_emoji}\n"
-                        message += f"🆔 Order ID: {order_id}\n"
-                        message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                        message += f"💵 Harga: {price}\n"
-                        message += f"📊 Status: {order_status}\n"
-                        message += f"📧 Menunggu SMS...\n"
-                        message += f"🕒 Dipesan pada: {order_time}"
-                    else:
-                        message = f"📱 SMS Order {service_name} {status_emoji}\n"
-                        message += f"🆔 Order ID: {order_id}\n"
-                        message += f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
-                        message += f"💵 Harga: {price}\n"
-                        message += f"📊 Status: {order_status}\n"
-                        message += f"📧 Total SMS: {len(sms_data)}\n"
-                        message += f"🕒 Dipesan pada: {order_time}\n\n"
-
-                        for i, sms in enumerate(sms_data, 1):
-                            sms_text = sms.get(
-                                'sms', sms.get('fullSms', 'No text'))
-                            full_sms = sms.get('fullSms', sms_text)
-
-                            if sms_text:
-                                sms_text = sms_text.strip()
-                            if full_sms:
-                                full_sms = full_sms.strip()
-
-                            message += f"📧 SMS #{i}: <code>{sms_text}</code>\n"
-                            if full_sms and full_sms != sms_text and len(full_sms) > len(sms_text):
-                                message += f"📄 Full SMS: <code>{full_sms}</code>\n"
-                            message += "\n"
-
-                    # Pending order buttons
-                    action_buttons = [
-                        [
-                            InlineKeyboardButton(
-                                "❌ Batalkan OTP", callback_data=f"cancel_order_{order_id}"),
-                            InlineKeyboardButton(
-                                "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
-                        ],
-                        [
-                            InlineKeyboardButton(
-                                "🔄 Resend", callback_data=f"resend_order_{order_id}"),
-                            InlineKeyboardButton(
-                                "📱 Get SMS", callback_data=f"get_sms_{order_id}")
-                        ]
-                    ]
-                    if service_id != "N/A":
-                        action_buttons.append([InlineKeyboardButton(
-                            f"🔄 Order Again", callback_data=f"order_service_{service_id}")])
-                    reply_markup = InlineKeyboardMarkup(action_buttons)
+                # Render through the shared order templates
+                message = render_order_view(
+                    order_view_state(order_status, sms_data), 'manual', order_id, service_name,
+                    order_status, phone_number, phoneformat62, price, order_time, sms_data=sms_data,
+                    reason="Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses",
+                    stamp=datetime.now().strftime('%H:%M:%S')
+                )
+                reply_markup = order_keyboard(
+                    order_keyboard_kind(order_status), order_id, service_id)
 
                 # Edit the message
                 try:
@@ -2146,24 +5105,13 @@ async def cancel_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
     """Enhanced async cancel order function"""
     user_id = str(query.from_user.id)
 
+    if order_lifecycle.is_closed(order_id):
+        await query.answer("ℹ️ Pesanan ini sudah selesai atau dibatalkan.", show_alert=True)
+        return
+
     # Stop all monitoring and timers for this order
-    if order_id in active_order_monitors:
-        monitor_info = active_order_monitors[order_id]
-        if isinstance(monitor_info, dict) and 'task' in monitor_info:
-            monitor_info['task'].cancel()
-        del active_order_monitors[order_id]
-
-    if order_id in pending_cancellations:
-        pending_task = pending_cancellations[order_id]
-        if isinstance(pending_task, dict) and 'task' in pending_task:
-            pending_task['task'].cancel()
-        del pending_cancellations[order_id]
-
-    if order_id in auto_cancel_timers:
-        auto_task = auto_cancel_timers[order_id]
-        if isinstance(auto_task, dict) and 'task' in auto_task:
-            auto_task['task'].cancel()
-        del auto_cancel_timers[order_id]
+    order_lifecycle.stop(order_id)
+    order_events.emit('cancel_requested', order_id, reason='user')
 
     # Extract order info
     original_message = query.message
@@ -2184,45 +5132,36 @@ async def cancel_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
     elif "✅ Terdaftar" in original_message.text:
         cancel_reason = "Nomor sudah terdaftar pada e-wallet"
 
-    # Calculate delay
+    # Same hold rule as every other cancellation: CANCEL_MIN_HOLD counted from placement
     current_time = datetime.now()
-    delay_seconds = 120
-    should_cancel_immediately = False
-
-    if order_time != "N/A":
-        try:
-            order_datetime = datetime.strptime(order_time, '%Y-%m-%d %H:%M:%S')
-            time_since_order = current_time - order_datetime
-            if time_since_order.total_seconds() >= 130:
-                should_cancel_immediately = True
-                delay_seconds = 5
-        except:
-            pass
+    if order_placed_at(order_id) is not None:
+        delay_seconds = min_hold_delay(order_id)
+    else:
+        delay_seconds = CANCEL_MIN_HOLD
+        if order_time != "N/A":
+            try:
+                placed_at = datetime.strptime(order_time, '%Y-%m-%d %H:%M:%S').timestamp()
+                delay_seconds = max(0, int(placed_at + CANCEL_MIN_HOLD - time.time()))
+            except ValueError:
+                pass
+    should_cancel_immediately = delay_seconds <= 0
+    if should_cancel_immediately:
+        delay_seconds = 5
 
     # Create immediate message
     if should_cancel_immediately:
-        immediate_message = (
-            f"⚡ Membatalkan pesanan {service_name}...\n"
-            f"🆔 Order ID: {order_id}\n"
-            f"📞 Nomor: {phone_number}\n"
-            f"🚫 Alasan: {cancel_reason}\n"
-            f"🕒 Dipesan pada: {order_time}\n"
-            f"⏰ Order sudah lebih dari 2 menit, dibatalkan langsung\n"
-            f"🔄 Status: Memproses pembatalan..."
-        )
+        immediate_message = render_notice(
+            'cancelling_now', service_name=service_name, order_id=order_id,
+            phone_number=phone_number, reason=cancel_reason, order_time=order_time,
+            hold=format_wait(CANCEL_MIN_HOLD))
     else:
         from datetime import timedelta
         cancel_time = (
             current_time + timedelta(seconds=delay_seconds)).strftime('%H:%M:%S')
-        immediate_message = (
-            f"⏳ Proses pembatalan pesanan {service_name}\n"
-            f"🆔 Order ID: {order_id}\n"
-            f"📞 Nomor: {phone_number}\n"
-            f"🚫 Alasan: {cancel_reason}\n"
-            f"🕒 Dipesan pada: {order_time}\n"
-            f"⏰ Akan dibatalkan pada: {cancel_time}\n"
-            f"🔄 Status: Menunggu konfirmasi API..."
-        )
+        immediate_message = render_notice(
+            'cancelling_later', service_name=service_name, order_id=order_id,
+            phone_number=phone_number, reason=cancel_reason, order_time=order_time,
+            cancel_time=cancel_time)
 
     # Edit message immediately
     try:
@@ -2243,14 +5182,137 @@ async def cancel_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
     )
 
     if should_cancel_immediately:
-        await query.answer("⚡ Order sudah lebih dari 2 menit, dibatalkan langsung!", show_alert=True)
+        await query.answer(
+            f"⚡ Order sudah lebih dari {format_wait(CANCEL_MIN_HOLD)}, dibatalkan langsung!", show_alert=True)
     else:
-        await query.answer("⏳ Pembatalan akan diproses dalam 2 menit...", show_alert=True)
+        await query.answer(
+            f"⏳ Pembatalan akan diproses dalam {format_wait(delay_seconds)}...", show_alert=True)
 
     logger.info(
         f"User {user_id} requested manual cancellation for order {order_id}")
 
 
+def save_completion(user_id: str, order_id, service_name: str, phone_number: str, price: str,
+                    completion_type: str = "manual_finish", service_id: str = None) -> None:
+    """Record a finished order in the completions table of the order archive"""
+    try:
+        order_archive.add_completions([(time.time(), user_id, str(order_id), service_id, service_name,
+                                        phone_number, str(price), completion_type)])
+        logger.info(f"Saved completed order {order_id} ({service_name})")
+    except Exception as save_error:
+        logger.error(
+            f"Failed to save completed order {order_id}: {str(save_error)}")
+
+
+# Legacy per-service completion files ({service}selesai.txt)
+
+COMPLETION_FILE_HEADER = "timestamp,user_id,order_id,service_name,phone_number,price,completion_type"
+
+
+def completion_filename(service_name: str) -> str:
+    """The per-service file name older versions appended completions to"""
+    clean_service_name = "".join(
+        c for c in service_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return f"{clean_service_name.replace(' ', '_')}selesai.txt"
+
+
+def import_legacy_completions() -> int:
+    """
+    Move rows of existing *selesai.txt files into the completions table once, then
+    rename each file to *.imported so the next start skips it
+    """
+    imported = 0
+    for path in glob.glob("*selesai.txt"):
+        rows = []
+        try:
+            with open(path, "r", encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if not line or line == COMPLETION_FILE_HEADER:
+                        continue
+                    # service_name was written unquoted and may contain commas
+                    head = line.split(",", 3)
+                    tail = head[-1].rsplit(",", 3) if len(head) == 4 else []
+                    if len(tail) != 4:
+                        continue
+                    timestamp, user_id, order_id = head[:3]
+                    service_name, phone_number, price, completion_type = tail
+                    try:
+                        completed_at = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').timestamp()
+                    except ValueError:
+                        continue
+                    rows.append((completed_at, user_id, order_id, None, service_name,
+                                 phone_number, price, completion_type))
+            imported += order_archive.add_completions(rows, replace=False)
+            os.replace(path, f"{path}.imported")
+        except Exception as e:
+            logger.error(f"Failed to import completions from {path}: {str(e)}")
+    if imported:
+        logger.info(f"Imported {imported} completions from legacy selesai files")
+    return imported
+
+
+def write_completion_file(rows, path: str) -> int:
+    """Write completion rows to path in the legacy selesai format; returns the row count"""
+    count = 0
+    with open(path, "w", encoding='utf-8') as f:
+        f.write(COMPLETION_FILE_HEADER + "\n")
+        for completed_at, user_id, order_id, _, service_name, phone_number, price, completion_type in rows:
+            timestamp = datetime.fromtimestamp(completed_at).strftime('%Y-%m-%d %H:%M:%S')
+            f.write(f"{timestamp},{user_id},{order_id},{service_name},{phone_number},{price},{completion_type}\n")
+            count += 1
+    return count
+
+
+async def completion_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin command: /selesai <service_id|service name> [from YYYY-MM-DD] [to YYYY-MM-DD]"""
+    user_id = str(update.effective_user.id)
+    if not await check_authorized(update, context):
+        return
+
+    if not auth_store.is_admin(user_id):
+        await update.message.reply_text("🚫 Sorry, only admins can download completion files! 😊")
+        logger.warning(f"Non-admin user {user_id} attempted to download completion files")
+        return
+
+    args = list(context.args or [])
+    dates = []
+    try:
+        while args and len(dates) < 2 and args[-1][:1].isdigit() and "-" in args[-1]:
+            dates.insert(0, datetime.strptime(args.pop(), '%Y-%m-%d').timestamp())
+    except ValueError:
+        args = []
+    service = " ".join(args)
+    if not service:
+        await update.message.reply_text(
+            "📄 Usage: /selesai <service_id|nama layanan> [dari YYYY-MM-DD] [sampai YYYY-MM-DD]\n"
+            "Example: /selesai 123 2024-01-01 2024-01-31")
+        return
+
+    since = dates[0] if dates else None
+    until = dates[1] + 86400 if len(dates) == 2 else None
+    service_id = service if service.isdigit() else None
+    service_name = get_service_name(service) if service_id else service
+    if service_id and service_name == "Unknown Service":
+        service_name = None  # Unlisted id: the placeholder name would match unrelated completions
+    handle = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+    handle.close()
+    try:
+        count = await asyncio.to_thread(
+            write_completion_file, order_archive.iter_completions(service_id, service_name, since, until), handle.name)
+        if not count:
+            await update.message.reply_text(f"📄 Tidak ada pesanan selesai untuk {service}.")
+            return
+        with open(handle.name, "rb") as f:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id, document=f,
+                filename=completion_filename(service_name if service_name != "Unknown Service" else service),
+                caption=f"📄 {count} pesanan selesai - {service_name}")
+    finally:
+        os.remove(handle.name)
+    logger.info(f"Admin {user_id} downloaded {count} completions for {service}")
+
+
 async def finish_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str) -> None:
     """Enhanced async finish order function"""
     user_id = str(query.from_user.id)
@@ -2258,8 +5320,13 @@ async def finish_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
     headers = {"X-Api-Key": API_KEY}
 
     try:
-        # Use enhanced async client
-        status_code, data = await http_client.patch(url, headers=headers)
+        # Serialized with timers and bulk actions so the order is finished at most once
+        outcome = await order_lifecycle.transition(
+            order_id, 'SUCCESS', lambda: http_client.patch(url, headers=headers))
+        if outcome is None:
+            await query.answer("ℹ️ Pesanan ini sudah selesai atau dibatalkan.", show_alert=True)
+            return
+        status_code, data = outcome
 
         if status_code != 200:
             await query.answer(f"❌ HTTP Error {status_code}", show_alert=True)
@@ -2273,29 +5340,13 @@ async def finish_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
         await query.answer(f"❌ Error: {str(e)}", show_alert=True)
         return
 
-    # Stop all monitoring and timers
-    tasks_to_cancel = [
-        (active_order_monitors, "monitoring"),
-        (pending_cancellations, "pending cancellation"),
-        (auto_cancel_timers, "auto-cancel timer"),
-        (user_cancel_requests, "user cancel request")
-    ]
-
-    for task_dict, task_name in tasks_to_cancel:
-        if order_id in task_dict:
-            task_info = task_dict[order_id]
-            if isinstance(task_info, dict) and 'task' in task_info:
-                task_info['task'].cancel()
-            del task_dict[order_id]
-            logger.info(f"Cancelled {task_name} for order {order_id}")
-
     # Get order information
-    stored_order = get_order_info(order_id)
-    service_name = stored_order.get('service_name', 'Unknown Service')
-    phone_number = stored_order.get('phone_number', 'N/A')
-    order_time = stored_order.get('order_time', 'N/A')
-    price = stored_order.get('price', 'N/A')
-    service_id = stored_order.get('service_id', 'N/A')
+    stored = get_order_info(order_id)
+    service_name = stored.service_name or 'Unknown Service'
+    phone_number = stored.phone_number or 'N/A'
+    order_time = stored.order_time
+    price = stored.price if stored.price is not None else 'N/A'
+    service_id = stored.service_id or 'N/A'
 
     # Use message extraction as fallback
     if service_name == 'Unknown Service' or phone_number == 'N/A' or order_time == 'N/A':
@@ -2340,38 +5391,14 @@ async def finish_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
     else:
         phone_display = "N/A"
 
-    # Save to completion file
-    try:
-        clean_service_name = "".join(
-            c for c in service_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        clean_service_name = clean_service_name.replace(' ', '_')
-        filename = f"{clean_service_name}selesai.txt"
-
-        if not os.path.exists(filename):
-            with open(filename, "w", encoding='utf-8') as f:
-                f.write(
-                    "timestamp,user_id,order_id,service_name,phone_number,price,completion_type\n")
-
-        with open(filename, "a", encoding='utf-8') as f:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            completion_entry = f"{timestamp},{user_id},{order_id},{service_name},{phone_number},{price},manual_finish\n"
-            f.write(completion_entry)
-
-        logger.info(f"Saved completed order {order_id} to {filename}")
-    except Exception as save_error:
-        logger.error(
-            f"Failed to save completed order {order_id}: {str(save_error)}")
+    save_completion(user_id, order_id, service_name, phone_number, price,
+                    service_id=service_id if service_id != 'N/A' else None)
 
     # Create completion message
-    completion_message = (
-        f"✅ Pesanan selesai - {service_name}\n"
-        f"🆔 Order ID: {order_id}\n"
-        f"📞 Nomor: {phone_display}\n"
-        f"💵 Harga: {price}\n"
-        f"🕒 Dipesan pada: {order_time}\n"
-        f"✅ Diselesaikan pada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        f"🎉 Status: Berhasil diselesaikan manual"
-    )
+    completion_message = render_notice(
+        'finished', service_name=service_name, order_id=order_id,
+        phone_display=phone_display, price=price, order_time=order_time,
+        stamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
     # Edit the message
     try:
@@ -2402,6 +5429,7 @@ async def resend_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
 
         if status_code == 200 and data:
             if data.get('status'):
+                order_events.emit('resend', order_id, user_id=user_id)
                 # Extract info from original message
                 original_message = query.message
                 service_info = extract_service_info_from_message(
@@ -2412,16 +5440,10 @@ async def resend_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
                 order_time = service_info['order_time']
 
                 # Create resend message
-                resend_message = (
-                    f"🔄 Resend Order {service_name}\n"
-                    f"🆔 Order ID: {order_id}\n"
-                    f"📞 Nomor: {phone_number}\n"
-                    f"💵 Harga: {price}\n"
-                    f"📊 Status: Resend berhasil\n"
-                    f"🕒 Dipesan pada: {order_time}\n"
-                    f"🔄 Resend pada: {datetime.now().strftime('%H:%M:%S')}\n"
-                    f"⏳ Menunggu SMS..."
-                )
+                resend_message = render_notice(
+                    'resend', service_name=service_name, order_id=order_id,
+                    phone_number=phone_number, price=price, order_time=order_time,
+                    stamp=datetime.now().strftime('%H:%M:%S'))
 
                 # Recreate action buttons
                 service_id = "N/A"
@@ -2429,26 +5451,7 @@ async def resend_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
                     if 'order_service_' in str(query.data):
                         service_id = str(query.data).split('_')[-1]
 
-                action_buttons = [
-                    [
-                        InlineKeyboardButton(
-                            "❌ Batalkan OTP", callback_data=f"cancel_order_{order_id}"),
-                        InlineKeyboardButton(
-                            "✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            "🔄 Resend", callback_data=f"resend_order_{order_id}"),
-                        InlineKeyboardButton(
-                            "📱 Get SMS", callback_data=f"get_sms_{order_id}")
-                    ]
-                ]
-
-                if service_id != "N/A":
-                    action_buttons.append([InlineKeyboardButton(
-                        f"🔄 Order Again", callback_data=f"order_service_{service_id}")])
-
-                reply_markup = InlineKeyboardMarkup(action_buttons)
+                reply_markup = order_keyboard('pending', order_id, service_id)
 
                 # Edit the message
                 try:
@@ -2479,6 +5482,176 @@ async def resend_order(query, context: ContextTypes.DEFAULT_TYPE, order_id: str)
 
     logger.info(f"User {user_id} requested resend for order {order_id}")
 
+# Table-driven callback router
+
+
+class CallbackAction(NamedTuple):
+    """callback_data parsed once: route key plus optional trailing argument"""
+    route: str
+    arg: str
+    raw: str
+
+
+class CallbackRouter:
+    """
+    Dispatch callback queries through dicts of routes. Exact keys ("balance") are
+    matched first, then "<prefix>_<arg>" keys by splitting on the last underscore,
+    so dispatch is at most two dict lookups no matter how many buttons exist.
+    """
+
+    def __init__(self):
+        self.exact = {}  # {callback_data: (handler, admin_only)}
+        self.prefixed = {}  # {prefix: (handler, admin_only)}
+        self.stats = {}  # {route: {'calls', 'errors', 'total_ms', 'max_ms'}}
+
+    def add(self, route: str, handler, prefix: bool = False, admin_only: bool = False):
+        """Register handler(query, context) or, for prefix routes, handler(query, context, arg)"""
+        table = self.prefixed if prefix else self.exact
+        table[route] = (handler, admin_only)
+        self.stats[f"{route}_*" if prefix else route] = {
+            'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+    def parse(self, data: str):
+        """Parse callback_data into a CallbackAction, None if no route matches"""
+        if not data:
+            return None
+        if data in self.exact:
+            return CallbackAction(data, "", data)
+        route, _, arg = data.rpartition("_")
+        if arg and route in self.prefixed:
+            return CallbackAction(route, arg, data)
+        return None
+
+    async def dispatch(self, query, context: ContextTypes.DEFAULT_TYPE, user_id: str) -> bool:
+        """Run the handler for query.data, returns False when nothing handled it"""
+        action = self.parse(query.data)
+        if action is None:
+            return False
+        if action.raw in self.exact:
+            handler, admin_only = self.exact[action.route]
+            stats = self.stats[action.route]
+        else:
+            handler, admin_only = self.prefixed[action.route]
+            stats = self.stats[f"{action.route}_*"]
+        if admin_only and not auth_store.is_admin(user_id):
+            return False
+
+        started = time.perf_counter()
+        try:
+            if action.arg:
+                await handler(query, context, action.arg)
+            else:
+                await handler(query, context)
+        except Exception:
+            stats['errors'] += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats['calls'] += 1
+            stats['total_ms'] += elapsed_ms
+            if elapsed_ms > stats['max_ms']:
+                stats['max_ms'] = elapsed_ms
+        return True
+
+    def snapshot(self) -> dict:
+        """Per-route call counts, error counts and latency for the status endpoint"""
+        return {
+            route: {
+                'calls': st['calls'],
+                'errors': st['errors'],
+                'avg_ms': round(st['total_ms'] / st['calls'], 2) if st['calls'] else 0.0,
+                'max_ms': round(st['max_ms'], 2)
+            }
+            for route, st in self.stats.items() if st['calls']
+        }
+
+
+callback_router = CallbackRouter()
+
+
+async def ask_service_price(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    waiting_for_service_id[str(query.from_user.id)] = True
+    await query.message.reply_text("🔍 Please send the service ID to check its price (e.g., 399):")
+
+
+async def admin_tools_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    admin_keyboard = [
+        [InlineKeyboardButton("🔐 Add User", callback_data="add_user")],
+        [InlineKeyboardButton(
+            "🗑️ Delete User", callback_data="delete_user")],
+        [InlineKeyboardButton(
+            "➕ Add Service", callback_data="add_service")],
+        [InlineKeyboardButton("➖ Delete Service",
+                              callback_data="delete_service")]
+    ]
+    reply_markup = InlineKeyboardMarkup(admin_keyboard)
+    await query.message.reply_text("🔧 Admin Tools:", reply_markup=reply_markup)
+
+
+async def add_user_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    waiting_for_user_id[str(query.from_user.id)] = 'add'
+    await query.message.reply_text("🔐 Please send the User ID you want to add:")
+
+
+async def add_service_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    waiting_for_service_input[str(query.from_user.id)] = 'add'
+    await query.message.reply_text("➕ Please send the service ID and name in format: <service_id> <service_name>")
+
+
+async def delete_user_callback(query, context: ContextTypes.DEFAULT_TYPE, target_id: str) -> None:
+    if delete_user(target_id):
+        await query.message.reply_text(f"✅ User {target_id} has been removed!")
+        logger.info(f"Admin {query.from_user.id} removed user {target_id}")
+    else:
+        await query.message.reply_text(f"❌ User {target_id} is not authorized!")
+
+
+async def delete_service_callback(query, context: ContextTypes.DEFAULT_TYPE, service_id: str) -> None:
+    delete_service_from_txt(service_id)
+    await query.message.reply_text(f"✅ Service {service_id} has been removed!")
+    logger.info(f"Admin {query.from_user.id} removed service {service_id}")
+
+
+def _list_page_route(list_type: str):
+    async def handler(query, context: ContextTypes.DEFAULT_TYPE, page: str) -> None:
+        if page.isdigit():
+            await show_list(query, context, list_type, int(page))
+    return handler
+
+
+callback_router.add("balance", balance_callback)
+callback_router.add("services", services_callback)
+callback_router.add("cekprice", ask_service_price)
+callback_router.add("check_price", ask_service_price)
+callback_router.add("order", order_callback)
+callback_router.add("active_orders", active_orders_callback)
+callback_router.add("order_service", place_order, prefix=True)
+callback_router.add("get_sms", get_sms, prefix=True)
+callback_router.add("cancel_order", cancel_order, prefix=True)
+callback_router.add("finish_order", finish_order, prefix=True)
+callback_router.add("resend_order", resend_order, prefix=True)
+callback_router.add("bulk_cancel", bulk_cancel_callback, prefix=True)
+callback_router.add("bulk_finish", bulk_finish_callback)
+callback_router.add("admin_tools", admin_tools_callback, admin_only=True)
+callback_router.add("add_user", add_user_callback, admin_only=True)
+callback_router.add("delete_user", lambda query, context: show_list(
+    query, context, 'user'), admin_only=True)
+callback_router.add("add_service", add_service_callback, admin_only=True)
+callback_router.add("delete_service", lambda query, context: show_list(
+    query, context, 'service'), admin_only=True)
+callback_router.add("delete_user", delete_user_callback,
+                    prefix=True, admin_only=True)
+callback_router.add("delete_service", delete_service_callback,
+                    prefix=True, admin_only=True)
+callback_router.add("prev_user", _list_page_route('user'),
+                    prefix=True, admin_only=True)
+callback_router.add("next_user", _list_page_route('user'),
+                    prefix=True, admin_only=True)
+callback_router.add("prev_service", _list_page_route('service'),
+                    prefix=True, admin_only=True)
+callback_router.add("next_service", _list_page_route('service'),
+                    prefix=True, admin_only=True)
+
 # Enhanced button callback handler
 
 
@@ -2488,138 +5661,39 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = str(query.from_user.id)
     log_user_id(user_id)
 
-    if user_id not in AUTHORIZED_IDS:
+    if not auth_store.is_authorized(user_id):
         await query.message.reply_text("🚫 Access denied! Please contact an admin to gain access. 😊")
         logger.warning(
             f"Unauthorized button access attempt by user ID: {user_id}")
         return
 
-    # Enhanced callback handling with better error handling
     try:
-        if query.data == "balance":
-            await balance_callback(query, context)
-        elif query.data == "services":
-            await services_callback(query, context)
-        elif query.data == "cekprice":
-            waiting_for_service_id[user_id] = True
-            await query.message.reply_text("🔍 Please send the service ID to check its price (e.g., 399):")
-        elif query.data == "order":
-            await order_callback(query, context)
-        elif query.data == "active_orders":
-            await active_orders_callback(query, context)
-        elif query.data.startswith("order_service_"):
-            service_id = query.data.split("_")[2]
-            await place_order(query, context, service_id)
-        elif query.data == "admin_tools" and user_id in ADMIN_IDS:
-            admin_keyboard = [
-                [InlineKeyboardButton("🔐 Add User", callback_data="add_user")],
-                [InlineKeyboardButton(
-                    "🗑️ Delete User", callback_data="delete_user")],
-                [InlineKeyboardButton(
-                    "➕ Add Service", callback_data="add_service")],
-                [InlineKeyboardButton("➖ Delete Service",
-                                      callback_data="delete_service")]
-            ]
-            reply_markup = InlineKeyboardMarkup(admin_keyboard)
-            await query.message.reply_text("🔧 Admin Tools:", reply_markup=reply_markup)
-        elif query.data == "add_user" and user_id in ADMIN_IDS:
-            waiting_for_user_id[user_id] = 'add'
-            await query.message.reply_text("🔐 Please send the User ID you want to add:")
-        elif query.data == "delete_user" and user_id in ADMIN_IDS:
-            await show_list(query, context, 'user')
-        elif query.data == "add_service" and user_id in ADMIN_IDS:
-            waiting_for_service_input[user_id] = 'add'
-            await query.message.reply_text("➕ Please send the service ID and name in format: <service_id> <service_name>")
-        elif query.data == "delete_service" and user_id in ADMIN_IDS:
-            await show_list(query, context, 'service')
-        elif query.data.startswith("get_sms_"):
-            order_id = query.data.split("_")[2]
-            await get_sms(query, context, order_id)
-        elif query.data.startswith("cancel_order_"):
-            order_id = query.data.split("_")[2]
-            await cancel_order(query, context, order_id)
-        elif query.data.startswith("finish_order_"):
-            order_id = query.data.split("_")[2]
-            await finish_order(query, context, order_id)
-        elif query.data.startswith("resend_order_"):
-            order_id = query.data.split("_")[2]
-            await resend_order(query, context, order_id)
-        # Add more callback handlers as needed...
-        else:
+        if not await callback_router.dispatch(query, context, user_id):
             await query.answer("❌ Unknown command", show_alert=True)
 
     except Exception as e:
         logger.error(f"Error in button callback for user {user_id}: {str(e)}")
         await query.answer("❌ An error occurred. Please try again.", show_alert=True)
 
-# Enhanced async check price
-
-
-async def check_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user_id = str(update.effective_user.id)
-    if not await check_authorized(update, context):
-        return
-
-    if not context.args:
-        await update.message.reply_text("🔍 Please provide a service ID: /cekprice <service_id>\nExample: /cekprice 399")
-        return
-
-    service_id = context.args[0]
-    if not service_id.isdigit():
-        await update.message.reply_text("❌ Please provide a valid numeric service ID!")
-        return
-
-    # Send loading message
-    loading_msg = await update.message.reply_text("⏳ Checking price...")
-
-    url = f"{BASE_URL}price/{service_id}/"
-    headers = {"X-Api-Key": API_KEY}
-
-    try:
-        status_code, data = await http_client.get(url, headers)
-
-        if status_code == 200 and data:
-            if data.get('status') and data.get('data'):
-                price_data = data['data']
-                message = f"💰 **Price Information for Service ID: {service_id}**\n\n"
-
-                for item in price_data:
-                    country_name = item.get('countryName', 'Unknown')
-                    country_id = item.get('country', 'N/A')
-                    available = item.get('available', 0)
-                    price_usd = item.get('priceUsd', 0)
-                    custom_prices = item.get('customPrice', [])
 
-                    message += f"🌍 **{country_name}** (ID: {country_id})\n"
-                    message += f"📱 Available: {available:,} numbers\n"
-                    message += f"💵 Standard Price: ${price_usd:.5f} USD\n"
+background_jobs = []  # Long-running tasks started after the application initializes
 
-                    if custom_prices:
-                        message += f"🎯 **Custom Prices:**\n"
-                        for i, custom_price in enumerate(custom_prices[:5], 1):
-                            if isinstance(custom_price, dict):
-                                custom_amount = custom_price.get(
-                                    'price', custom_price.get('amount', 'N/A'))
-                                custom_type = custom_price.get(
-                                    'type', custom_price.get('name', f'Option {i}'))
-                                message += f"   • {custom_type}: ${custom_amount:.5f} USD\n"
-                            else:
-                                message += f"   • Custom {i}: ${custom_price:.5f} USD\n"
-                    else:
-                        message += f"🎯 Custom Prices: Not available\n"
 
-                    message += f"\n" + "─" * 30 + "\n"
+async def start_background_jobs(application) -> None:
+    """post_init hook: start periodic jobs on the application's event loop"""
+    background_jobs.append(asyncio.create_task(price_snapshot.run()))
+    background_jobs.append(asyncio.create_task(order_reconciler.run(application)))
+    background_jobs.append(asyncio.create_task(order_events.run()))
+    background_jobs.append(asyncio.create_task(run_log_rotation()))
+    background_jobs.append(asyncio.create_task(registered_index.run()))
+    logger.info(f"⏱️ Started {len(background_jobs)} background jobs")
 
-                message += f"🕒 Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                await loading_msg.edit_text(message, parse_mode="Markdown")
-            else:
-                await loading_msg.edit_text(f"⚠️ Error: {data.get('message', 'No price data available')}")
-        else:
-            await loading_msg.edit_text(f"❌ HTTP Error {status_code}")
-    except Exception as e:
-        await loading_msg.edit_text(f"❌ Error: {str(e)}")
 
-    logger.info(f"User {user_id} checked price for service ID: {service_id}")
+async def stop_background_jobs(application) -> None:
+    """post_shutdown hook: cancel periodic jobs"""
+    for task in background_jobs:
+        task.cancel()
+    background_jobs.clear()
 
 
 async def main_async() -> None:
@@ -2627,27 +5701,54 @@ async def main_async() -> None:
     try:
         # Load order storage on startup
         load_order_storage()
+        archive_closed_orders()
+        import_legacy_completions()
+        log_segments.resume()
+        rotate_order_history()
         logger.info("📦 Order storage loaded successfully")
+        ewallet_cache.load()
+        registered_index.load()
+        price_tier_stats.load()
+        sms_latency_stats.load()
+        order_events.open()
+        if not order_analytics.load():
+            logger.info(f"📈 Rebuilt order analytics from {order_analytics.rebuild(order_events)} events")
 
         # Create the Application with enhanced settings
         application = (Application.builder()
                        .token(TELEGRAM_TOKEN)
-                       # Enable concurrent processing
-                       .concurrent_updates(True)
+                       # Concurrent processing with a global cap and per-user fairness
+                       .concurrent_updates(update_processor)
+                       # Attribute Bot API round-trips to the update being handled
+                       .request(TimedTelegramRequest(connection_pool_size=MAX_CONCURRENT_UPDATES))
+                       .post_init(start_background_jobs)
+                       .post_shutdown(stop_background_jobs)
                        .build())
 
-        # Add all handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("balance", balance))
-        application.add_handler(CommandHandler("services", services))
-        application.add_handler(CommandHandler("cekprice", check_price))
-        application.add_handler(CommandHandler("order", order))
-        application.add_handler(CommandHandler("active_orders", active_orders))
-        application.add_handler(CommandHandler("adduser", add_user))
-        application.add_handler(CommandHandler("admin", admin))
-        application.add_handler(CallbackQueryHandler(button_callback))
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, handle_text_message))
+        # Add all handlers, each wrapped in the timing middleware
+        handlers = [
+            CommandHandler("start", start),
+            CommandHandler("balance", balance),
+            CommandHandler("services", services),
+            CommandHandler("cekprice", check_price),
+            CommandHandler("order", order),
+            CommandHandler("active_orders", active_orders),
+            CommandHandler("adduser", add_user),
+            CommandHandler("admin", admin),
+            CommandHandler("setquota", set_quota),
+            CommandHandler("setrole", set_role),
+            CommandHandler("cekwallet", check_wallets),
+            CommandHandler("bulkorder", bulk_order),
+            CommandHandler("stats", show_stats),
+            CommandHandler("export", export_orders),
+            CommandHandler("selesai", completion_report),
+            CommandHandler("trace", trace_order),
+            CallbackQueryHandler(button_callback),
+            MessageHandler(filters.TEXT & ~filters.COMMAND,
+                           handle_text_message)
+        ]
+        for handler in handlers:
+            application.add_handler(instrument_handler(handler))
 
         logger.info("🎯 All handlers registered successfully")
 
@@ -2664,6 +5765,14 @@ async def main_async() -> None:
         raise
     finally:
         # Cleanup
+        ewallet_cache.save()
+        auth_store.flush()
+        registered_index.save()
+        price_tier_stats.save()
+        sms_latency_stats.save()
+        order_analytics.save()
+        order_archive.close()
+        order_events.close()
         await http_client.close()
         logger.info("🧹 Cleanup completed")
 
@@ -2694,6 +5803,8 @@ def main() -> None:
     except Exception as e:
         logger.error(f"❌ Bot error: {str(e)}")
         raise
+    finally:
+        log_listener.stop()  # Drain queued records before exit
 
 
 if __name__ == "__main__":
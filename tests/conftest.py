@@ -0,0 +1,29 @@
+"""
+Importing telefix_enhanced validates its environment, creates its data files in the
+working directory and starts the log listener thread. Give it placeholder credentials
+and a throwaway working directory so tests never touch the checkout.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("SMSVIRTUAL_API_KEY", "test-api-key")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("AUTHORIZED_IDS", "1")
+
+_cwd = os.getcwd()
+_workdir = tempfile.mkdtemp(prefix="telefix-tests-")
+os.chdir(_workdir)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    bot = sys.modules.get("telefix_enhanced")
+    if bot is not None:
+        bot.log_listener.stop()
+        bot.file_handler.close()
+    os.chdir(_cwd)
+    shutil.rmtree(_workdir, ignore_errors=True)
@@ -0,0 +1,167 @@
+"""
+Regression test for the shared order templates: render_order_view() and
+order_keyboard() must produce exactly what the per-view builders they replaced
+in auto_update_order_message (monitor) and the Get SMS handler (manual) did.
+
+Run with: pip install -r requirements-dev.txt && python -m pytest tests/
+"""
+import itertools
+
+import pytest
+
+# Skipped (and reported as such) without the bot's dependencies; see requirements-dev.txt
+pytest.importorskip("telegram", reason="bot dependencies not installed (pip install -r requirements-dev.txt)")
+pytest.importorskip("flask", reason="bot dependencies not installed (pip install -r requirements-dev.txt)")
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+import telefix_enhanced as bot  # noqa: E402
+
+STAMP = "03:04:05"
+STATUSES = ['PENDING', 'SUCCESS', 'CANCEL', 'REFUND', 'Unknown']
+SMS_CASES = [
+    [],
+    [{'sms': ' 123456 '}],
+    [{'sms': '111', 'fullSms': 'Your code is 111 '}, {'fullSms': 'abc'}],
+    [{'sms': 'x'}, {'sms': 'long text', 'fullSms': 'long'}],
+]
+SERVICE_IDS = ['17', 'N/A']
+
+
+def _sms_lines(sms_data, full_label, spaced):
+    message = ""
+    for i, sms in enumerate(sms_data, 1):
+        sms_text = sms.get('sms', sms.get('fullSms', 'No text'))
+        full_sms = sms.get('fullSms', sms_text)
+        if sms_text:
+            sms_text = sms_text.strip()
+        if full_sms:
+            full_sms = full_sms.strip()
+        message += f"📧 SMS #{i}: <code>{sms_text}</code>\n"
+        if full_sms and full_sms != sms_text and len(full_sms) > len(sms_text):
+            message += f"📄 {full_label}: <code>{full_sms}</code>\n"
+        if spaced:
+            message += "\n"
+    return message
+
+
+def _old_keyboard(order_status, order_id, service_id):
+    if order_status in ['CANCEL', 'REFUND']:
+        return None
+    if order_status == 'SUCCESS':
+        action_buttons = [
+            [InlineKeyboardButton("✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")],
+        ]
+    else:
+        action_buttons = [
+            [
+                InlineKeyboardButton("❌ Batalkan OTP", callback_data=f"cancel_order_{order_id}"),
+                InlineKeyboardButton("✅ Tandai Selesai", callback_data=f"finish_order_{order_id}")
+            ],
+        ]
+    action_buttons.append([
+        InlineKeyboardButton("🔄 Resend", callback_data=f"resend_order_{order_id}"),
+        InlineKeyboardButton("📱 Get SMS", callback_data=f"get_sms_{order_id}")
+    ])
+    if service_id != "N/A":
+        action_buttons.append([
+            InlineKeyboardButton(f"🔄 Order Again", callback_data=f"order_service_{service_id}")
+        ])
+    return InlineKeyboardMarkup(action_buttons)
+
+
+def _old_body(order_id, phone_number, phoneformat62, price, order_status):
+    return (f"🆔 Order ID: {order_id}\n"
+            f"📞 Nomor: <code>{phone_number}</code> | <code>{phoneformat62}</code>\n"
+            f"💵 Harga: {price}\n"
+            f"📊 Status: {order_status}\n")
+
+
+def old_monitor_message(order_status, sms_data, service_name, order_id,
+                        phone_number, phoneformat62, price, order_time):
+    """The auto_update_order_message builder before ORDER_TEMPLATES"""
+    status_emoji = bot.ORDER_STATUS_EMOJI.get(order_status, '⚪')
+    body = _old_body(order_id, phone_number, phoneformat62, price, order_status)
+    if order_status in ['CANCEL', 'REFUND']:
+        cancel_reason = "Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses"
+        return (f"📱 Status Order {service_name} {status_emoji}\n" + body +
+                f"🚫 {cancel_reason}\n"
+                f"📧 SMS tidak tersedia (order dibatalkan)\n"
+                f"🕒 Dipesan pada: {order_time}\n"
+                f"🔄 Final Update: {STAMP}")
+    if order_status == 'SUCCESS':
+        if sms_data:
+            return (f"📱 SMS Order {service_name} {status_emoji}\n" + body +
+                    f"📧 Total SMS: {len(sms_data)}\n"
+                    f"🕒 Dipesan pada: {order_time}\n"
+                    f"🔄 Final Update: {STAMP}\n\n" +
+                    _sms_lines(sms_data, "Full SMS", True))
+        return (f"📱 Order {service_name} {status_emoji}\n" + body +
+                f"✅ Order berhasil diselesaikan\n"
+                f"🕒 Dipesan pada: {order_time}\n"
+                f"🔄 Final Update: {STAMP}")
+    if sms_data:
+        return (f"📱 SMS Order {service_name} {status_emoji}\n" + body +
+                f"📧 Total SMS: {len(sms_data)}\n"
+                f"🕒 Dipesan pada: {order_time}\n"
+                f"🔄 Auto-Update: {STAMP}\n\n" +
+                _sms_lines(sms_data, "Full", False))
+    return (f"📱 Status Order {service_name} {status_emoji}\n" + body +
+            f"📧 Menunggu SMS...\n"
+            f"🕒 Dipesan pada: {order_time}\n"
+            f"🔄 Auto-Update: {STAMP}")
+
+
+def old_manual_message(order_status, sms_data, service_name, order_id,
+                       phone_number, phoneformat62, price, order_time):
+    """The Get SMS button builder before ORDER_TEMPLATES"""
+    status_emoji = bot.ORDER_STATUS_EMOJI.get(order_status, '⚪')
+    body = _old_body(order_id, phone_number, phoneformat62, price, order_status)
+    if order_status in ['CANCEL', 'REFUND']:
+        cancel_reason = "Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses"
+        return (f"📱 Order {service_name} {status_emoji}\n" + body +
+                f"🚫 {cancel_reason}\n"
+                f"🕒 Dipesan pada: {order_time}\n"
+                f"🔄 Final Update: {STAMP}")
+    if sms_data:
+        return (f"📱 SMS Order {service_name} {status_emoji}\n" + body +
+                f"📧 Total SMS: {len(sms_data)}\n"
+                f"🕒 Dipesan pada: {order_time}\n\n" +
+                _sms_lines(sms_data, "Full SMS", True))
+    if order_status == 'SUCCESS':
+        return (f"📱 Order {service_name} {status_emoji}\n" + body +
+                f"✅ Order berhasil diselesaikan\n"
+                f"🕒 Dipesan pada: {order_time}")
+    return (f"📱 Status Order {service_name} {status_emoji}\n" + body +
+            f"📧 Menunggu SMS...\n"
+            f"🕒 Dipesan pada: {order_time}")
+
+
+OLD_BUILDERS = {'monitor': old_monitor_message, 'manual': old_manual_message}
+
+
+@pytest.mark.parametrize("view", ['monitor', 'manual'])
+@pytest.mark.parametrize("order_status,sms_data,service_id",
+                         list(itertools.product(STATUSES, SMS_CASES, SERVICE_IDS)))
+def test_order_view_matches_old_builder(view, order_status, sms_data, service_id):
+    fields = ('DANA', '9901', '6281234', '081234', '$0.12000', '2025-01-01 00:00:00')
+    expected = OLD_BUILDERS[view](order_status, sms_data, *fields)
+
+    rendered = bot.render_order_view(
+        bot.order_view_state(order_status, sms_data), view, '9901', 'DANA', order_status,
+        '6281234', '081234', '$0.12000', '2025-01-01 00:00:00', sms_data=sms_data,
+        reason="Dibatalkan otomatis" if order_status == 'CANCEL' else "Refund diproses",
+        stamp=STAMP
+    )
+    assert rendered == expected
+
+
+@pytest.mark.parametrize("order_status,service_id",
+                         list(itertools.product(STATUSES, SERVICE_IDS)))
+def test_order_keyboard_matches_old_builder(order_status, service_id):
+    expected = _old_keyboard(order_status, '9901', service_id)
+    keyboard = bot.order_keyboard(bot.order_keyboard_kind(order_status), '9901', service_id)
+    if expected is None:
+        assert keyboard is None
+    else:
+        assert keyboard.to_dict() == expected.to_dict()